@@ -1,66 +1,227 @@
 #!/usr/bin/python3
+import bz2
+import getopt
+import json
 import os
+import re
+import struct
 import sys
-from subprocess import Popen
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+# the member index code is shared with the stub scanners in runqueries
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'runqueries'))
+import queries.memberindex as qmemberindex
 
 
 # is it worth it to have some sort of progress that shows the size
 # of the written file in the real code?
 
 
-GZIPMARKER = b'\x1f\x8b\x08\x00'
+GZIP_MAGIC = qmemberindex.GZIP_MAGIC
+# tell zlib to expect a gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+GZIP_TRAILER_SIZE = 8
+BZ2_MAGIC = qmemberindex.BZ2_MAGIC
+# a bz2 stream starts byte-aligned with the magic and block size, followed
+# by either the magic for the first block or the end of stream marker
+BZ2_STREAM_START = re.compile(rb'BZh[1-9](?:1AY&SY|\x17\x72\x45\x38\x50\x90)')
+BZ2_STREAM_START_LEN = 10
+# the end of stream marker is not byte aligned; it's followed by the
+# 32 bit combined crc and then padded out to the next byte
+BZ2_EOS_MAGIC = 0x177245385090
+BZ2_TRAILER_SIZE = 11
+INDEX_SUFFIX = qmemberindex.INDEX_SUFFIX
+# completed pieces of an output file are recorded in a file with
+# this name tacked onto the end, until the output file is done
+JOURNAL_SUFFIX = ".journal"
+READ_BLOCKSIZE = 1024 * 1024
+# don't let one read of compressed data turn into
+# more than this much decompressed data at once
+MAX_INFLATE_SIZE = 64 * 1024 * 1024
+# how much we read and write at a time when copying a segment
+COPY_BLOCKSIZE = 4 * 1024 * 1024
+# segments bigger than this are split up so that one huge input
+# file doesn't leave the rest of the workers idle
+MAX_PIECE_SIZE = 256 * 1024 * 1024
+DEFAULT_JOBS = 4
+# how much of the start and end of each member we keep around when verifying
+SAMPLE_SIZE = 1024
 
 
-def get_header_offset(filename):
-    with open(filename, "rb") as infile:
-        # skip the first byte
+def read_gzip_member(infile, offset, pending, output=None):
+    """decompress the gzip member starting at the given offset in the file just far
+    enough to find its end, where pending is whatever has already been read from
+    the file starting at that offset; return the member info and whatever
+    was read past the end of the member. if output is passed, it is called
+    with each piece of decompressed data"""
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    consumed = 0
+    usize = 0
+    data = pending
+    while not decompressor.eof:
+        if not data:
+            data = infile.read(READ_BLOCKSIZE)
+            if not data:
+                raise ValueError("truncated gzip member at offset {offset} in {fname}".format(
+                    offset=offset, fname=infile.name))
         try:
-            infile.seek(1, os.SEEK_SET)
-            max_offset = 1000000
-            buffer = infile.read(max_offset)
-        except IOError:
-            return None
-        buffer_offset = buffer.find(GZIPMARKER)
-        if buffer_offset >= 0:
-            # because we skipped the first byte, add that here
-            return buffer_offset + 1
-    return None
+            chunk = decompressor.decompress(data, MAX_INFLATE_SIZE)
+        except zlib.error as ex:
+            raise ValueError("bad gzip member at offset {offset} in {fname} ({err})".format(
+                offset=offset, fname=infile.name, err=ex)) from None
+        usize += len(chunk)
+        if output is not None:
+            output(chunk)
+        remaining = decompressor.unconsumed_tail + decompressor.unused_data
+        consumed += len(data) - len(remaining)
+        data = remaining
+    # the decompressor has already checked these, we just want to record them
+    trailer = os.pread(infile.fileno(), GZIP_TRAILER_SIZE,
+                       offset + consumed - GZIP_TRAILER_SIZE)
+    crc, isize = struct.unpack("<II", trailer)
+    if isize != usize % 2**32:
+        raise ValueError("bad size in gzip member at offset {offset} in {fname}".format(
+            offset=offset, fname=infile.name))
+    return {'offset': offset, 'csize': consumed, 'usize': usize, 'crc': crc}, data
 
 
-def get_footer_offset(filename):
+def walk_gzip_members(filename, output=None):
+    """read through a file of one or more concatenated gzip members,
+    returning a list of offset, compressed size, uncompressed size
+    and crc for each member; if output is passed, it is called with
+    each piece of decompressed data along the way"""
+    members = []
+    offset = 0
+    pending = b''
     with open(filename, "rb") as infile:
-        # empty files or files with only a footer will return None
-        # here (too short) and that's ok, we might as well fail out on them
-        # by now they should have already been moved out of the way
-        # by the previous job but, just in case...
-        max_offset = 100
-        try:
-            filesize = infile.seek(0, os.SEEK_END)
-            infile.seek(filesize - max_offset, os.SEEK_SET)
-            buffer = infile.read()
-        except IOError:
-            return None
-        buffer_offset = buffer.find(GZIPMARKER)
-        if buffer_offset >= 0:
-            return filesize - (len(buffer) - buffer_offset)
+        while True:
+            if len(pending) < len(GZIP_MAGIC):
+                pending += infile.read(READ_BLOCKSIZE)
+                if not pending:
+                    break
+            if not pending.startswith(GZIP_MAGIC):
+                raise ValueError("no gzip member found at offset {offset} in {fname}".format(
+                    offset=offset, fname=filename))
+            member, pending = read_gzip_member(infile, offset, pending, output)
+            members.append(member)
+            offset += member['csize']
+    return members
+
+
+def get_bz2_stream_crc(trailer):
+    """given the last bytes of what should be a bz2 stream, return the combined
+    crc of the stream if there is an end of stream marker in the right place,
+    or None if there is not"""
+    if len(trailer) < BZ2_TRAILER_SIZE:
+        return None
+    bits = int.from_bytes(trailer[-BZ2_TRAILER_SIZE:], 'big')
+    for padding in range(8):
+        value = bits >> padding
+        if (value >> 32) & 0xffffffffffff == BZ2_EOS_MAGIC:
+            return value & 0xffffffff
     return None
 
 
-def dump_file(filename, outfile, header_offset, footer_offset, outfile_size):
-    command = ['dd', 'if=' + filename, 'of=' + outfile,
-               'skip=' + str(header_offset),
-               'count=' + str(footer_offset - header_offset),
-               'iflag=skip_bytes,count_bytes',
-               'seek=' + str(outfile_size), 'oflag=seek_bytes']
-    print("running command", " ".join(command))
-    proc = Popen(command)
-    output, error = proc.communicate()
-    if output:
-        print("here is some output", output)
-    if error:
-        print("here is an error message", error)
-    if proc.returncode:
-        print("command returned with error code", proc.returncode)
+def walk_bz2_streams(filename):
+    """scan a file of one or more concatenated bz2 streams for the stream
+    boundaries without decompressing anything, returning a list of offset,
+    compressed size and stream crc for each stream; the uncompressed size
+    is not known"""
+    members = []
+    with open(filename, "rb") as infile:
+        filesize = infile.seek(0, os.SEEK_END)
+        infile.seek(0, os.SEEK_SET)
+        starts = []
+        offset = 0
+        # keep the end of the previous block around in case a stream start
+        # or a trailer spans two blocks
+        overlap = b''
+        while True:
+            data = infile.read(READ_BLOCKSIZE)
+            if not data:
+                break
+            buffer = overlap + data
+            buffer_offset = offset - len(overlap)
+            for match in BZ2_STREAM_START.finditer(buffer):
+                start = buffer_offset + match.start()
+                if starts and start <= starts[-1]:
+                    continue
+                if start == 0:
+                    starts.append(start)
+                    continue
+                if match.start() < BZ2_TRAILER_SIZE:
+                    trailer = os.pread(infile.fileno(), BZ2_TRAILER_SIZE,
+                                       start - BZ2_TRAILER_SIZE)
+                else:
+                    trailer = buffer[match.start() - BZ2_TRAILER_SIZE:match.start()]
+                # otherwise it's just something that looks like a stream
+                # start in the middle of compressed data
+                if get_bz2_stream_crc(trailer) is not None:
+                    starts.append(start)
+            offset += len(data)
+            overlap = buffer[-(BZ2_TRAILER_SIZE + BZ2_STREAM_START_LEN):]
+        if not starts or starts[0] != 0:
+            raise ValueError("no bz2 stream found at start of {fname}".format(fname=filename))
+        for start, end in zip(starts, starts[1:] + [filesize]):
+            trailer = os.pread(infile.fileno(), BZ2_TRAILER_SIZE, end - BZ2_TRAILER_SIZE)
+            crc = get_bz2_stream_crc(trailer)
+            if crc is None:
+                raise ValueError("truncated bz2 stream at offset {offset} in {fname}".format(
+                    offset=start, fname=filename))
+            members.append({'offset': start, 'csize': end - start, 'usize': None, 'crc': crc})
+    return members
+
+
+def get_file_format(filename):
+    """return 'gz' or 'bz2' depending on what kind of compressed file this is"""
+    file_format = qmemberindex.get_file_format(filename)
+    if file_format == 'plain':
+        raise ValueError("{fname} is neither a gzip nor a bz2 file".format(fname=filename))
+    return file_format
+
+
+def walk_members(filename):
+    """return the list of gzip members or bz2 streams that make up the file"""
+    if get_file_format(filename) == 'bz2':
+        return walk_bz2_streams(filename)
+    return walk_gzip_members(filename)
+
+
+get_index_path = qmemberindex.get_index_path
+read_member_index = qmemberindex.read_member_index
+write_member_index = qmemberindex.write_member_index
+
+
+def get_member_index(filename):
+    """return the member index for the file, from the sidecar file if
+    it's current, otherwise by reading through the file (and then
+    saving it in the sidecar file for next time)"""
+    members = read_member_index(filename)
+    if members is None:
+        members = walk_members(filename)
+        write_member_index(filename, members)
+    return members
+
+
+def get_header_offset(filename):
+    """return the offset of the second gzip member or bz2 stream
+    of the file, where the body starts"""
+    members = get_member_index(filename)
+    if len(members) < 2:
+        return None
+    return members[1]['offset']
+
+
+def get_footer_offset(filename):
+    """return the offset of the last gzip member or bz2 stream
+    of the file, where the footer starts"""
+    # files with only a footer will return None here and that's ok,
+    # we might as well fail out on them; by now they should have
+    # already been moved out of the way by the previous job but, just in case...
+    members = get_member_index(filename)
+    if len(members) < 2:
+        return None
+    return members[-1]['offset']
 
 
 def get_file_size(filename):
@@ -71,74 +232,558 @@ def get_file_size(filename):
     return filesize
 
 
-def filter_one_stubfile(filename, outfile):
-    header_offset = get_header_offset(filename)
-    footer_offset = get_footer_offset(filename)
-    outfile_size = get_file_size(outfile)
-    if not outfile_size:
-        # this is used to decide where to seek to when outfile is opened
-        outfile_size = 0
-    print("header offset:", header_offset, "footer_offset:", footer_offset,
-          "output file current size:", outfile_size)
-    dump_file(filename, outfile, header_offset, footer_offset, outfile_size)
-
-
-def write_header(filename, outfile):
-    header_offset = get_header_offset(filename)
-    print("header offset:", header_offset)
-    outfile_size = get_file_size(outfile)
-    if not outfile_size:
-        # this is used to decide where to seek to when outfile is opened
-        outfile_size = 0
-    dump_file(filename, outfile, 0, header_offset, outfile_size)
-
-
-def write_footer(filename, outfile):
-    footer_offset = get_footer_offset(filename)
-    infile_size = get_file_size(filename)
-    outfile_size = get_file_size(outfile)
-    if not outfile_size:
-        # this is used to decide where to seek to when outfile is opened
-        outfile_size = 0
-    print("footer_offset:", footer_offset,
-          "output file current size:", outfile_size)
-    dump_file(filename, outfile, footer_offset, infile_size, outfile_size)
-
-
-def rewrite_stubs(infiles, outfile):
+def get_offsets(filename):
+    """return header offset, footer offset, size and member index of the file"""
+    members = get_member_index(filename)
+    filesize = get_file_size(filename)
+    if len(members) < 2:
+        raise ValueError("failed to find header and footer offsets for {fname}".format(
+            fname=filename))
+    header_offset = members[1]['offset']
+    footer_offset = members[-1]['offset']
+    print("file:", filename, "header offset:", header_offset,
+          "footer_offset:", footer_offset, "size:", filesize, file=sys.stderr)
+    return {'header': header_offset, 'footer': footer_offset, 'size': filesize,
+            'members': members}
+
+
+def get_all_offsets(infiles, jobs):
+    """find the header and footer offsets of all input files at once,
+    return them in the same order as the input files"""
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(get_offsets, infiles))
+
+
+def get_members_in_range(members, start, end):
+    """return the members that lie in the given range of a file"""
+    return [member for member in members
+            if member['offset'] >= start and member['offset'] + member['csize'] <= end]
+
+
+def add_segment(segments, infile, start, end, members):
+    """add a segment from the input file to the end of the list of
+    segments for an output file, along with the members it contains,
+    return the new output file size"""
+    dest = 0
+    if segments:
+        dest = segments[-1]['dest'] + segments[-1]['end'] - segments[-1]['start']
+    segments.append({'infile': infile, 'start': start, 'end': end, 'dest': dest,
+                     'members': get_members_in_range(members, start, end)})
+    return dest + end - start
+
+
+def get_layout(infiles, offsets, outfile):
+    """given the input files and their offsets, figure out where each piece
+    of each input file goes; return a dict of output file names and for each,
+    the list of segments (input file, start, end, offset in output file)
+    that make it up, in order"""
+    layout = {}
     if len(infiles) == 1:
-        write_header(infiles[0], "header-" + outfile)
-        filter_one_stubfile(infiles[0], outfile)
-        write_footer(infiles[0], "footer-" + outfile)
+        members = offsets[0]['members']
+        layout["header-" + outfile] = []
+        add_segment(layout["header-" + outfile], infiles[0], 0, offsets[0]['header'], members)
+        layout[outfile] = []
+        add_segment(layout[outfile], infiles[0], offsets[0]['header'], offsets[0]['footer'],
+                    members)
+        layout["footer-" + outfile] = []
+        add_segment(layout["footer-" + outfile], infiles[0],
+                    offsets[0]['footer'], offsets[0]['size'], members)
     else:
-        write_header(infiles[0], outfile)
-        for infile in infiles:
-            filter_one_stubfile(infile, outfile)
-        write_footer(infiles[-1], outfile)
+        layout[outfile] = []
+        add_segment(layout[outfile], infiles[0], 0, offsets[0]['header'], offsets[0]['members'])
+        for infile, file_offsets in zip(infiles, offsets):
+            add_segment(layout[outfile], infile, file_offsets['header'], file_offsets['footer'],
+                        file_offsets['members'])
+        add_segment(layout[outfile], infiles[-1], offsets[-1]['footer'], offsets[-1]['size'],
+                    offsets[-1]['members'])
+    return layout
 
 
-def do_main():
-    filenames = sys.argv[1:]
-    if len(filenames) != 2:
-        message = """Usage: python3 offset_test.py infile,infile,... outfile
+def get_output_members(segments):
+    """return the member index for an output file made up of the given segments"""
+    members = []
+    for segment in segments:
+        for member in segment['members']:
+            member = dict(member)
+            member['offset'] += segment['dest'] - segment['start']
+            members.append(member)
+    return members
+
+
+def get_output_size(segments):
+    """return the size the output file will have once all
+    of its segments are written"""
+    if not segments:
+        return 0
+    return segments[-1]['dest'] + segments[-1]['end'] - segments[-1]['start']
+
+
+def preallocate(outfile, size, keep=0):
+    """create the output file at its final size, throwing away
+    anything that was in there before except for the first
+    keep bytes"""
+    flags = os.O_WRONLY | os.O_CREAT
+    if not keep:
+        flags |= os.O_TRUNC
+    fdesc = os.open(outfile, flags, 0o644)
+    try:
+        os.ftruncate(fdesc, keep)
+        if size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(fdesc, 0, size)
+            except OSError:
+                # some filesystems don't do this, we'll just let it grow
+                os.ftruncate(fdesc, size)
+        else:
+            os.ftruncate(fdesc, size)
+    finally:
+        os.close(fdesc)
+
+
+def split_segments(outfile, segments):
+    """split the segments for an output file into pieces no larger
+    than MAX_PIECE_SIZE, so that they can be copied in parallel"""
+    pieces = []
+    for segment in segments:
+        start = segment['start']
+        while start < segment['end']:
+            end = min(start + MAX_PIECE_SIZE, segment['end'])
+            pieces.append({'outfile': outfile, 'infile': segment['infile'], 'start': start,
+                           'end': end, 'dest': segment['dest'] + start - segment['start']})
+            start = end
+    return pieces
+
+
+def copy_piece(piece):
+    """copy the given range of the input file to its place in
+    the output file with positional reads and writes, make sure
+    it's on disk, and return the piece with the checksum of
+    the data copied"""
+    crc = 0
+    in_fd = os.open(piece['infile'], os.O_RDONLY)
+    try:
+        out_fd = os.open(piece['outfile'], os.O_WRONLY)
+        try:
+            offset = piece['start']
+            dest = piece['dest']
+            while offset < piece['end']:
+                data = os.pread(in_fd, min(COPY_BLOCKSIZE, piece['end'] - offset), offset)
+                if not data:
+                    raise IOError("unexpected end of file {fname} at {offset}".format(
+                        fname=piece['infile'], offset=offset))
+                written = 0
+                while written < len(data):
+                    written += os.pwrite(out_fd, data[written:], dest + written)
+                crc = zlib.crc32(data, crc)
+                offset += len(data)
+                dest += len(data)
+            os.fsync(out_fd)
+        finally:
+            os.close(out_fd)
+    finally:
+        os.close(in_fd)
+    piece = dict(piece)
+    piece['crc'] = crc
+    return piece
+
+
+def get_range_crc(filename, start, end):
+    """return the checksum of the given range of the file"""
+    crc = 0
+    fdesc = os.open(filename, os.O_RDONLY)
+    try:
+        while start < end:
+            data = os.pread(fdesc, min(COPY_BLOCKSIZE, end - start), start)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+            start += len(data)
+    finally:
+        os.close(fdesc)
+    return crc
+
+
+def check_piece(piece):
+    """return the checksum of the part of the output file
+    where the piece was copied"""
+    return get_range_crc(piece['outfile'], piece['dest'],
+                         piece['dest'] + piece['end'] - piece['start'])
+
+
+def get_journal_path(outfile):
+    """return the path of the journal of completed pieces for the output file"""
+    return outfile + JOURNAL_SUFFIX
+
+
+def get_journal_header(outfile, segments):
+    """return a description of the output file and of the input files
+    that go into it, so that we don't resume from a journal written
+    for some other recombine"""
+    inputs = []
+    for segment in segments:
+        stat = os.stat(segment['infile'])
+        entry = [segment['infile'], stat.st_size, stat.st_mtime_ns]
+        if entry not in inputs:
+            inputs.append(entry)
+    return {'output': outfile, 'size': get_output_size(segments), 'inputs': inputs}
+
+
+def get_piece_key(piece):
+    """return a string that identifies a piece in the journal"""
+    return "{infile}:{start}:{end}:{dest}".format(
+        infile=piece['infile'], start=piece['start'], end=piece['end'], dest=piece['dest'])
+
+
+def read_journal(outfile, header):
+    """return the checksums of the pieces recorded as done in the
+    journal for the output file, or nothing if there is no journal
+    or it's from a recombine of some other files"""
+    entries = {}
+    try:
+        with open(get_journal_path(outfile), "r") as infile:
+            lines = infile.readlines()
+    except OSError:
+        return entries
+    try:
+        if not lines or json.loads(lines[0]) != header:
+            return entries
+        for line in lines[1:]:
+            entry = json.loads(line)
+            entries[get_piece_key(entry)] = entry['crc']
+    except ValueError:
+        # a partly written last line, everything before it is still good
+        pass
+    return entries
+
+
+def get_resume_point(outfile, pieces, entries, jobs):
+    """return the number of pieces at the start of the output file
+    that the journal says were done and that still have the right
+    checksum"""
+    journaled = []
+    for piece in pieces:
+        if get_piece_key(piece) not in entries:
+            break
+        journaled.append(piece)
+    if not journaled or get_file_size(outfile) is None:
+        return 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        crcs = list(executor.map(check_piece, journaled))
+    done = 0
+    for piece, crc in zip(journaled, crcs):
+        if crc != entries[get_piece_key(piece)]:
+            break
+        done += 1
+    return done
+
+
+def get_journal_entry(piece, crc):
+    """return the line recording a completed piece in the journal"""
+    return json.dumps({'infile': piece['infile'], 'start': piece['start'], 'end': piece['end'],
+                       'dest': piece['dest'], 'crc': crc}) + "\n"
+
+
+def journal_piece(journal, piece):
+    """record in the journal that the piece has been copied,
+    and make sure the record is on disk"""
+    journal.write(get_journal_entry(piece, piece['crc']))
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def start_journal(outfile, header, done_pieces, entries):
+    """open a new journal for the output file, recording the pieces
+    that are already done, and return it"""
+    journal = open(get_journal_path(outfile), "w")
+    journal.write(json.dumps(header) + "\n")
+    for piece in done_pieces:
+        journal.write(get_journal_entry(piece, entries[get_piece_key(piece)]))
+    journal.flush()
+    os.fsync(journal.fileno())
+    return journal
+
+
+def write_layout(layout, jobs):
+    """preallocate all output files and copy all segments into them at once,
+    picking up where a previous run left off if there's a journal for it"""
+    pieces = []
+    journals = {}
+    for outfile, segments in layout.items():
+        size = get_output_size(segments)
+        outfile_pieces = split_segments(outfile, segments)
+        header = get_journal_header(outfile, segments)
+        entries = read_journal(outfile, header)
+        done = get_resume_point(outfile, outfile_pieces, entries, jobs)
+        keep = 0
+        if done:
+            last = outfile_pieces[done - 1]
+            keep = last['dest'] + last['end'] - last['start']
+        print("output file:", outfile, "size:", size, "resuming at:", keep, file=sys.stderr)
+        preallocate(outfile, size, keep)
+        journals[outfile] = start_journal(outfile, header, outfile_pieces[:done], entries)
+        pieces.extend(outfile_pieces[done:])
+    copied = 0
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(copy_piece, piece) for piece in pieces]
+            for future in as_completed(futures):
+                piece = future.result()
+                journal_piece(journals[piece['outfile']], piece)
+                copied += piece['end'] - piece['start']
+    finally:
+        for journal in journals.values():
+            journal.close()
+    print("copied", copied, "bytes in", len(pieces), "pieces", file=sys.stderr)
+    # we already know where all the members are, save the next reader the trouble
+    for outfile, segments in layout.items():
+        write_member_index(outfile, get_output_members(segments))
+        os.unlink(get_journal_path(outfile))
+
+
+def get_decompressor(file_format):
+    """return a decompressor for a single gzip member or bz2 stream"""
+    if file_format == 'bz2':
+        return bz2.BZ2Decompressor()
+    return zlib.decompressobj(GZIP_WBITS)
+
+
+def inflate(decompressor, data):
+    """feed data to the decompressor, yielding the decompressed
+    data a piece at a time"""
+    try:
+        if isinstance(decompressor, bz2.BZ2Decompressor):
+            yield decompressor.decompress(data, MAX_INFLATE_SIZE)
+            while not decompressor.eof and not decompressor.needs_input:
+                yield decompressor.decompress(b'', MAX_INFLATE_SIZE)
+        else:
+            while data:
+                yield decompressor.decompress(data, MAX_INFLATE_SIZE)
+                data = decompressor.unconsumed_tail
+    except (OSError, EOFError, zlib.error) as ex:
+        raise ValueError("bad compressed data ({err})".format(err=ex)) from None
+
+
+def decompress_member(filename, file_format, offset, csize):
+    """decompress the gzip member or bz2 stream at the given offset and
+    of the given size in the file, yielding the decompressed data a piece
+    at a time; raise ValueError if it doesn't end exactly where it should"""
+    decompressor = get_decompressor(file_format)
+    fdesc = os.open(filename, os.O_RDONLY)
+    try:
+        position = offset
+        end = offset + csize
+        while position < end:
+            if decompressor.eof:
+                raise ValueError("member at offset {offset} in {fname} ends early".format(
+                    offset=offset, fname=filename))
+            data = os.pread(fdesc, min(READ_BLOCKSIZE, end - position), position)
+            if not data:
+                raise ValueError("unexpected end of file {fname} at {position}".format(
+                    fname=filename, position=position))
+            position += len(data)
+            yield from inflate(decompressor, data)
+        if not decompressor.eof:
+            raise ValueError("member at offset {offset} in {fname} is truncated".format(
+                offset=offset, fname=filename))
+        if decompressor.unused_data:
+            raise ValueError("member at offset {offset} in {fname} ends early".format(
+                offset=offset, fname=filename))
+    finally:
+        os.close(fdesc)
+
+
+def check_member(filename, file_format, offset, csize):
+    """decompress one member of the file, returning its uncompressed size,
+    its crc (crc32 of the contents for gzip members, the stream crc for
+    bz2 streams), the start and end of the contents, and any error"""
+    result = {'offset': offset, 'usize': 0, 'crc': 0, 'head': b'', 'tail': b'', 'error': None}
+    try:
+        for chunk in decompress_member(filename, file_format, offset, csize):
+            result['usize'] += len(chunk)
+            if file_format == 'gz':
+                result['crc'] = zlib.crc32(chunk, result['crc'])
+            if len(result['head']) < SAMPLE_SIZE:
+                result['head'] += chunk[:SAMPLE_SIZE - len(result['head'])]
+            result['tail'] = (result['tail'] + chunk)[-SAMPLE_SIZE:]
+    except ValueError as ex:
+        result['error'] = str(ex)
+        return result
+    if file_format == 'bz2':
+        # the decompressor has checked the stream crc, we just want its value
+        with open(filename, "rb") as infile:
+            result['crc'] = get_bz2_stream_crc(os.pread(
+                infile.fileno(), BZ2_TRAILER_SIZE, offset + csize - BZ2_TRAILER_SIZE))
+    return result
+
+
+def get_verify_problems(outfile, expected, result):
+    """compare what we found in a member of the output file with what
+    the input file says it should be, return a list of problems if any"""
+    problems = []
+    if result['error']:
+        problems.append(result['error'])
+    else:
+        if expected['usize'] is not None and result['usize'] != expected['usize']:
+            problems.append("expected uncompressed size {exp}, got {got}".format(
+                exp=expected['usize'], got=result['usize']))
+        if result['crc'] != expected['crc']:
+            problems.append("expected crc {exp}, got {got}".format(
+                exp=expected['crc'], got=result['crc']))
+    return ["{fname} at offset {offset}: {problem}".format(
+        fname=outfile, offset=expected['offset'], problem=problem) for problem in problems]
+
+
+def verify_layout(layout, jobs):
+    """decompress every member of every output file in parallel and check
+    each against the member of the input file it was copied from; check
+    also that the xml starts and ends the way it should. return True if
+    everything is fine, False otherwise"""
+    problems = []
+    tasks = []
+    for outfile, segments in layout.items():
+        members = get_output_members(segments)
+        size = get_file_size(outfile)
+        if size != get_output_size(segments):
+            problems.append("{fname}: expected size {exp}, got {got}".format(
+                fname=outfile, exp=get_output_size(segments), got=size))
+            continue
+        if sum(member['csize'] for member in members) != size:
+            problems.append("{fname}: members don't cover the whole file".format(
+                fname=outfile))
+            continue
+        file_format = get_file_format(outfile)
+        tasks.extend([(outfile, file_format, member) for member in members])
+    if problems:
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        return False
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(check_member, outfile, file_format,
+                                   member['offset'], member['csize'])
+                   for (outfile, file_format, member) in tasks]
+        results = [future.result() for future in futures]
+
+    for (outfile, _file_format, member), result in zip(tasks, results):
+        problems.extend(get_verify_problems(outfile, member, result))
+    if results and not results[0]['error']:
+        if not results[0]['head'].lstrip().startswith(b'<mediawiki'):
+            problems.append("{fname}: does not start with <mediawiki".format(
+                fname=tasks[0][0]))
+    if results and not results[-1]['error']:
+        if not results[-1]['tail'].rstrip().endswith(b'</mediawiki>'):
+            problems.append("{fname}: does not end with </mediawiki>".format(
+                fname=tasks[-1][0]))
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    print("verified", len(results), "members,", len(problems), "problems found",
+          file=sys.stderr)
+    return not problems
+
+
+def rewrite_stubs(infiles, outfile, jobs=DEFAULT_JOBS, verify=False, write=True):
+    """recombine the input files into the output file, optionally verifying
+    the result; if write is False, only verify the existing output file.
+    returns False if verification fails, True otherwise"""
+    if len(set(get_file_format(infile) for infile in infiles)) > 1:
+        raise ValueError("input files must be all gzip or all bz2 files")
+    offsets = get_all_offsets(infiles, jobs)
+    layout = get_layout(infiles, offsets, outfile)
+    if write:
+        write_layout(layout, jobs)
+    if verify:
+        return verify_layout(layout, jobs)
+    return True
+
+
+def usage(message=None):
+    if message is not None:
+        sys.stderr.write(message + "\n")
+    message = """Usage: python3 offset_test.py [--jobs <number>] [--verify|--verifyonly]
+                             infile,infile,... outfile
 This script writes the header from the first file, the body from all files in order,
 and then the footer from the last file, into the specified output file. This assumes
 that the input files all consist of three gzipped bits of content: header, body, footer.
+The body may be made up of several gzip members, but the header and footer must be
+one member each.
+
+Files made up of bz2 streams (a header stream, one or more body streams and a footer
+stream) are handled the same way; the stream boundaries are found by scanning the
+compressed data, and the body streams are copied as is, without being decompressed
+and compressed again.
+
+The gzip members of each input file are found by reading through the file once, and
+the results are saved in <file>{suffix} so that later runs on the same file can skip that
+step. The same is done for each output file.
 
 If only only one file is specified as an input file instead of a comma-separated list,
 the header and footer are stripped from it and the result written to the specified
 output file. Additionally the header will be written to header-<outfile> and the footer
 to footer-<outfile>.
 
+The offsets of all input files are found in parallel, the output file is preallocated
+and all pieces are copied into place in parallel.
+
+Each piece copied into an output file is recorded, with its checksum, in
+<outfile>{journal} as soon as it is on disk. If the script dies partway through,
+running it again with the same arguments checks the pieces recorded there, truncates
+the output file after the last good one, and copies only the rest. The journal is
+removed once the output file is complete.
+
+With --verify, every gzip member or bz2 stream of the output is decompressed afterwards,
+in parallel, and its size and crc are checked against the input file it came from; the
+xml must also start with <mediawiki and end with </mediawiki>. The script exits with
+an error if there are any problems.
+
+Arguments:
+  --jobs        (-j):   number of files to scan, pieces to copy or members to verify
+                        at the same time
+                        default: {jobs}
+  --verify      (-V):   verify the output files after writing them
+                        default: false
+  --verifyonly  (-o):   don't write anything, just verify existing output files
+                        against the input files
+                        default: false
+
 Example: python3 offset_test.py elwikt-20190108-stub-articles1.xml.gz,elwikt-20190108-stub-articles2.xml.gz,\\
 elwikt-20190108-stub-articles3.xml.gz,elwikt-20190108-stub-articles4.xml.gz  \\
 elwikt-20190108-stub-articles-all.xml.gz
 
-Example with one input file: python3 offset_test.py fullstubfile.gz fullstubextracted.gz"""
-        sys.stderr.write(message + "\n")
-        sys.exit(1)
+Example with one input file: python3 offset_test.py fullstubfile.gz fullstubextracted.gz
+
+Example with bz2 files: python3 offset_test.py elwikt-20190108-pages-articles1.xml.bz2,\\
+elwikt-20190108-pages-articles2.xml.bz2 elwikt-20190108-pages-articles.xml.bz2""".format(
+        jobs=DEFAULT_JOBS, suffix=INDEX_SUFFIX, journal=JOURNAL_SUFFIX)
+    sys.stderr.write(message + "\n")
+    sys.exit(1)
+
+
+def do_main():
+    jobs = DEFAULT_JOBS
+    verify = False
+    write = True
+    try:
+        (options, filenames) = getopt.gnu_getopt(sys.argv[1:], "j:Voh", [
+            "jobs=", "verify", "verifyonly", "help"])
+    except getopt.GetoptError as err:
+        usage("Unknown option specified: " + str(err))
+    for (opt, val) in options:
+        if opt in ["-j", "--jobs"]:
+            if not val.isdigit() or not int(val):
+                usage("Arg 'jobs' must be a positive number")
+            jobs = int(val)
+        elif opt in ["-V", "--verify"]:
+            verify = True
+        elif opt in ["-o", "--verifyonly"]:
+            verify = True
+            write = False
+        elif opt in ["-h", "--help"]:
+            usage()
+    if len(filenames) != 2:
+        usage()
     infiles = filenames[0].split(',')
-    rewrite_stubs(infiles, filenames[1])
+    if not rewrite_stubs(infiles, filenames[1], jobs, verify, write):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+"""
+Decompress files made up of many gzip members or bz2 streams, such as
+the stub and abstract files recombined by offset_test.py, using several
+processes at once, writing the output in order to stdout or to a file
+or pipe. Meant as a drop-in replacement for zcat in pipelines like
+
+    python3 pzcat.py enwiki-20190101-stub-meta-history.xml.gz | revsperpage all
+
+The list of members in each file comes from the sidecar index written
+by offset_test.py; if there isn't one yet, the file is decompressed
+serially like zcat would, and the index is written along the way so
+that the next run can go in parallel.
+"""
+import getopt
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import offset_test
+
+
+DEFAULT_JOBS = 4
+# how much decompressed data (in MB) we allow to pile up waiting to be written
+DEFAULT_MEMORY = 1024
+# we don't know the uncompressed size of bz2 streams until we decompress them,
+# so guess, erring on the large side
+BZ2_EXPANSION_GUESS = 10
+
+
+def decompress_to_bytes(filename, file_format, offset, csize):
+    """decompress one member of the file and return all of its contents"""
+    return b''.join(offset_test.decompress_member(filename, file_format, offset, csize))
+
+
+def get_usize_estimate(member):
+    """return the uncompressed size of the member, or a guess
+    at it if we don't know it"""
+    if member['usize'] is not None:
+        return member['usize']
+    return member['csize'] * BZ2_EXPANSION_GUESS
+
+
+def decompress_members(filename, file_format, members, output, jobs, memory, executor=None):
+    """decompress the members of the file in a pool of processes, writing the
+    results to output in order. at most memory bytes of decompressed data are
+    allowed to be in flight; members bigger than that are decompressed here,
+    after everything before them is written out. if an executor is passed,
+    its processes are used instead of starting a pool of our own"""
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=jobs) as own_executor:
+            decompress_members(filename, file_format, members, output, jobs, memory,
+                               own_executor)
+        return
+    pending = deque()
+    in_flight = 0
+    for member in members:
+        usize = get_usize_estimate(member)
+        while pending and (in_flight + usize > memory or len(pending) >= 2 * jobs):
+            future, future_usize = pending.popleft()
+            output(future.result())
+            in_flight -= future_usize
+        if usize > memory:
+            for chunk in offset_test.decompress_member(
+                    filename, file_format, member['offset'], member['csize']):
+                output(chunk)
+            continue
+        pending.append((executor.submit(decompress_to_bytes, filename, file_format,
+                                        member['offset'], member['csize']), usize))
+        in_flight += usize
+    while pending:
+        future, _future_usize = pending.popleft()
+        output(future.result())
+
+
+def decompress_file(filename, output, jobs=DEFAULT_JOBS, memory=DEFAULT_MEMORY * 1024 * 1024,
+                    executor=None):
+    """decompress the file, writing the contents to output in order, in parallel
+    if we have or can cheaply get an index of its members, using the executor's
+    processes if one is passed"""
+    file_format = offset_test.get_file_format(filename)
+    members = offset_test.read_member_index(filename)
+    if members is None:
+        if file_format == 'gz':
+            # finding the members means decompressing everything anyways,
+            # so write it out while we're at it
+            members = offset_test.walk_gzip_members(filename, output)
+            offset_test.write_member_index(filename, members)
+            return
+        # bz2 streams can be found without decompressing
+        members = offset_test.get_member_index(filename)
+    decompress_members(filename, file_format, members, output, jobs, memory, executor)
+
+
+def usage(message=None):
+    """display usage message for this script with an optional
+    preceding message, and exit"""
+    if message is not None:
+        sys.stderr.write(message + "\n")
+    usage_message = """Usage: python3 pzcat.py [--jobs <number>] [--memory <number>]
+                        [--output <path>] file [file...]
+
+Decompress the given gzip or bz2 files, in parallel, writing the contents in order
+to stdout or to the specified output file or pipe.
+
+Arguments:
+  --jobs    (-j):   number of members to decompress at the same time
+                    default: {jobs}
+  --memory  (-m):   maximum amount of decompressed data, in MB, that can be waiting
+                    to be written at any time; members larger than this are
+                    decompressed one at a time
+                    default: {memory}
+  --output  (-o):   path to file or named pipe to which to write output
+                    default: stdout
+  --help    (-h):   display this usage message
+
+Example use:
+   python3 pzcat.py -j 8 elwikt-20190108-stub-articles-all.xml.gz | revsperpage all bytes
+""".format(jobs=DEFAULT_JOBS, memory=DEFAULT_MEMORY)
+    sys.stderr.write(usage_message)
+    sys.exit(1)
+
+
+def do_main():
+    """entry point"""
+    jobs = DEFAULT_JOBS
+    memory = DEFAULT_MEMORY
+    outpath = None
+    try:
+        (options, filenames) = getopt.gnu_getopt(sys.argv[1:], "j:m:o:h", [
+            "jobs=", "memory=", "output=", "help"])
+    except getopt.GetoptError as err:
+        usage("Unknown option specified: " + str(err))
+    for (opt, val) in options:
+        if opt in ["-j", "--jobs"]:
+            if not val.isdigit() or not int(val):
+                usage("Arg 'jobs' must be a positive number")
+            jobs = int(val)
+        elif opt in ["-m", "--memory"]:
+            if not val.isdigit() or not int(val):
+                usage("Arg 'memory' must be a positive number")
+            memory = int(val)
+        elif opt in ["-o", "--output"]:
+            outpath = val
+        elif opt in ["-h", "--help"]:
+            usage()
+    if not filenames:
+        usage("At least one file must be specified")
+
+    if outpath:
+        outfile = open(outpath, "wb")
+    else:
+        outfile = sys.stdout.buffer
+    try:
+        for filename in filenames:
+            decompress_file(filename, outfile.write, jobs, memory * 1024 * 1024)
+        outfile.flush()
+    except BrokenPipeError:
+        # whoever was reading from us (head, say) has all they want;
+        # keep python from complaining about it again on the way out
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(0)
+    finally:
+        if outpath:
+            outfile.close()
+
+
+if __name__ == '__main__':
+    do_main()
@@ -0,0 +1,403 @@
+#!/usr/bin/python3
+"""
+Build an index from revision id to where that revision sits in a set of
+page content dump files (pages-meta-history and friends, gz or bz2,
+ideally made up of many gzip members or bz2 streams, as multistream
+files and files recombined by offset_test.py are), and use it to get
+the text of a revision straight from the dump files on local disk,
+decompressing only the member it is in, instead of going through
+maintenance hosts and external storage the way get_revision.py does.
+
+The index is a file of fixed-size records sorted by revision id:
+    revision id, file number, member offset, offset in the member
+and a json file describing it and listing the dump files, with their
+sizes and mtimes so that a stale index can be caught. A revision that
+starts in one member and continues in the next is read across members,
+and is found even if its opening tag or its id crosses into the next
+member; test_revindex.sh checks this on the files in testdata/.
+"""
+import getopt
+import heapq
+import itertools
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import unescape
+import offset_test
+
+
+INDEX_FORMAT = 'revision-offsets'
+INDEX_VERSION = 1
+# revision id, file number, compressed offset of member, offset within member
+RECORD = struct.Struct('<qiqq')
+DEFAULT_JOBS = 4
+# how many records get sorted in memory at once
+SORT_RUN_RECORDS = 4 * 1024 * 1024
+REVISION_START = b'<revision>'
+REVISION_END = b'</revision>'
+REVID_RE = re.compile(rb'<revision>\s*<id>(\d+)</id>')
+# how far past the start of a revision we might have to look for its id
+REVID_LOOKAHEAD = 256
+CONTENT_RE = re.compile(rb'<content>.*?</content>', re.DOTALL)
+ROLE_RE = re.compile(rb'<role>([^<]*)</role>')
+TEXT_RE = re.compile(rb'<text[^>]*?(?:/>|>(.*?)</text>)', re.DOTALL)
+XML_ENTITIES = {'&quot;': '"', '&#039;': "'", '&apos;': "'"}
+
+
+def get_meta_path(index):
+    """return the path of the json file describing the index"""
+    return index + ".json"
+
+
+def find_revisions(filename, file_format, offset, csize):
+    """decompress one member of the file, returning a list of (revision id,
+    offset of the start of the revision within the decompressed member),
+    along with what's needed to find revisions that start near the end of
+    this member and have their id in the next one: the leftover bytes at
+    the end that might be the start of a revision, their offset within the
+    member, and the first REVID_LOOKAHEAD bytes of the member"""
+    found = []
+    buffer = b''
+    position = 0
+    head = b''
+    for data in offset_test.decompress_member(filename, file_format, offset, csize):
+        if len(head) < REVID_LOOKAHEAD:
+            head += data[:REVID_LOOKAHEAD - len(head)]
+        buffer += data
+        start = 0
+        while True:
+            rev_start = buffer.find(REVISION_START, start)
+            if rev_start < 0:
+                keep = max(start, len(buffer) - len(REVISION_START) + 1)
+                break
+            match = REVID_RE.match(buffer, rev_start)
+            if not match:
+                if len(buffer) - rev_start < REVID_LOOKAHEAD:
+                    # the id might be in the next piece of data
+                    keep = rev_start
+                    break
+                start = rev_start + 1
+                continue
+            found.append((int(match.group(1)), position + rev_start))
+            start = match.end()
+        position += keep
+        buffer = buffer[keep:]
+    return found, buffer, position, head
+
+
+def find_spanning_revisions(tail, following):
+    """given the leftover bytes at the end of one member and the bytes that
+    come after it in the next member(s), return a list of (revision id, offset
+    in the leftover bytes) for the revisions that start in the leftover bytes"""
+    found = []
+    combined = tail + following
+    start = 0
+    while True:
+        rev_start = combined.find(REVISION_START, start, len(tail) + len(REVISION_START) - 1)
+        if rev_start < 0:
+            break
+        match = REVID_RE.match(combined, rev_start)
+        if match:
+            found.append((int(match.group(1)), rev_start))
+        start = rev_start + 1
+    return found
+
+
+def get_member_results(executor, filenames, jobs):
+    """find the revisions in every member of every file with a pool of
+    processes, yielding (file number, member offset, revisions found) in
+    file and member order. revisions that start at the end of one member
+    and have their id in the next are found by handing what's left over
+    at the end of each member on to the next one"""
+    pending = deque()
+    for file_number, filename in enumerate(filenames):
+        file_format = offset_test.get_file_format(filename)
+        members = offset_test.get_member_index(filename)
+        for member_number, member in enumerate(members):
+            if len(pending) >= 2 * jobs:
+                yield from get_stitched_results(pending)
+            pending.append((executor.submit(index_member, file_number, filename, file_format,
+                                            member['offset'], member['csize']),
+                            member_number == len(members) - 1))
+    while pending:
+        yield from get_stitched_results(pending)
+
+
+def get_stitched_results(pending):
+    """wait for the oldest member in the queue and yield its results, including
+    any revisions that start in what's left over at the end of it; for those
+    we need at least REVID_LOOKAHEAD bytes from the start of the following
+    members of the same file, or all of them if there's less than that. if
+    those members haven't been queued yet, yields nothing"""
+    following = b''
+    last_member = pending[0][1]
+    for future, last in itertools.islice(pending, 1, None):
+        if last_member or len(following) >= REVID_LOOKAHEAD:
+            break
+        following += future.result()[2][3]
+        last_member = last
+    if not last_member and len(following) < REVID_LOOKAHEAD:
+        return
+    future, _last = pending.popleft()
+    file_number, offset, (found, tail, tail_offset, _head) = future.result()
+    found.extend((revid, tail_offset + tail_position) for (revid, tail_position)
+                 in find_spanning_revisions(tail, following))
+    yield file_number, offset, found
+
+
+def index_member(file_number, filename, file_format, offset, csize):
+    """worker: find the revisions in one member of one file and return
+    them along with where they came from"""
+    return file_number, offset, find_revisions(filename, file_format, offset, csize)
+
+
+def write_sorted_run(records, tmpdir):
+    """sort the records and write them to an anonymous temp file, returning the file"""
+    outfile = tempfile.TemporaryFile(dir=tmpdir)
+    records.sort()
+    for record in records:
+        outfile.write(RECORD.pack(*record))
+    outfile.seek(0)
+    return outfile
+
+
+def read_sorted_run(infile):
+    """yield the records from a temp file written by write_sorted_run, closing it when done"""
+    with infile:
+        while True:
+            data = infile.read(RECORD.size * 65536)
+            if not data:
+                break
+            yield from RECORD.iter_unpack(data)
+
+
+def build_index(filenames, index, jobs=DEFAULT_JOBS, tmpdir=None):
+    """scan the dump files for revisions and write the index for them;
+    records are sorted in runs on disk and merged, so memory use
+    doesn't grow with the number of revisions"""
+    runs = []
+    records = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for file_number, offset, found in get_member_results(executor, filenames, jobs):
+            records.extend((revid, file_number, offset, uoffset) for (revid, uoffset) in found)
+            if len(records) >= SORT_RUN_RECORDS:
+                runs.append(write_sorted_run(records, tmpdir))
+                records = []
+    runs.append(write_sorted_run(records, tmpdir))
+    count = 0
+    with open(index + ".tmp", "wb") as outfile:
+        for record in heapq.merge(*[read_sorted_run(run) for run in runs]):
+            outfile.write(RECORD.pack(*record))
+            count += 1
+    files = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        files.append({'path': os.path.abspath(filename), 'size': stat.st_size,
+                      'mtime': stat.st_mtime_ns})
+    meta = {'format': INDEX_FORMAT, 'version': INDEX_VERSION, 'records': count, 'files': files}
+    with open(get_meta_path(index), "w") as outfile:
+        json.dump(meta, outfile, indent=2)
+    os.replace(index + ".tmp", index)
+    return count
+
+
+def read_index_meta(index):
+    """read and check the description of the index, making sure
+    the dump files haven't changed since it was built"""
+    with open(get_meta_path(index), "r") as infile:
+        meta = json.load(infile)
+    if meta.get('format') != INDEX_FORMAT or meta.get('version') != INDEX_VERSION:
+        raise ValueError("{path} is not a revision offset index".format(
+            path=get_meta_path(index)))
+    for entry in meta['files']:
+        stat = os.stat(entry['path'])
+        if stat.st_size != entry['size'] or stat.st_mtime_ns != entry['mtime']:
+            raise ValueError("{path} has changed since the index {index} was built".format(
+                path=entry['path'], index=index))
+    return meta
+
+
+def lookup_revision(index, revid):
+    """return (file number, member offset, offset in member) for the revision
+    from the index, or None if it isn't there"""
+    with open(index, "rb") as infile:
+        if not os.fstat(infile.fileno()).st_size:
+            return None
+        records = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        low = 0
+        high = len(records) // RECORD.size
+        while low < high:
+            middle = (low + high) // 2
+            record = RECORD.unpack_from(records, middle * RECORD.size)
+            if record[0] < revid:
+                low = middle + 1
+            else:
+                high = middle
+        if low * RECORD.size < len(records):
+            record = RECORD.unpack_from(records, low * RECORD.size)
+            if record[0] == revid:
+                return record[1:]
+        return None
+    finally:
+        records.close()
+
+
+def read_revision_xml(filename, offset, uoffset):
+    """decompress the member at the offset in the file, and following members if
+    need be, returning the revision element that starts at uoffset in the member"""
+    file_format = offset_test.get_file_format(filename)
+    members = offset_test.get_member_index(filename)
+    following = [member for member in members if member['offset'] >= offset]
+    if not following or following[0]['offset'] != offset:
+        raise ValueError("no member at offset {offset} in {fname}".format(
+            offset=offset, fname=filename))
+    skip = uoffset
+    collected = b''
+    for member in following:
+        for data in offset_test.decompress_member(filename, file_format, member['offset'],
+                                                  member['csize']):
+            if skip >= len(data):
+                skip -= len(data)
+                continue
+            search_from = max(0, len(collected) - len(REVISION_END) + 1)
+            collected += data[skip:]
+            skip = 0
+            end = collected.find(REVISION_END, search_from)
+            if end >= 0:
+                return collected[:end + len(REVISION_END)]
+    raise ValueError("revision at offset {uoffset} of member {offset} in {fname} "
+                     "never ends".format(uoffset=uoffset, offset=offset, fname=filename))
+
+
+def get_slot_text(revision_xml, slot):
+    """return the text of the given slot ('main' or the role of some other
+    slot) from the revision xml, unescaped, or None if there is no such
+    slot or its text was deleted"""
+    contents = CONTENT_RE.findall(revision_xml)
+    if slot == 'main':
+        # in newer dumps, the main slot is the revision's own text element,
+        # and other slots each get a content element of their own
+        outside = CONTENT_RE.sub(b'', revision_xml)
+        match = TEXT_RE.search(outside)
+    else:
+        match = None
+        for content in contents:
+            role = ROLE_RE.search(content)
+            if role and role.group(1).decode('utf-8') == slot:
+                match = TEXT_RE.search(content)
+                break
+    if not match or match.group(1) is None:
+        return None
+    return unescape(match.group(1).decode('utf-8'), XML_ENTITIES)
+
+
+def get_revision(index, revid, slot='main', raw=False):
+    """return the text of the slot of the revision, or its entire xml
+    if raw is set, from the dump files listed in the index"""
+    meta = read_index_meta(index)
+    location = lookup_revision(index, revid)
+    if location is None:
+        raise ValueError("revision {revid} is not in the index {index}".format(
+            revid=revid, index=index))
+    file_number, offset, uoffset = location
+    revision_xml = read_revision_xml(meta['files'][file_number]['path'], offset, uoffset)
+    if raw:
+        return revision_xml.decode('utf-8')
+    text = get_slot_text(revision_xml, slot)
+    if text is None:
+        raise ValueError("revision {revid} has no text for slot {slot}".format(
+            revid=revid, slot=slot))
+    return text
+
+
+def usage(message=None):
+    """display usage message for this script with an optional
+    preceding message, and exit"""
+    if message is not None:
+        sys.stderr.write(message + "\n")
+    usage_message = """Usage: python3 revindex.py --index <path> [--jobs <number>] [--tmpdir <path>]
+                          file [file...]
+   or: python3 revindex.py --index <path> --revid <number> [--slot <slot role>] [--raw]
+
+Build an index of where each revision is in the given page content dump files,
+or use one to display the text of a revision from those files.
+
+Arguments:
+  --index   (-i):   path to the index file; its description and the list of dump
+                    files it covers go in <path>.json
+  --jobs    (-j):   number of members to scan at the same time when building
+                    default: {jobs}
+  --tmpdir  (-t):   directory for sorting revision records when building
+                    default: the system temp directory
+  --revid   (-r):   id of revision for which to display content
+  --slot    (-s):   name of slot type ('mediainfo', 'main', etc.) for revision
+                    default: 'main'
+  --raw     (-R):   display the revision's xml as it is in the dump file
+  --help    (-h):   display this usage message
+
+Each dump file gets a member index (see offset_test.py) if it does not have one
+already. Files that are a single gzip member or bz2 stream can be indexed, but
+getting a revision from them means decompressing everything up to it.
+
+Example use:
+   python3 revindex.py -i elwikt-history.idx -j 8 elwikt-20200101-pages-meta-history*.xml.bz2
+   python3 revindex.py -i elwikt-history.idx -r 20050 -s main
+""".format(jobs=DEFAULT_JOBS)
+    sys.stderr.write(usage_message)
+    sys.exit(1)
+
+
+def do_main():
+    """entry point"""
+    index = None
+    jobs = DEFAULT_JOBS
+    tmpdir = None
+    revid = None
+    slot = 'main'
+    raw = False
+    try:
+        (options, filenames) = getopt.gnu_getopt(sys.argv[1:], "i:j:t:r:s:Rh", [
+            "index=", "jobs=", "tmpdir=", "revid=", "slot=", "raw", "help"])
+    except getopt.GetoptError as err:
+        usage("Unknown option specified: " + str(err))
+    for (opt, val) in options:
+        if opt in ["-i", "--index"]:
+            index = val
+        elif opt in ["-j", "--jobs"]:
+            if not val.isdigit() or not int(val):
+                usage("Arg 'jobs' must be a positive number")
+            jobs = int(val)
+        elif opt in ["-t", "--tmpdir"]:
+            tmpdir = val
+        elif opt in ["-r", "--revid"]:
+            if not val.isdigit():
+                usage("Arg 'revid' must be a number")
+            revid = int(val)
+        elif opt in ["-s", "--slot"]:
+            slot = val
+        elif opt in ["-R", "--raw"]:
+            raw = True
+        elif opt in ["-h", "--help"]:
+            usage()
+    if index is None:
+        usage("The index file must be specified")
+    if revid is None:
+        if not filenames:
+            usage("At least one dump file must be specified to build an index")
+        count = build_index(filenames, index, jobs, tmpdir)
+        print("indexed", count, "revisions", file=sys.stderr)
+    else:
+        if filenames:
+            usage("Dump files can't be given along with a revision id")
+        print(get_revision(index, revid, slot, raw))
+
+
+if __name__ == '__main__':
+    do_main()
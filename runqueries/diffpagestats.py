@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Compare per-page revision statistics from two dump runs, given
+either the column files written by 'revsperpage.py columns' or
+the stub files themselves, and write out which pages were added
+or deleted and how the others changed.
+"""
+
+
+import getopt
+import os
+import shutil
+import sys
+import tempfile
+import queries.pagediff as qpagediff
+import queries.pagestats as qpagestats
+
+
+def usage(message=None):
+    '''
+    display a helpful usage message with
+    an optional introductory message first
+    '''
+    if message is not None:
+        sys.stderr.write(message)
+        sys.stderr.write('\n')
+    usage_message = """Usage: python3 diffpagestats.py [--jobs <number>] [--tmpdir <path>]
+                        [--output <path>] <old> <new>
+
+Compare per-page revision counts and byte totals from an older and a newer dump
+run. Each of old and new may be the prefix of column files written by
+'revsperpage.py columns <prefix>' (there must be a <prefix>.schema.json file),
+or a stubs file (plain, gz or bz2), which is read with all namespaces included.
+
+Output is one line for each page that is only in the new run ('added'), only
+in the old run ('deleted'), or in both with a different namespace, revision
+count or byte total ('changed'), in page id order:
+  added page:<id> ns:<ns> revs:<revs> bytes:<bytes>
+  deleted page:<id> ns:<ns> revs:<revs> bytes:<bytes>
+  changed page:<id> ns:<ns> revs:<revs> bytes:<bytes> old_ns:<ns>
+      delta_revs:<+-revs> delta_bytes:<+-bytes>
+and then a line of totals:
+  totals added:<n> deleted:<n> changed:<n> unchanged:<n>
+      delta_revs:<+-revs> delta_bytes:<+-bytes>
+
+Columns not in page id order are sorted on disk, and stub files are converted
+to columns on disk first, so memory use stays bounded even for the largest wikis.
+
+Arguments:
+  --jobs    (-j):   read stub files with this many processes
+                    default: 1
+  --tmpdir  (-t):   directory for columns converted from stub files and
+                    for sorting
+                    default: the system temp directory
+  --output  (-o):   path to file to which to write output
+                    default: stdout
+  --help    (-h):   display this usage message
+"""
+    sys.stderr.write(usage_message)
+    sys.exit(1)
+
+
+def get_prefixes(inputs, jobs, workdir):
+    '''
+    return the column prefixes for the old and new inputs, converting
+    any stub files to columns first; both must cover the same pages
+    '''
+    prefixes = []
+    for name, path in zip(['old', 'new'], inputs):
+        if os.path.exists(qpagestats.get_schema_path(path)):
+            prefixes.append(path)
+        elif os.path.exists(path):
+            prefix = os.path.join(workdir, name)
+            qpagestats.write_columns_from_stubs(path, jobs, prefix)
+            prefixes.append(prefix)
+        else:
+            usage("No such stubs file or column prefix {path}".format(path=path))
+    old_settings, new_settings = [qpagestats.read_schema(prefix)['settings']
+                                  for prefix in prefixes]
+    if old_settings != new_settings:
+        raise ValueError("Columns for {old} and {new} were written with different settings "
+                         "({old_settings} and {new_settings}), can't compare them".format(
+                             old=inputs[0], new=inputs[1],
+                             old_settings=old_settings, new_settings=new_settings))
+    return prefixes
+
+
+def do_main():
+    '''
+    entry point
+    '''
+    jobs = 1
+    tmpdir = None
+    outpath = None
+    try:
+        (options, remainder) = getopt.gnu_getopt(sys.argv[1:], "j:t:o:h", [
+            "jobs=", "tmpdir=", "output=", "help"])
+    except getopt.GetoptError as err:
+        usage("Unknown option specified: " + str(err))
+    for (opt, val) in options:
+        if opt in ["-j", "--jobs"]:
+            if not val.isdigit() or not int(val):
+                usage("Arg 'jobs' must be a positive number")
+            jobs = int(val)
+        elif opt in ["-t", "--tmpdir"]:
+            tmpdir = val
+        elif opt in ["-o", "--output"]:
+            outpath = val
+        elif opt in ["-h", "--help"]:
+            usage()
+    if len(remainder) != 2:
+        usage("Exactly two inputs, old and new, must be specified")
+
+    workdir = tempfile.mkdtemp(prefix="diffpagestats-", dir=tmpdir)
+    outfile = open(outpath, "w") if outpath else sys.stdout
+    try:
+        old_prefix, new_prefix = get_prefixes(remainder, jobs, workdir)
+        qpagediff.write_diff(qpagestats.get_sorted_rows(old_prefix, workdir),
+                             qpagestats.get_sorted_rows(new_prefix, workdir), outfile)
+        outfile.flush()
+    except BrokenPipeError:
+        # head or whoever has seen enough
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(0)
+    finally:
+        if outpath:
+            outfile.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    do_main()
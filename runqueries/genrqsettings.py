@@ -7,17 +7,21 @@ explain script
 
 Here's the hoops we jump through for the specified wiki:
 
-ssh to the dumps host
+ssh to the dumps host (unless we have a recent listing cached)
    get a recent dump run date for the wiki that we hope has complete stubs
 ssh to the dumps host
+   get the size and mtime of the stubs file for that run
+ssh to the dumps host (unless we have results for that stubs file cached)
    from that stubs file, find page with the most revisions, display pageid, revcount
+   and, with the python rev counter, the id of the revision about halfway through
+   the page history
 ssh to mw host
    see if mwscript exists or not -- must be done before any mw maint scripts can be run
 ssh to mw host
    get $wgCanonicalServer and $wgScriptPath
 use those values to put together the mw api path
 curl to get info for the page with most revisions, using the api -- could be done via library
-ssh to mw host
+ssh to mw host (only with the C rev counter, which doesn't report it)
    get the id of the revision about halfway through the page history
 ssh to mw host
    get the db configuration info ($wgLBFactoryConf)
@@ -36,6 +40,7 @@ import queries.utils as qutils
 import queries.dbinfo as qdbinfo
 import queries.args as qargs
 import queries.logger as qlogger
+import queries.stubcache as qstubcache
 
 
 # SSH = '/usr/bin/ssh'
@@ -176,25 +181,37 @@ class QueryRunner():
 
 class RevCounter():
     '''
-    run a horrid little C binary to read through an xml stubs history file,
-    count revs per page, nd write out the ones that have more than 10k
-    revisions. it's nicer than asking the dbs to do it, meh
+    run a rev counter on the dumps host to read through an xml stubs history
+    file and find the page with the most revisions, only considering pages
+    with more than 10k revisions. it's nicer than asking the dbs to do it, meh
+
+    by default that's the horrid little C binary, whose output gets sorted to
+    find the page; revsperpage.py can be used instead (revsperpage_engine=python
+    in the config), which keeps only the top page as it goes and gets the id
+    of the revision halfway through its history in the same pass, but it is
+    slower and needs the queries package installed alongside it
     '''
     REVCUTOFF = 10000
+    ENGINES = ['c', 'python']
 
     def __init__(self, args):
+        if args['revsperpage_engine'] not in self.ENGINES:
+            raise ValueError("revsperpage_engine must be one of {engines}".format(
+                engines=", ".join(self.ENGINES)))
         self.args = args
         self.log = qlogger.get_logger(args)
+        self.cache = qstubcache.StubCache(args['cachedir'], args['wikidb'])
 
     def get_biggest_page_info(self):
         '''
         get the date of a dump we think is complete (last minus one),
         use that date to find a stubs meta history xml file from which
-        we'll get the page id of the page with the most revisions in it
+        we'll get the page id of the page with the most revisions in it,
+        the number of revisions and the revid about halfway through them,
+        or None for the revid if the rev counter doesn't report it
         '''
         rundate = self.get_dump_rundate()
-        pageid, revcount = self.get_pageid_revcount(rundate)
-        return pageid, revcount
+        return self.get_pageid_revcount(rundate)
 
     def get_dump_rundate(self):
         '''
@@ -202,11 +219,30 @@ class RevCounter():
         stubs. if it doesn't, we have some really broken crap out there
         and ought to hear about it in any case
         '''
+        rundates = None
+        if not self.args['refresh']:
+            rundates = self.cache.get_rundates()
+        if rundates is None:
+            rundates = self.get_rundates()
+            if rundates is None:
+                return b'99999999'
+            self.cache.set_rundates(rundates)
+        try:
+            return rundates[-2].encode('utf-8')
+        except Exception:
+            raise ValueError("Errors encountered getting run dates for {wiki} dumps:".format(
+                wiki=self.args['wikidb'])) from None
+
+    def get_rundates(self):
+        '''
+        get the list of dump run dates for the wiki from the dumps host,
+        or None if this is a dry run
+        '''
         remote_command = ["/bin/ls", "{dumpsdir}/{wiki}".format(
             dumpsdir=self.args['dumpsdir'], wiki=self.args['wikidb'])]
         command = qutils.build_command(remote_command, ssh_host=self.args['dumpshost'])
         if not display_command_info(command, self.args['dryrun'], self.log):
-            return b'99999999'
+            return None
 
         command = " ".join(command)
         proc = Popen(command, stdout=PIPE, stderr=PIPE, shell=True)
@@ -216,47 +252,133 @@ class RevCounter():
         # expect something like
         # 20180920  20181001  20181020  20181101 20181120 latest
         entries = output.split()
+        return [entry.decode('utf-8') for entry in entries
+                if entry.isdigit() and len(entry) == 8]
+
+    def get_stubs_path(self, rundate):
+        '''
+        return the path on the dumps host to the stubs meta history file for the run date
+        '''
+        return "{dumpsdir}/{wiki}/{rundate}/{wiki}-{rundate}-stub-meta-history.xml.gz".format(
+            dumpsdir=self.args['dumpsdir'], wiki=self.args['wikidb'],
+            rundate=rundate.decode('utf-8'))
+
+    def get_stubs_size_mtime(self, rundate):
+        '''
+        return the size and mtime of the stubs meta history file for the run date,
+        or None, None if this is a dry run
+        '''
+        remote_command = ["/usr/bin/stat", "--format", "%s:%Y", self.get_stubs_path(rundate)]
+        command = qutils.build_command(remote_command, ssh_host=self.args['dumpshost'])
+        if not display_command_info(command, self.args['dryrun'], self.log):
+            return None, None
+
+        command = " ".join(command)
+        proc = Popen(command, stdout=PIPE, stderr=PIPE, shell=True)
+        output, error = proc.communicate()
+        if error:
+            raise SubprocessError("Errors encountered: {error}".format(error=error.decode('utf-8')))
+        # expect size:mtime
         try:
-            entries = [entry for entry in entries if entry.isdigit() and len(entry) == 8]
-            return entries[-2]
-        except Exception:
-            raise ValueError("Errors encountered getting run dates for {wiki} dumps:".format(
+            size, mtime = output.strip().split(b':')
+            return int(size), int(mtime)
+        except ValueError:
+            raise ValueError("Failed to get size and mtime of stubs for {wiki}".format(
                 wiki=self.args['wikidb'])) from None
 
     def get_pageid_revcount(self, rundate):
         '''
-        having the date of the specific dump run, scat the stubs meta history file as stdin
-        to the rev counter, sort and get the page id with the most revs
+        return the page id with the most revs, its revision count and its
+        midpoint revid (None if the rev counter doesn't report it) from the
+        stubs meta history file for the dump run, from the cache if we have
+        already scanned the file as it is now
         '''
-        # this command has single quotes at the beginning and end. yeah it's gross.
-        remote_command = [
-            "'/bin/zcat",
-            "{dumpsdir}/{wiki}/{rundate}/{wiki}-{rundate}-stub-meta-history.xml.gz".format(
-                dumpsdir=self.args['dumpsdir'], wiki=self.args['wikidb'],
-                rundate=rundate.decode('utf-8')),
-            "|",
-            "/usr/local/bin/revsperpage", "all", str(self.REVCUTOFF),
-            "|",
-            "sort", "-k", "2", "-nr",
-            "|",
-            "head", "-1'"
-        ]
+        size, mtime = self.get_stubs_size_mtime(rundate)
+        if size is None:
+            # dry run; show the scan that would follow too, since we can't know
+            # whether its results would have come from the cache
+            self.scan_stubs(rundate)
+            return self.get_dryrun_results()
+        results = None
+        if not self.args['refresh']:
+            results = self.cache.get_stub_results(rundate.decode('utf-8'), size, mtime)
+        if results is None:
+            results = self.scan_stubs(rundate)
+            if results is None:
+                return self.get_dryrun_results()
+            self.cache.set_stub_results(rundate.decode('utf-8'), size, mtime, results)
+        else:
+            self.log.info("using cached stub results for %s %s",
+                          self.args['wikidb'], rundate.decode('utf-8'))
+        midrevid = results['midrevid']
+        return (results['pageid'].encode('utf-8'), results['revcount'].encode('utf-8'),
+                midrevid.encode('utf-8') if midrevid is not None else None)
+
+    def get_dryrun_results(self):
+        '''
+        return placeholder page id, revision count and midpoint revid for a
+        dry run; the revid is None if the rev counter wouldn't report it, so
+        that the command to get it some other way gets shown too
+        '''
+        return b'0', b'0', b'0' if self.args['revsperpage_engine'] == 'python' else None
+
+    def scan_stubs(self, rundate):
+        '''
+        having the date of the specific dump run, have the rev counter read the
+        stubs meta history file and report the page id with the most revs and,
+        if it's revsperpage.py, the revid at the midpoint of its history.
+        return a dict of the results, or None if this is a dry run
+        '''
+        if self.args['revsperpage_engine'] == 'python':
+            remote_command = [
+                self.args['revsperpage_py'], "all", str(self.REVCUTOFF), "topk", "1",
+                "quantiles", "50", "jobs", self.args['revsperpage_jobs'],
+                "file", self.get_stubs_path(rundate)
+            ]
+        else:
+            # this command has single quotes at the beginning and end. yeah it's gross.
+            remote_command = [
+                "'/bin/zcat", self.get_stubs_path(rundate),
+                "|",
+                self.args['revsperpage'], "all", str(self.REVCUTOFF),
+                "|",
+                "sort", "-k", "2", "-nr",
+                "|",
+                "head", "-1'"
+            ]
         command = qutils.build_command(remote_command, ssh_host=self.args['dumpshost'])
         if not display_command_info(command, self.args['dryrun'], self.log):
-            return b'0', b'0'
+            return None
 
         command = " ".join(command)
         proc = Popen(command, stdout=PIPE, stderr=PIPE, shell=True)
         output, error = proc.communicate()
         if error:
             raise SubprocessError("Errors encountered: {error}".format(error=error.decode('utf-8')))
+        if self.args['revsperpage_engine'] == 'python':
+            return self.get_topk_results(output)
         # expect pageid revcount as the last line
         lines = output.splitlines()
         if not lines:
             raise ValueError("No pages found with enough revisions to work on")
-        pageid = lines[-1].split()[0]
-        revcount = lines[-1].split()[1]
-        return pageid, revcount
+        pageid, revcount = lines[-1].split()[:2]
+        return {'pageid': pageid.decode('utf-8'), 'revcount': revcount.decode('utf-8'),
+                'midrevid': None}
+
+    @staticmethod
+    def get_topk_results(output):
+        '''
+        dig the page id, revision count and midpoint revid of the top page
+        out of revsperpage.py topk output, and return them in a dict
+        '''
+        # expect topk:revs rank:1 page:<pageid> ns:<ns> revs:<revcount> ... revid_q50:<revid>
+        for line in output.splitlines():
+            if line.startswith(b'topk:revs rank:1 '):
+                fields = dict(field.split(b':', 1) for field in line.split()[2:])
+                return {'pageid': fields[b'page'].decode('utf-8'),
+                        'revcount': fields[b'revs'].decode('utf-8'),
+                        'midrevid': fields[b'revid_q50'].decode('utf-8')}
+        raise ValueError("No pages found with enough revisions to work on")
 
 
 def get_start_end_pageids(pageid):
@@ -303,7 +425,7 @@ def usage(message=None):
         sys.stderr.write('\n')
     usage_message = """
 Usage: python3 genrqsettings.py --settings <path> --wikidb <name>
-    [--dryrun] [--verbose] [--help]
+    [--refresh] [--dryrun] [--verbose] [--help]
 
 This script reads a settings file path and the name of a wiki database,
 and then by means of several somersaults and a few rabbits out of grody
@@ -318,6 +440,10 @@ Arguments:
     --wikidb     (-w)   Name of wiki database (e.g. enwiki) for which to generate
                         show explain query config data
                         default: none
+    --refresh    (-r)   Ignore any cached dump run dates and stubs scan results
+                        for the wiki and get them from the dumps host again; the
+                        cache is in the directory given by the cachedir setting
+                        default: use the cache
 """
     usage_output = qargs.get_common_arg_docs(['output'])
     usage_common = qargs.get_common_arg_docs(['settings'])
@@ -346,10 +472,11 @@ def run(args):
     the show explain script and write out a sample stanza
     '''
     revcounter = RevCounter(args)
-    bigpage_id, revcount = revcounter.get_biggest_page_info()
+    bigpage_id, revcount, revid = revcounter.get_biggest_page_info()
     qrunner = QueryRunner(args)
     namespace, title = qrunner.get_page_info(bigpage_id)
-    revid = qrunner.get_midpoint_revid(bigpage_id, revcount)
+    if revid is None:
+        revid = qrunner.get_midpoint_revid(bigpage_id, revcount)
     startpage, endpage = get_start_end_pageids(int(bigpage_id))
     section = get_section(args)
     display(namespace, title, bigpage_id, revid, startpage, endpage, section, args['wikidb'])
@@ -384,6 +511,8 @@ def get_opt(opt, val, args):
         args['wikidb'] = val
     elif opt in ['-s', '--settings']:
         args['settings'] = val
+    elif opt in ['-r', '--refresh']:
+        args['refresh'] = True
     else:
         return False
     return True
@@ -393,11 +522,11 @@ def do_main():
     '''
     entry point
     '''
-    args = qargs.get_arg_defaults(['settings', 'wikidb'], ['dryrun', 'verbose'])
+    args = qargs.get_arg_defaults(['settings', 'wikidb'], ['dryrun', 'refresh', 'verbose'])
     try:
         (options, remainder) = getopt.gnu_getopt(
-            sys.argv[1:], 's:w:dvh', ['settings=', 'wikidb=',
-                                      'dryrun', 'verbose', 'help'])
+            sys.argv[1:], 's:w:rdvh', ['settings=', 'wikidb=', 'refresh',
+                                       'dryrun', 'verbose', 'help'])
     except getopt.GetoptError as err:
         usage("Unknown option specified: " + str(err))
 
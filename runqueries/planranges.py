@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Plan page id ranges for parallel dump jobs from per-page revision
+statistics, so that the jobs take about the same time instead of
+one of them getting all of the pages with huge histories.
+"""
+
+
+import getopt
+import os
+import shutil
+import sys
+import tempfile
+import queries.pagestats as qpagestats
+import queries.rangeplan as qrangeplan
+
+
+def usage(message=None):
+    '''
+    display a helpful usage message with
+    an optional introductory message first
+    '''
+    if message is not None:
+        sys.stderr.write(message)
+        sys.stderr.write('\n')
+    usage_message = """Usage: python3 planranges.py --ranges <number> [--cost bytes|revs]
+                        [--maxcost <number>] [--jobs <number>] [--tmpdir <path>]
+                        [--output <path>] <input>
+
+Split the pages of a wiki into contiguous page id ranges for parallel dump jobs,
+so that the largest estimated cost of any range is as small as possible.
+The input may be the prefix of column files written by 'revsperpage.py all columns
+<prefix>' (there must be a <prefix>.schema.json file; columns written without 'all'
+or with a cutoff are refused, since they leave pages out), or a stubs file (plain,
+gz or bz2), which is read with all namespaces included.
+
+Output is one line per range, in page id order:
+  p<first page id>p<last page id> pages:<n> revs:<n> bytes:<n>
+The ranges cover all page ids from 1 through the largest page id, with no gaps.
+A single page that costs more than the rest put together gets a range of its own,
+so there may be fewer ranges than asked for.
+
+Arguments:
+  --ranges   (-r):   the largest number of ranges to produce
+  --cost     (-c):   estimate the cost of a range by the sum of the byte lengths
+                     of all its revisions ('bytes') or by the number of its
+                     revisions ('revs')
+                     default: bytes
+  --maxcost  (-m):   instead of making the largest range as cheap as possible,
+                     use as few ranges as possible that each cost no more than
+                     this, but never more than --ranges ranges
+                     default: none
+  --jobs     (-j):   read a stubs file with this many processes
+                     default: 1
+  --tmpdir   (-t):   directory for columns converted from a stubs file and
+                     for sorting
+                     default: the system temp directory
+  --output   (-o):   path to file to which to write output
+                     default: stdout
+  --help     (-h):   display this usage message
+"""
+    sys.stderr.write(usage_message)
+    sys.exit(1)
+
+
+def get_number(opt, val):
+    '''
+    return the value of the option as a positive number
+    '''
+    if not val.isdigit() or not int(val):
+        usage("Arg '{opt}' must be a positive number".format(opt=opt.lstrip('-')))
+    return int(val)
+
+
+def do_main():
+    '''
+    entry point
+    '''
+    maxranges = None
+    cost = 'bytes'
+    maxcost = None
+    jobs = 1
+    tmpdir = None
+    outpath = None
+    try:
+        (options, remainder) = getopt.gnu_getopt(sys.argv[1:], "r:c:m:j:t:o:h", [
+            "ranges=", "cost=", "maxcost=", "jobs=", "tmpdir=", "output=", "help"])
+    except getopt.GetoptError as err:
+        usage("Unknown option specified: " + str(err))
+    for (opt, val) in options:
+        if opt in ["-r", "--ranges"]:
+            maxranges = get_number(opt, val)
+        elif opt in ["-c", "--cost"]:
+            if val not in qrangeplan.COSTS:
+                usage("Arg 'cost' must be one of " + ", ".join(qrangeplan.COSTS))
+            cost = val
+        elif opt in ["-m", "--maxcost"]:
+            maxcost = get_number(opt, val)
+        elif opt in ["-j", "--jobs"]:
+            jobs = get_number(opt, val)
+        elif opt in ["-t", "--tmpdir"]:
+            tmpdir = val
+        elif opt in ["-o", "--output"]:
+            outpath = val
+        elif opt in ["-h", "--help"]:
+            usage()
+    if maxranges is None:
+        usage("The number of ranges must be specified")
+    if len(remainder) != 1:
+        usage("Exactly one input must be specified")
+    path = remainder[0]
+
+    workdir = tempfile.mkdtemp(prefix="planranges-", dir=tmpdir)
+    outfile = open(outpath, "w") if outpath else sys.stdout
+    try:
+        if os.path.exists(qpagestats.get_schema_path(path)):
+            settings = qpagestats.read_schema(path)['settings']
+            if not settings['all'] or settings['cutoff']:
+                # ranges planned from these would leave out the cost of the other pages
+                usage("Columns {path} were not written with 'all' and no cutoff, so they "
+                      "don't cover every page".format(path=path))
+            prefix = path
+        elif os.path.exists(path):
+            prefix = os.path.join(workdir, "pages")
+            qpagestats.write_columns_from_stubs(path, jobs, prefix)
+        else:
+            usage("No such stubs file or column prefix {path}".format(path=path))
+        # we go through the rows twice, so sort them (if need be) just once
+        prefix = qpagestats.sort_columns(prefix, os.path.join(workdir, "sorted"), workdir)
+        sums = qrangeplan.get_prefix_sums(qpagestats.get_sorted_rows(prefix), cost)
+        ends = qrangeplan.plan_ranges(sums, maxranges, maxcost)
+        for page_range in qrangeplan.get_ranges(qpagestats.get_sorted_rows(prefix), ends):
+            outfile.write(qrangeplan.format_range(page_range))
+    finally:
+        if outpath:
+            outfile.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    do_main()
@@ -8,8 +8,9 @@ import configparser
 import sys
 
 
-SETTINGS = ['domain', 'dumpsdir', 'dumpshost', 'logfile', 'multiversion', 'mwhost',
-            'mwrepo', 'params_ignore', 'php', 'sudouser', 'tables', 'wikifile', 'wikilist']
+SETTINGS = ['cachedir', 'domain', 'dumpsdir', 'dumpshost', 'logfile', 'multiversion', 'mwhost',
+            'mwrepo', 'params_ignore', 'php', 'revsperpage', 'revsperpage_engine',
+            'revsperpage_jobs', 'revsperpage_py', 'sudouser', 'tables', 'wikifile', 'wikilist']
 
 
 def config_setup(configfile):
@@ -35,6 +36,7 @@ def get_config_defaults():
     get and return default config settings for this crapola
     '''
     return {
+        'cachedir': '',
         'dumpshost': '',
         'dumpspath': '/dumps',
         'logfile': 'sql_checker_errors.log',
@@ -43,6 +45,10 @@ def get_config_defaults():
         'mwrepo': '/srv/mediawiki',
         'params_ignore': 'AUTO_INCREMENT,DEFAULT,AVG_ROW_LENGTH',
         'php': '/usr/bin/php',
+        'revsperpage': '/usr/local/bin/revsperpage',
+        'revsperpage_engine': 'c',
+        'revsperpage_jobs': '4',
+        'revsperpage_py': '/usr/local/bin/revsperpage.py',
         'sudouser': '',
         'tables': '',
         'wikifile': 'all.dblist',
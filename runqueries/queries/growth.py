@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+count revisions and sum their byte lengths per namespace and per
+day, week or month of the revision timestamp, from stub files,
+so that growth over time can be charted without asking the
+databases for anything
+"""
+
+
+import datetime
+import queries.stubscan as qstubscan
+
+
+INTERVALS = ['day', 'week', 'month']
+
+
+def get_bucket_getter(interval):
+    '''
+    return a function that takes a revision timestamp (bytes, as in the stubs:
+    2019-03-12T10:00:00Z) and returns the start date of its day, week (weeks
+    start on Monday) or month, as a string: 2019-03-12, 2019-03-11 or 2019-03-01
+    '''
+    if interval == 'day':
+        return lambda timestamp: timestamp[:10].decode('utf-8')
+    if interval == 'month':
+        return lambda timestamp: timestamp[:7].decode('utf-8') + '-01'
+    if interval == 'week':
+        # there are only a few thousand distinct days in any wiki's history
+        weeks = {}
+
+        def get_week(timestamp):
+            day = timestamp[:10]
+            if day not in weeks:
+                date = datetime.date(int(day[:4]), int(day[5:7]), int(day[8:10]))
+                weeks[day] = (date - datetime.timedelta(days=date.weekday())).isoformat()
+            return weeks[day]
+        return get_week
+    raise ValueError("unknown interval {interval}, expected one of {intervals}".format(
+        interval=interval, intervals=", ".join(INTERVALS)))
+
+
+class RevisionGrowth():
+    '''
+    count revisions and sum their byte lengths for each (interval start
+    date, namespace), for every page in every namespace. revisions with
+    no timestamp we can read are skipped; revisions with no byte length
+    (deleted text) are counted with a length of 0.
+
+    if outfile is given, the totals are written there once all pages are
+    in; otherwise this is a partial collector for some chunk of the input,
+    to be merged later
+    '''
+    def __init__(self, interval, cumulative=False, outfile=None):
+        self.interval = interval
+        self.cumulative = cumulative
+        self.outfile = outfile
+        self.get_bucket = get_bucket_getter(interval)
+        # (date, namespace) -> [revision count, byte length sum]
+        self.totals = {}
+
+    def __getstate__(self):
+        # the bucket getter may be a closure, which can't be pickled
+        # when this is handed back from a worker process
+        state = dict(self.__dict__)
+        del state['get_bucket']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.get_bucket = get_bucket_getter(self.interval)
+
+    def add_page(self, page):
+        '''
+        add the revisions of one page element
+        '''
+        ns_match = qstubscan.NS_RE.search(page)
+        if not ns_match:
+            return
+        namespace = int(ns_match.group(1))
+        for revision in qstubscan.get_revisions(page):
+            timestamp_match = qstubscan.TIMESTAMP_RE.search(revision)
+            if not timestamp_match or len(timestamp_match.group(1)) < 10:
+                continue
+            key = (self.get_bucket(timestamp_match.group(1)), namespace)
+            if key not in self.totals:
+                self.totals[key] = [0, 0]
+            self.totals[key][0] += 1
+            bytes_match = qstubscan.BYTES_RE.search(revision)
+            if bytes_match:
+                self.totals[key][1] += int(bytes_match.group(1))
+
+    def merge(self, other):
+        '''
+        add the totals from a collector that handled some other part of the input
+        '''
+        for key, (revs, length) in other.totals.items():
+            if key not in self.totals:
+                self.totals[key] = [0, 0]
+            self.totals[key][0] += revs
+            self.totals[key][1] += length
+
+    def get_lines(self):
+        '''
+        return the output lines: a commented header and then one line per
+        interval and namespace, oldest first, with whitespace-separated
+        fields so that gnuplot and awk can use them as is
+        '''
+        lines = ["# {interval} ns revs bytes{totals}\n".format(
+            interval=self.interval, totals=" total_revs total_bytes" if self.cumulative else "")]
+        running = {}
+        for (date, namespace) in sorted(self.totals):
+            revs, length = self.totals[(date, namespace)]
+            line = "{date} {ns} {revs} {length}".format(
+                date=date, ns=namespace, revs=revs, length=length)
+            if self.cumulative:
+                total_revs, total_length = running.get(namespace, (0, 0))
+                running[namespace] = (total_revs + revs, total_length + length)
+                line += " {revs} {length}".format(revs=running[namespace][0],
+                                                  length=running[namespace][1])
+            lines.append(line + "\n")
+        return lines
+
+    def finish(self):
+        '''
+        write out the totals, if we have somewhere to write them
+        '''
+        if self.outfile is None:
+            return
+        self.outfile.writelines(self.get_lines())
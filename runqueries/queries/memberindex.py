@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+the member index for a compressed dump file: the list of gzip members
+or bz2 streams in it, with their offsets, compressed and uncompressed
+sizes and crcs, kept in a sidecar json file next to it
+
+this is the one place that knows the sidecar file name and format;
+offset_test.py, pzcat.py and the stub scanners all go through here
+"""
+
+
+import json
+import os
+import sys
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+BZ2_MAGIC = b'BZh'
+# the member index for a file is cached in a file with this name
+# tacked onto the end
+INDEX_SUFFIX = ".members.json"
+
+
+def get_file_format(filename):
+    '''
+    return 'gz', 'bz2' or 'plain' depending on the file contents
+    '''
+    with open(filename, "rb") as infile:
+        magic = infile.read(len(BZ2_MAGIC))
+    if magic.startswith(GZIP_MAGIC):
+        return 'gz'
+    if magic.startswith(BZ2_MAGIC):
+        return 'bz2'
+    return 'plain'
+
+
+def get_index_path(filename):
+    '''
+    return the path of the sidecar file with the member index for a file
+    '''
+    return filename + INDEX_SUFFIX
+
+
+def read_member_index(filename):
+    '''
+    return the cached member index for the file as a list of dicts with
+    offset, csize, usize and crc, or None if there is none or it's for
+    some older version of the file (the size and mtime in ns are recorded
+    in the index to check this)
+    '''
+    try:
+        stat = os.stat(filename)
+        with open(get_index_path(filename), "r") as infile:
+            contents = json.load(infile)
+    except (OSError, ValueError):
+        return None
+    if contents.get('size') != stat.st_size or contents.get('mtime') != stat.st_mtime_ns:
+        return None
+    return [{'offset': offset, 'csize': csize, 'usize': usize, 'crc': crc}
+            for (offset, csize, usize, crc) in contents['members']]
+
+
+def write_member_index(filename, members):
+    '''
+    write the member index for the file to its sidecar file, so that
+    the next time it's wanted we don't have to read through the file again;
+    if we can't, no big deal, but say so on stderr
+    '''
+    index_path = get_index_path(filename)
+    try:
+        stat = os.stat(filename)
+        contents = {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                    'members': [[member['offset'], member['csize'], member['usize'],
+                                 member['crc']] for member in members]}
+        with open(index_path + ".tmp", "w") as outfile:
+            json.dump(contents, outfile)
+        os.replace(index_path + ".tmp", index_path)
+    except OSError as ex:
+        print("failed to write member index", index_path, "({err})".format(err=ex),
+              file=sys.stderr)
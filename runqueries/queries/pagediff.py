@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+compare per-page revision statistics from two dump runs: walk the
+two sets of rows in page id order at the same time and report the
+pages that were added or deleted and the ones whose revision count,
+byte total or namespace changed
+"""
+
+
+import queries.pagestats as qpagestats
+
+
+PAGE_ID = qpagestats.COLUMN_NAMES.index('page_id')
+NAMESPACE = qpagestats.COLUMN_NAMES.index('ns')
+REVS = qpagestats.COLUMN_NAMES.index('revs')
+TOTAL_BYTES = qpagestats.COLUMN_NAMES.index('total_bytes')
+
+
+def diff_rows(old_rows, new_rows):
+    '''
+    given two iterables of page stats rows (tuples of values in
+    pagestats.COLUMN_NAMES order) sorted by page id, yield
+    ('added', None, new row), ('deleted', old row, None) or
+    ('changed', old row, new row) in page id order; pages
+    with the same namespace, revision count and byte total
+    in both are yielded as ('same', old row, new row)
+    '''
+    old_rows = iter(old_rows)
+    new_rows = iter(new_rows)
+    old = next(old_rows, None)
+    new = next(new_rows, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[PAGE_ID] < new[PAGE_ID]):
+            yield 'deleted', old, None
+            old = next(old_rows, None)
+        elif old is None or new[PAGE_ID] < old[PAGE_ID]:
+            yield 'added', None, new
+            new = next(new_rows, None)
+        else:
+            if (old[NAMESPACE], old[REVS], old[TOTAL_BYTES]) != \
+                    (new[NAMESPACE], new[REVS], new[TOTAL_BYTES]):
+                yield 'changed', old, new
+            else:
+                yield 'same', old, new
+            old = next(old_rows, None)
+            new = next(new_rows, None)
+
+
+def format_diff(change, old, new):
+    '''
+    return the output line for one entry from diff_rows, or None for
+    pages that didn't change
+    '''
+    if change == 'same':
+        return None
+    row = new if new is not None else old
+    line = "{change} page:{page} ns:{ns} revs:{revs} bytes:{length}".format(
+        change=change, page=row[PAGE_ID], ns=row[NAMESPACE], revs=row[REVS],
+        length=row[TOTAL_BYTES])
+    if change == 'changed':
+        line += " old_ns:{ns} delta_revs:{revs:+d} delta_bytes:{length:+d}".format(
+            ns=old[NAMESPACE], revs=new[REVS] - old[REVS],
+            length=new[TOTAL_BYTES] - old[TOTAL_BYTES])
+    return line + "\n"
+
+
+class DiffTotals():
+    '''
+    keep count of added, deleted, changed and unchanged pages and
+    the net change in revisions and bytes across all of them
+    '''
+    def __init__(self):
+        self.counts = {'added': 0, 'deleted': 0, 'changed': 0, 'same': 0}
+        self.delta_revs = 0
+        self.delta_bytes = 0
+
+    def add(self, change, old, new):
+        '''
+        add one entry from diff_rows
+        '''
+        self.counts[change] += 1
+        if old is not None:
+            self.delta_revs -= old[REVS]
+            self.delta_bytes -= old[TOTAL_BYTES]
+        if new is not None:
+            self.delta_revs += new[REVS]
+            self.delta_bytes += new[TOTAL_BYTES]
+
+    def format(self):
+        '''
+        return the totals as an output line
+        '''
+        return ("totals added:{added} deleted:{deleted} changed:{changed} unchanged:{same} "
+                "delta_revs:{revs:+d} delta_bytes:{length:+d}\n").format(
+                    revs=self.delta_revs, length=self.delta_bytes, **self.counts)
+
+
+def write_diff(old_rows, new_rows, outfile):
+    '''
+    write out the differences between the two sorted sets of page stats
+    rows, one line per page that changed, followed by a line of totals
+    '''
+    totals = DiffTotals()
+    for change, old, new in diff_rows(old_rows, new_rows):
+        totals.add(change, old, new)
+        line = format_diff(change, old, new)
+        if line is not None:
+            outfile.write(line)
+    outfile.write(totals.format())
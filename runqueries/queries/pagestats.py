@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+write and read per-page revision statistics as fixed-width
+columns, one .npy file per column plus a small json schema,
+so that other tools can memory-map them instead of parsing
+revsperpage text output
+
+the .npy files can be loaded by numpy directly (numpy.load with
+mmap_mode='r'), but numpy is not needed to write or read them
+"""
+
+
+import array
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from itertools import islice
+import queries.stubscan as qstubscan
+import queries.stubchunks as qstubchunks
+
+
+SCHEMA_FORMAT = 'revsperpage-columns'
+SCHEMA_VERSION = 1
+# name, array typecode, npy dtype, key in page stats
+COLUMNS = [
+    ('page_id', 'q', '<i8', 'id'),
+    ('ns', 'i', '<i4', 'ns'),
+    ('revs', 'q', '<i8', 'revs'),
+    ('total_bytes', 'q', '<i8', 'bytes'),
+    ('max_revlen', 'q', '<i8', 'maxrevlen'),
+]
+COLUMN_NAMES = [name for (name, _typecode, _dtype, _key) in COLUMNS]
+# one row of all the columns, for sorting rows on disk
+ROW_STRUCT = struct.Struct('<' + ''.join(typecode for (_name, typecode, _dtype, _key) in COLUMNS))
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+# the npy header is written before we know how many rows there are, so
+# it's always this long, padded with spaces, and gets rewritten at the end
+NPY_HEADER_LEN = 128
+# write columns out to disk every this many rows
+FLUSH_ROWS = 1000000
+# how many rows get sorted in memory at once when the columns aren't in page id order
+SORT_RUN_ROWS = 1000000
+
+
+def get_npy_header(dtype, rows):
+    '''
+    return an npy format 1.0 header for a one-dimensional array
+    with the given dtype and number of rows
+    '''
+    header = "{{'descr': '{dtype}', 'fortran_order': False, 'shape': ({rows},), }}".format(
+        dtype=dtype, rows=rows).encode('latin1')
+    padding = NPY_HEADER_LEN - len(NPY_MAGIC) - 2 - len(header) - 1
+    return NPY_MAGIC + (NPY_HEADER_LEN - len(NPY_MAGIC) - 2).to_bytes(2, 'little') + \
+        header + b' ' * padding + b'\n'
+
+
+def get_column_path(prefix, name):
+    '''
+    return the path of the npy file for the given column
+    '''
+    return "{prefix}.{name}.npy".format(prefix=prefix, name=name)
+
+
+def get_schema_path(prefix):
+    '''
+    return the path of the json schema for the columns
+    '''
+    return prefix + ".schema.json"
+
+
+def new_columns():
+    '''
+    return a dict of empty arrays, one per column
+    '''
+    return {name: array.array(typecode) for (name, typecode, _dtype, _key) in COLUMNS}
+
+
+class PageStatsColumns():
+    '''
+    collect page stats into columns, for the same pages that revsperpage
+    would display with the given settings (batching is not supported).
+
+    if prefix is given, the columns are written to <prefix>.<column>.npy
+    with the schema in <prefix>.schema.json; otherwise this is a partial
+    collector for some chunk of the input, keeping the columns in memory
+    to be merged later
+    '''
+    def __init__(self, settings, prefix=None):
+        if settings['batch']:
+            raise ValueError("batching is not supported for columnar output")
+        self.settings = settings
+        self.prefix = prefix
+        self.columns = new_columns()
+        self.rows = 0
+        self.outfiles = {}
+        if prefix is not None:
+            for (name, _typecode, dtype, _key) in COLUMNS:
+                self.outfiles[name] = open(get_column_path(prefix, name), "wb")
+                self.outfiles[name].write(get_npy_header(dtype, 0))
+
+    def add_page(self, page):
+        '''
+        get the stats for one page element and add them
+        '''
+        self.add_stats(qstubscan.get_page_stats(page, self.settings['all']))
+
+    def add_block(self, block):
+        '''
+        get the stats for each page in a run of complete page elements and add them
+        '''
+        for stats in qstubscan.get_block_stats(block, self.settings['all'], want_bytes=True):
+            self.add_stats(stats)
+
+    def add_stats(self, stats):
+        '''
+        add one page's stats, if revsperpage would display them
+        '''
+        if not stats['revs'] or stats['revs'] <= self.settings['cutoff']:
+            return
+        for (name, _typecode, _dtype, key) in COLUMNS:
+            self.columns[name].append(stats[key])
+        self.rows += 1
+        if self.prefix is not None and len(self.columns['page_id']) >= FLUSH_ROWS:
+            self.flush()
+
+    def merge(self, other):
+        '''
+        add the columns from a collector that handled the next part of the input
+        '''
+        for (name, _typecode, _dtype, _key) in COLUMNS:
+            self.columns[name].extend(other.columns[name])
+        self.rows += other.rows
+        if self.prefix is not None and len(self.columns['page_id']) >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        '''
+        write out the rows we have so far
+        '''
+        for (name, _typecode, _dtype, _key) in COLUMNS:
+            if sys.byteorder != 'little':
+                self.columns[name].byteswap()
+            self.columns[name].tofile(self.outfiles[name])
+        self.columns = new_columns()
+
+    def finish(self):
+        '''
+        write out the rest of the rows, fix up the npy headers
+        with the final row count and write the schema
+        '''
+        if self.prefix is None:
+            return
+        self.flush()
+        for (name, _typecode, dtype, _key) in COLUMNS:
+            self.outfiles[name].seek(0)
+            self.outfiles[name].write(get_npy_header(dtype, self.rows))
+            self.outfiles[name].close()
+        schema = {'format': SCHEMA_FORMAT, 'version': SCHEMA_VERSION, 'rows': self.rows,
+                  'settings': {'all': self.settings['all'], 'cutoff': self.settings['cutoff']},
+                  'columns': [{'name': name, 'dtype': dtype,
+                               'file': os.path.basename(get_column_path(self.prefix, name))}
+                              for (name, _typecode, dtype, _key) in COLUMNS]}
+        with open(get_schema_path(self.prefix), "w") as outfile:
+            json.dump(schema, outfile, indent=2)
+
+
+def read_schema(prefix):
+    '''
+    read and check the schema for the columns with the given prefix
+    '''
+    with open(get_schema_path(prefix), "r") as infile:
+        schema = json.load(infile)
+    if schema.get('format') != SCHEMA_FORMAT or schema.get('version') != SCHEMA_VERSION:
+        raise ValueError("{path} is not a schema for revsperpage columns".format(
+            path=get_schema_path(prefix)))
+    return schema
+
+
+def load_columns(prefix):
+    '''
+    memory-map the columns with the given prefix, returning the
+    schema and a dict of column name and read-only memoryview
+    of its values; numpy.asarray() will take these as is
+    '''
+    schema = read_schema(prefix)
+    typecodes = {name: typecode for (name, typecode, _dtype, _key) in COLUMNS}
+    columns = {}
+    for column in schema['columns']:
+        path = os.path.join(os.path.dirname(prefix), column['file'])
+        with open(path, "rb") as infile:
+            if schema['rows']:
+                mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+                columns[column['name']] = memoryview(mapped)[NPY_HEADER_LEN:].cast(
+                    typecodes[column['name']])
+            else:
+                columns[column['name']] = memoryview(array.array(typecodes[column['name']]))
+        if len(columns[column['name']]) != schema['rows']:
+            raise ValueError("{path} has the wrong number of rows".format(path=path))
+    return schema, columns
+
+
+def write_columns_from_stubs(filename, jobs, prefix):
+    '''
+    count revisions per page for all namespaces in the stubs file,
+    using jobs processes, and write them as columns with the given prefix
+    '''
+    settings = qstubscan.get_default_settings()
+    settings['all'] = True
+    collector = PageStatsColumns(settings, prefix)
+    if jobs > 1:
+        qstubchunks.scan_parallel(filename, jobs, collector, PageStatsColumns, (settings,))
+    else:
+        with qstubchunks.open_input(filename) as infile:
+            qstubscan.scan_pages(infile, collector)
+
+
+def is_sorted(values):
+    '''
+    return True if the values are in strictly increasing order
+    '''
+    return all(first < second for first, second in zip(values, islice(values, 1, None)))
+
+
+def write_sorted_run(rows, tmpdir):
+    '''
+    sort the rows and write them to an anonymous temp file, returning the file
+    '''
+    outfile = tempfile.TemporaryFile(dir=tmpdir)
+    for row in sorted(rows):
+        outfile.write(ROW_STRUCT.pack(*row))
+    outfile.seek(0)
+    return outfile
+
+
+def read_sorted_run(infile):
+    '''
+    yield the rows from a temp file written by write_sorted_run, closing it when done
+    '''
+    with infile:
+        while True:
+            data = infile.read(ROW_STRUCT.size * 65536)
+            if not data:
+                break
+            yield from ROW_STRUCT.iter_unpack(data)
+
+
+def get_sorted_rows(prefix, tmpdir=None):
+    '''
+    yield the rows of the columns with the given prefix as tuples of values
+    in COLUMN_NAMES order, sorted by page id. if they aren't already in
+    that order, they are sorted in runs of SORT_RUN_ROWS written to temp
+    files in tmpdir and then merged, so memory use stays bounded
+    '''
+    _schema, columns = load_columns(prefix)
+    values = [columns[name] for name in COLUMN_NAMES]
+    if is_sorted(columns['page_id']):
+        yield from zip(*values)
+        return
+    runs = [write_sorted_run(zip(*[column[start:start + SORT_RUN_ROWS] for column in values]),
+                             tmpdir)
+            for start in range(0, len(columns['page_id']), SORT_RUN_ROWS)]
+    yield from heapq.merge(*[read_sorted_run(run) for run in runs])
+
+
+def sort_columns(prefix, outprefix, tmpdir=None):
+    '''
+    return the prefix of columns with the rows of the columns with the given
+    prefix in page id order: the same prefix if they are in order already,
+    otherwise outprefix, once the sorted rows have been written there. this
+    is for callers that go through the sorted rows more than once, so that
+    the sort is done only once
+    '''
+    schema, columns = load_columns(prefix)
+    if is_sorted(columns['page_id']):
+        return prefix
+    settings = qstubscan.get_default_settings()
+    settings.update(schema['settings'])
+    collector = PageStatsColumns(settings, outprefix)
+    keys = [key for (_name, _typecode, _dtype, key) in COLUMNS]
+    for row in get_sorted_rows(prefix, tmpdir):
+        collector.add_stats(dict(zip(keys, row)))
+    collector.finish()
+    return outprefix
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+split a wiki's pages into contiguous page id ranges for parallel
+dump jobs so that the most expensive range (by estimated cost,
+the sum of revision byte lengths or the number of revisions of
+its pages) is as cheap as possible, instead of splitting by
+page count and leaving one job with all the monster pages
+"""
+
+
+import array
+from bisect import bisect_right
+import queries.pagestats as qpagestats
+
+
+COSTS = {'bytes': qpagestats.COLUMN_NAMES.index('total_bytes'),
+         'revs': qpagestats.COLUMN_NAMES.index('revs')}
+PAGE_ID = qpagestats.COLUMN_NAMES.index('page_id')
+REVS = qpagestats.COLUMN_NAMES.index('revs')
+TOTAL_BYTES = qpagestats.COLUMN_NAMES.index('total_bytes')
+
+
+def get_prefix_sums(rows, cost):
+    '''
+    given page stats rows in page id order, return an array of the
+    running total of the cost for the pages, starting with 0, so that
+    the cost of pages i through j-1 is sums[j] - sums[i]
+    '''
+    index = COSTS[cost]
+    sums = array.array('q', [0])
+    total = 0
+    for row in rows:
+        total += row[index]
+        sums.append(total)
+    return sums
+
+
+def get_range_ends(sums, maxcost, maxranges):
+    '''
+    greedily fill ranges with as many pages as fit under maxcost and
+    return the list of (exclusive) end indexes of the ranges, or None
+    if that takes more than maxranges ranges. maxcost must be at least
+    the cost of the most expensive page
+    '''
+    ends = []
+    start = 0
+    pages = len(sums) - 1
+    while start < pages:
+        if len(ends) == maxranges:
+            return None
+        start = bisect_right(sums, sums[start] + maxcost, start + 1) - 1
+        ends.append(start)
+    return ends
+
+
+def get_max_page_cost(sums):
+    '''
+    return the cost of the most expensive single page
+    '''
+    return max((sums[index + 1] - sums[index] for index in range(len(sums) - 1)), default=0)
+
+
+def plan_ranges(sums, maxranges, maxcost=None):
+    '''
+    return the (exclusive) end indexes of at most maxranges contiguous
+    ranges of pages such that the cost of the most expensive range is
+    as small as it can be. if maxcost is given, ranges are kept under
+    that cost instead, as long as that takes no more than maxranges
+    ranges; if it would take more, the cap on ranges wins.
+
+    this binary searches on the cost of the most expensive range; each
+    try takes one bisect per range, not one step per page
+    '''
+    low = max(get_max_page_cost(sums), 1)
+    if maxcost is not None and maxcost >= low:
+        ends = get_range_ends(sums, maxcost, maxranges)
+        if ends is not None:
+            return ends
+    high = max(sums[-1], low)
+    while low < high:
+        middle = (low + high) // 2
+        if get_range_ends(sums, middle, maxranges) is None:
+            low = middle + 1
+        else:
+            high = middle
+    return get_range_ends(sums, low, maxranges)
+
+
+def get_ranges(rows, ends):
+    '''
+    given the page stats rows in page id order (the same ones the ends were
+    computed from) and the range end indexes, return a list of dicts with the
+    first and last page id, the number of pages, revisions and bytes for each
+    range. ranges cover all page ids with no gaps: the first starts at page
+    id 1 and each one after starts right after the last page of the one before
+    '''
+    ranges = []
+    current = None
+    ends = iter(ends)
+    end = next(ends, None)
+    for index, row in enumerate(rows):
+        if current is None:
+            current = {'start': ranges[-1]['end'] + 1 if ranges else 1,
+                       'pages': 0, 'revs': 0, 'bytes': 0}
+        current['end'] = row[PAGE_ID]
+        current['pages'] += 1
+        current['revs'] += row[REVS]
+        current['bytes'] += row[TOTAL_BYTES]
+        if index + 1 == end:
+            ranges.append(current)
+            current = None
+            end = next(ends, None)
+    return ranges
+
+
+def format_range(page_range):
+    '''
+    return the output line for one range: production style p<start>p<end>
+    boundaries, then the number of pages, revisions and bytes in it
+    '''
+    return "p{start}p{end} pages:{pages} revs:{revs} bytes:{bytes}\n".format(**page_range)
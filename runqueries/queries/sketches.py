@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+small, mergeable summaries of streams that are too big to count
+exactly: Space-Saving counters for the most frequent items and
+HyperLogLog for the number of distinct items, plus a stub collector
+that uses them for revision contributors
+
+error bounds, for a stream of N items:
+
+Space-Saving with m counters: every item that occurs more than N/m
+times is among the counters, and no count is more than N/m too high
+(each counter also tracks its own, usually much smaller, bound); a
+count is never too low. merging two summaries keeps this, with N the
+sum of both streams
+
+HyperLogLog with 2^p registers: the standard error of the estimate
+is about 1.04/sqrt(2^p), so 0.81% for the default p of 14, and the
+estimate is within three times that almost always; merging is exact
+(the merged sketch is the one we'd have gotten from the whole stream)
+"""
+
+
+import hashlib
+import heapq
+import math
+import queries.stubscan as qstubscan
+
+
+DEFAULT_COUNTERS = 10000
+DEFAULT_PRECISION = 14
+
+
+class SpaceSaving():
+    '''
+    keep approximate counts for the most frequent items using at most
+    capacity counters; each count is an overestimate by no more than
+    the error recorded with it
+    '''
+    def __init__(self, capacity=DEFAULT_COUNTERS):
+        self.capacity = capacity
+        self.total = 0
+        # item -> [count, error]
+        self.counters = {}
+        # (count, item) for every counter, possibly stale (too low): counts only
+        # go up, so entries are fixed up when they turn up at the top of the heap
+        self.heap = []
+
+    def get_min_item(self):
+        '''
+        return the item with the smallest count, fixing up stale heap entries on the way
+        '''
+        while True:
+            count, item = self.heap[0]
+            if self.counters[item][0] == count:
+                return item
+            heapq.heapreplace(self.heap, (self.counters[item][0], item))
+
+    def add(self, item, count=1):
+        '''
+        count count more occurrences of the item
+        '''
+        self.total += count
+        if item in self.counters:
+            self.counters[item][0] += count
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [count, 0]
+            heapq.heappush(self.heap, (count, item))
+        else:
+            # the new item takes over the smallest counter, and might have
+            # occurred as many times as that counter's item did
+            evicted = self.get_min_item()
+            min_count = self.counters.pop(evicted)[0]
+            self.counters[item] = [min_count + count, min_count]
+            heapq.heapreplace(self.heap, (min_count + count, item))
+
+    def get_min_count(self):
+        '''
+        return the most times an item we aren't counting might have occurred
+        '''
+        if len(self.counters) < self.capacity:
+            return 0
+        return self.counters[self.get_min_item()][0]
+
+    def merge(self, other):
+        '''
+        add in the counts from a summary of some other part of the stream. an item
+        missing from one summary might have occurred as often as that summary's
+        smallest count, so that much is added to its count and its error
+        '''
+        own_min = self.get_min_count()
+        other_min = other.get_min_count()
+        merged = {}
+        for item, (count, error) in self.counters.items():
+            if item in other.counters:
+                other_count, other_error = other.counters[item]
+                merged[item] = [count + other_count, error + other_error]
+            else:
+                merged[item] = [count + other_min, error + other_min]
+        for item, (count, error) in other.counters.items():
+            if item not in self.counters:
+                merged[item] = [count + own_min, error + own_min]
+        kept = heapq.nlargest(self.capacity, merged.items(), key=lambda entry: entry[1][0])
+        self.counters = {item: values for item, values in kept}
+        self.heap = [(values[0], item) for item, values in kept]
+        heapq.heapify(self.heap)
+        self.total += other.total
+
+    def get_top(self, count):
+        '''
+        return a list of (item, count, error) for the count items with the
+        largest counts, largest first; ties are broken by item
+        '''
+        return [(item, values[0], values[1]) for item, values in sorted(
+            self.counters.items(), key=lambda entry: (-entry[1][0], entry[0]))[:count]]
+
+    def get_error_bound(self):
+        '''
+        return the most that any count can be too high by
+        '''
+        return self.total // self.capacity
+
+
+class HyperLogLog():
+    '''
+    estimate the number of distinct items seen, with 2^precision one-byte registers
+    '''
+    def __init__(self, precision=DEFAULT_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, item):
+        '''
+        note that we have seen the item (bytes)
+        '''
+        value = int.from_bytes(hashlib.blake2b(item, digest_size=8).digest(), 'big')
+        register = value >> (64 - self.precision)
+        # position of the first 1 bit in what's left of the hash
+        rank = 64 - self.precision - (value & ((1 << (64 - self.precision)) - 1)).bit_length() + 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def merge(self, other):
+        '''
+        add in the items seen by another sketch with the same precision
+        '''
+        if other.precision != self.precision:
+            raise ValueError("can't merge HyperLogLog sketches with different precisions")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        '''
+        return the estimated number of distinct items seen
+        '''
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        raw = alpha * size * size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * size and zeros:
+            # for small counts, counting empty registers does better
+            return round(size * math.log(size / zeros))
+        return round(raw)
+
+    def get_relative_error(self):
+        '''
+        return the standard error of the estimate, relative to the true count
+        '''
+        return 1.04 / math.sqrt(len(self.registers))
+
+
+def get_contributor(revision):
+    '''
+    return b'user:<username>' or b'ip:<address>' for the contributor of the
+    revision element contents, or None if there's no contributor we can name
+    '''
+    match = qstubscan.CONTRIBUTOR_RE.search(revision)
+    if not match:
+        return None
+    username = qstubscan.USERNAME_RE.search(match.group(1))
+    if username:
+        return b'user:' + username.group(1)
+    address = qstubscan.IP_RE.search(match.group(1))
+    if address:
+        return b'ip:' + address.group(1)
+    return None
+
+
+class ContributorSketches():
+    '''
+    for every revision in every namespace, count its contributor in a
+    Space-Saving summary and add it to a HyperLogLog sketch for the
+    namespace and one for all namespaces. revisions with deleted
+    contributors are skipped.
+
+    if outfile is given, the results are written there once all pages are
+    in; otherwise this is a partial collector for some chunk of the input,
+    to be merged later
+    '''
+    def __init__(self, topk, counters=DEFAULT_COUNTERS, precision=DEFAULT_PRECISION,
+                 outfile=None):
+        self.topk = topk
+        self.precision = precision
+        self.outfile = outfile
+        self.top = SpaceSaving(max(counters, topk))
+        self.distinct = HyperLogLog(precision)
+        self.distinct_by_ns = {}
+
+    def add_page(self, page):
+        '''
+        add the contributors of one page element
+        '''
+        ns_match = qstubscan.NS_RE.search(page)
+        if not ns_match:
+            return
+        namespace = int(ns_match.group(1))
+        if namespace not in self.distinct_by_ns:
+            self.distinct_by_ns[namespace] = HyperLogLog(self.precision)
+        distinct_ns = self.distinct_by_ns[namespace]
+        for revision in qstubscan.get_revisions(page):
+            contributor = get_contributor(revision)
+            if contributor is None:
+                continue
+            self.top.add(contributor)
+            self.distinct.add(contributor)
+            distinct_ns.add(contributor)
+
+    def merge(self, other):
+        '''
+        add in the sketches from a collector that handled some other part of the input
+        '''
+        self.top.merge(other.top)
+        self.distinct.merge(other.distinct)
+        for namespace, sketch in other.distinct_by_ns.items():
+            if namespace not in self.distinct_by_ns:
+                self.distinct_by_ns[namespace] = HyperLogLog(self.precision)
+            self.distinct_by_ns[namespace].merge(sketch)
+
+    def get_lines(self):
+        '''
+        return the output lines: commented lines with the error bounds, the
+        top contributors, then the distinct contributor counts
+        '''
+        lines = [
+            "# revisions:{total} counters:{counters} max_count_error:{bound}\n".format(
+                total=self.top.total, counters=self.top.capacity,
+                bound=self.top.get_error_bound()),
+            "# distinct_relative_std_error:{error:.4f}\n".format(
+                error=self.distinct.get_relative_error())]
+        for rank, (contributor, count, error) in enumerate(self.top.get_top(self.topk)):
+            lines.append("topk rank:{rank} revs:{count} error:{error} contributor:{name}\n".format(
+                rank=rank + 1, count=count, error=error,
+                name=contributor.decode('utf-8', errors='replace')))
+        for namespace in sorted(self.distinct_by_ns):
+            lines.append("distinct ns:{ns} contributors:{count}\n".format(
+                ns=namespace, count=self.distinct_by_ns[namespace].estimate()))
+        lines.append("distinct ns:all contributors:{count}\n".format(
+            count=self.distinct.estimate()))
+        return lines
+
+    def finish(self):
+        '''
+        write out the results, if we have somewhere to write them
+        '''
+        if self.outfile is None:
+            return
+        self.outfile.writelines(self.get_lines())
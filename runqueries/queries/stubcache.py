@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+keep results from scanning dump stub files, and the list of dump
+run dates for each wiki, in a local cache directory so that we
+don't have to reread an enormous stubs file that hasn't changed
+"""
+
+
+import json
+import os
+import time
+
+
+# how long a listing of run dates for a wiki is good for, in seconds
+RUNDATES_MAX_AGE = 24 * 60 * 60
+CACHE_VERSION = 2
+
+
+class StubCache():
+    '''
+    cache of stub scan results keyed by wiki, dump run date and the
+    size and mtime of the stubs file, plus run date listings per wiki,
+    all kept as small json files in <cachedir>/<wiki>/
+
+    if cachedir is empty, nothing is cached and every lookup misses
+    '''
+    def __init__(self, cachedir, wiki):
+        self.cachedir = cachedir
+        self.wiki = wiki
+
+    def get_path(self, name):
+        '''
+        return the path to the cache file with the given name for our wiki
+        '''
+        return os.path.join(self.cachedir, self.wiki, name + ".json")
+
+    def read(self, name):
+        '''
+        return the contents of the cache file with the given name,
+        or None if there isn't one or it's unreadable or from some
+        other version of this code
+        '''
+        if not self.cachedir:
+            return None
+        try:
+            with open(self.get_path(name), "r") as infile:
+                contents = json.load(infile)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(contents, dict) or contents.get('version') != CACHE_VERSION:
+            return None
+        return contents
+
+    def write(self, name, contents):
+        '''
+        write the contents to the cache file with the given name,
+        replacing the old file only once the new one is complete
+        '''
+        if not self.cachedir:
+            return
+        path = self.get_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        contents = dict(contents, version=CACHE_VERSION)
+        with open(path + ".tmp", "w") as outfile:
+            json.dump(contents, outfile, indent=2, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+    def get_rundates(self):
+        '''
+        return the cached list of run dates for the wiki, or
+        None if we don't have one or it's too old
+        '''
+        contents = self.read('rundates')
+        if contents is None or time.time() - contents.get('fetched', 0) > RUNDATES_MAX_AGE:
+            return None
+        return contents['rundates']
+
+    def set_rundates(self, rundates):
+        '''
+        save the list of run dates for the wiki
+        '''
+        self.write('rundates', {'fetched': int(time.time()), 'rundates': rundates})
+
+    def get_stub_results(self, rundate, size, mtime):
+        '''
+        return the cached results of scanning the stubs file for the run date,
+        or None if we have none or the file has changed since
+        '''
+        contents = self.read('stubs-' + rundate)
+        if contents is None or contents.get('size') != size or contents.get('mtime') != mtime:
+            return None
+        return contents['results']
+
+    def set_stub_results(self, rundate, size, mtime, results):
+        '''
+        save the results (a dict) of scanning the stubs file for the run date,
+        which has the given size and mtime
+        '''
+        self.write('stubs-' + rundate, {'rundate': rundate, 'size': size, 'mtime': mtime,
+                                        'results': results})
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+split stub xml input into chunks that can be scanned by separate
+worker processes, and stitch the results back together in order,
+including the pages that straddle two (or more) chunks
+
+chunks are runs of gzip members or bz2 streams when there is a
+member index for the file (the .members.json file that offset_test.py
+and pzcat.py write), byte ranges for uncompressed files, and
+otherwise blocks of decompressed data read by the main process
+"""
+
+
+import bz2
+import gzip
+import io
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import queries.memberindex as qmemberindex
+import queries.stubscan as qstubscan
+
+
+# how much compressed (or uncompressed, for plain xml) data goes into each chunk
+CHUNKSIZE = 64 * 1024 * 1024
+# how much decompressed data goes into each chunk when the main process
+# has to do the decompressing
+DATA_CHUNKSIZE = 32 * 1024 * 1024
+
+
+class RangeReader(io.RawIOBase):
+    '''
+    read only the given byte range of a file
+    '''
+    def __init__(self, filename, start, end):
+        super().__init__()
+        self.fdesc = os.open(filename, os.O_RDONLY)
+        self.position = start
+        self.end = end
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = min(len(buffer), self.end - self.position)
+        if count <= 0:
+            return 0
+        data = os.pread(self.fdesc, count, self.position)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            os.close(self.fdesc)
+        super().close()
+
+
+def get_chunk_ranges(filename, file_format):
+    '''
+    return a list of (start, end) byte ranges of the file that can be
+    read independently, each about CHUNKSIZE long, or None if the file
+    can't be split up that way
+    '''
+    if file_format == 'plain':
+        size = os.stat(filename).st_size
+        return [(start, min(start + CHUNKSIZE, size)) for start in range(0, size, CHUNKSIZE)]
+    members = qmemberindex.read_member_index(filename)
+    if members is None:
+        return None
+    ranges = []
+    for member in members:
+        offset, csize = member['offset'], member['csize']
+        if ranges and ranges[-1][1] - ranges[-1][0] < CHUNKSIZE:
+            ranges[-1] = (ranges[-1][0], offset + csize)
+        else:
+            ranges.append((offset, offset + csize))
+    return ranges
+
+
+def open_range(filename, file_format, start, end):
+    '''
+    return a binary file object with the decompressed contents of
+    the given range of the file
+    '''
+    reader = io.BufferedReader(RangeReader(filename, start, end))
+    if file_format == 'gz':
+        return gzip.GzipFile(fileobj=reader)
+    if file_format == 'bz2':
+        return bz2.BZ2File(reader)
+    return reader
+
+
+def open_input(filename):
+    '''
+    return a binary file object with the decompressed contents of the file,
+    or of stdin if no filename is given
+    '''
+    if filename is None or filename == '-':
+        # a file object of our own for stdin, so that closing it when the
+        # caller is done doesn't close stdin
+        return open(sys.stdin.fileno(), "rb", closefd=False)
+    file_format = qmemberindex.get_file_format(filename)
+    if file_format == 'gz':
+        return gzip.open(filename, "rb")
+    if file_format == 'bz2':
+        return bz2.open(filename, "rb")
+    return open(filename, "rb")
+
+
+def scan_chunk(infile, collector, blocksize=qstubscan.BLOCKSIZE):
+    '''
+    hand all complete pages in the chunk to the collector. return everything
+    before the first page start (the end of some page from an earlier chunk,
+    or the xml header), whether there was a page start at all, and everything
+    after the last complete page (the start of some page that continues into
+    a later chunk, or the xml footer)
+    '''
+    head = []
+    carry = b''
+    while True:
+        data = infile.read(blocksize)
+        if not data:
+            head.append(carry)
+            return b''.join(head), False, b''
+        buffer = carry + data
+        index = buffer.find(qstubscan.PAGE_START)
+        if index >= 0:
+            head.append(buffer[:index])
+            pending = buffer[index:]
+            break
+        # keep enough around to find a start tag that got cut in half
+        keep = len(qstubscan.PAGE_START) - 1
+        head.append(buffer[:-keep])
+        carry = buffer[-keep:]
+    reader = qstubscan.PageReader(infile, blocksize, pending)
+    for block in reader.blocks():
+        qstubscan.add_block(collector, block)
+    return b''.join(head), True, reader.carry
+
+
+def scan_range(filename, file_format, start, end, collector_factory, factory_args):
+    '''
+    worker: scan one byte range of a file, return the head, whether
+    there was a page start, the tail and the collector
+    '''
+    collector = collector_factory(*factory_args)
+    with open_range(filename, file_format, start, end) as infile:
+        head, has_start, tail = scan_chunk(infile, collector)
+    return head, has_start, tail, collector
+
+
+def scan_data(data, collector_factory, factory_args):
+    '''
+    worker: scan one block of decompressed data, return the head,
+    whether there was a page start, the tail and the collector
+    '''
+    collector = collector_factory(*factory_args)
+    head, has_start, tail = scan_chunk(io.BytesIO(data), collector)
+    return head, has_start, tail, collector
+
+
+def read_data_chunks(infile):
+    '''
+    yield blocks of decompressed data from the file object
+    '''
+    while True:
+        data = infile.read(DATA_CHUNKSIZE)
+        if not data:
+            break
+        yield data
+
+
+def merge_results(results, collector):
+    '''
+    given the results from scanning each chunk in order, stitch together
+    the pages that cross chunk boundaries and hand them to the collector,
+    then merge in the chunk results, all in order
+    '''
+    pending = b''
+    for head, has_start, tail, chunk_collector in results:
+        pending += head
+        if not has_start:
+            # some enormous page that covers this entire chunk
+            continue
+        for page in qstubscan.get_pages(io.BytesIO(pending)):
+            collector.add_page(page)
+        collector.merge(chunk_collector)
+        pending = tail
+    for page in qstubscan.get_pages(io.BytesIO(pending)):
+        collector.add_page(page)
+    collector.finish()
+
+
+def get_ordered_results(executor, tasks, jobs):
+    '''
+    submit (function, args) tasks to the executor, keeping only a limited
+    number in flight, and yield their results in order
+    '''
+    pending = deque()
+    for function, args in tasks:
+        if len(pending) >= 2 * jobs:
+            yield pending.popleft().result()
+        pending.append(executor.submit(function, *args))
+    while pending:
+        yield pending.popleft().result()
+
+
+def scan_parallel(filename, jobs, collector, collector_factory, factory_args):
+    '''
+    scan the stub file (or stdin if no filename is given) with jobs worker
+    processes, each of which creates its own collector by calling
+    collector_factory(*factory_args); the results of all of these are
+    merged in order into collector
+    '''
+    file_format = None
+    ranges = None
+    if filename is not None and filename != '-':
+        file_format = qmemberindex.get_file_format(filename)
+        ranges = get_chunk_ranges(filename, file_format)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        if ranges is not None:
+            tasks = ((scan_range, (filename, file_format, start, end,
+                                   collector_factory, factory_args))
+                     for (start, end) in ranges)
+            merge_results(get_ordered_results(executor, tasks, jobs), collector)
+        else:
+            with open_input(filename) as infile:
+                tasks = ((scan_data, (data, collector_factory, factory_args))
+                         for data in read_data_chunks(infile))
+                merge_results(get_ordered_results(executor, tasks, jobs), collector)
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""
+read through MediaWiki xml stub files in large blocks and
+collect per-page revision statistics, the same ones the
+revsperpage C utility produces
+"""
+
+
+import re
+
+
+# how much we read at once from the stub stream
+BLOCKSIZE = 16 * 1024 * 1024
+PAGE_START = b'<page>'
+PAGE_END = b'</page>'
+REVISION_START = b'<revision>'
+# only text elements have a bytes attribute in stub files
+TEXT_BYTES = b' bytes="'
+# the title, ns and page id come right after the page start in every stub
+# file; a page without them is still found, so that its revisions don't end
+# up counted for the page before it
+PAGE_HEAD_RE = re.compile(
+    rb'<page>(?:\s*<title>([^<]*)</title>\s*<ns>(-?\d+)</ns>\s*<id>(\d+)</id>)?')
+TEXT_BYTES_RE = re.compile(rb' bytes="(\d+)"')
+NS_RE = re.compile(rb'<ns>(-?\d+)</ns>')
+ID_RE = re.compile(rb'<id>(\d+)</id>')
+TITLE_RE = re.compile(rb'<title>(.*?)</title>')
+# typical entry in stubs used to be: <text id="11453" bytes="4837" />
+# then: <text xml:space="preserve" bytes="141920" id="87207" />
+# now: <text bytes="2052" id="335706323" />
+BYTES_RE = re.compile(rb'<text[^>]* bytes="(\d+)"')
+REVID_RE = re.compile(rb'<revision>\s*<id>(\d+)</id>')
+TIMESTAMP_RE = re.compile(rb'<timestamp>([^<]*)</timestamp>')
+CONTRIBUTOR_RE = re.compile(rb'<contributor>(.*?)</contributor>', re.DOTALL)
+USERNAME_RE = re.compile(rb'<username>([^<]*)</username>')
+IP_RE = re.compile(rb'<ip>([^<]*)</ip>')
+
+
+class PageReader():
+    '''
+    read stub xml from a (binary) file object in big blocks and
+    yield the contents of each <page>...</page> element in turn,
+    or, from blocks(), each run of complete page elements read in
+    at once; whatever is left over after the last complete page is
+    in carry once we are done
+    '''
+    def __init__(self, infile, blocksize=BLOCKSIZE, pending=b''):
+        self.infile = infile
+        self.blocksize = blocksize
+        self.carry = pending
+
+    def __iter__(self):
+        for block in self.blocks():
+            yield from split_pages(block)
+
+    def blocks(self):
+        '''
+        yield the data from the start of the first complete page through the
+        end of the last one, for each block of input, skipping blocks where
+        no page ends
+        '''
+        while True:
+            data = self.infile.read(self.blocksize)
+            if not data and not self.carry:
+                break
+            buffer = self.carry + data if self.carry else data
+            self.carry = b''
+            first_start = buffer.find(PAGE_START)
+            if first_start < 0:
+                # keep enough around to find a start tag that got cut in half
+                self.carry = buffer[max(0, len(buffer) - len(PAGE_START) + 1):]
+            else:
+                last_end = buffer.rfind(PAGE_END, first_start)
+                if last_end < 0:
+                    self.carry = buffer[first_start:]
+                else:
+                    last_end += len(PAGE_END)
+                    yield buffer[first_start:last_end]
+                    next_start = buffer.find(PAGE_START, last_end)
+                    if next_start >= 0:
+                        self.carry = buffer[next_start:]
+                    else:
+                        self.carry = buffer[max(last_end, len(buffer) - len(PAGE_START) + 1):]
+            if not data:
+                break
+
+
+def split_pages(block):
+    '''
+    yield the contents of each <page>...</page> element in a block
+    '''
+    start = 0
+    while True:
+        page_start = block.find(PAGE_START, start)
+        if page_start < 0:
+            return
+        page_end = block.find(PAGE_END, page_start)
+        if page_end < 0:
+            return
+        start = page_end + len(PAGE_END)
+        yield block[page_start:start]
+
+
+def get_pages(infile, blocksize=BLOCKSIZE):
+    '''
+    read the stub xml from the (binary) file object in big blocks and
+    yield the contents of each <page>...</page> element in turn
+    '''
+    yield from PageReader(infile, blocksize)
+
+
+def get_block_stats(block, all_namespaces=False, want_title=False, want_bytes=False,
+                    want_revlens=False):
+    '''
+    given a run of complete page elements from a stub file, return a list
+    with the page id, namespace, number of revisions and title (if requested)
+    of each page, and the sum of its revision lengths, its largest revision
+    length and the list of its revision lengths, if requested.
+
+    the whole block is searched once for page starts and, if byte lengths
+    are wanted, once for byte lengths; the revisions of each page are then
+    counted between its start and the next page's, so nothing at all is
+    done per revision in python. each revision normally has one byte length,
+    so the byte lengths of a page are the next that many of them; only if
+    some revisions have none (text deleted) do they get counted separately.
+
+    revisions are only counted for pages in the main namespace
+    unless all_namespaces is set
+    '''
+    heads = list(PAGE_HEAD_RE.finditer(block))
+    ends = [head.start() for head in heads[1:]] + [len(block)]
+    results = []
+    for head in heads:
+        title, namespace, page_id = head.groups()
+        stats = {'id': int(page_id) if page_id else 0,
+                 'ns': int(namespace) if namespace else None,
+                 'revs': 0, 'bytes': 0, 'maxrevlen': 0,
+                 'title': title if want_title else None}
+        if want_revlens:
+            stats['revlens'] = []
+        results.append(stats)
+    good = [stats['ns'] is not None and (all_namespaces or stats['ns'] == 0)
+            for stats in results]
+    want_bytes = want_bytes or want_revlens
+    if not want_bytes:
+        for stats, head, end, is_good in zip(results, heads, ends, good):
+            if is_good:
+                stats['revs'] = block.count(REVISION_START, head.end(), end)
+        return results
+
+    revs = [block.count(REVISION_START, head.end(), end) for head, end in zip(heads, ends)]
+    lengths = list(map(int, TEXT_BYTES_RE.findall(block)))
+    if sum(revs) == len(lengths):
+        length_counts = revs
+    else:
+        length_counts = [block.count(TEXT_BYTES, head.end(), end)
+                         for head, end in zip(heads, ends)]
+    next_length = 0
+    for stats, page_revs, length_count, is_good in zip(results, revs, length_counts, good):
+        first_length = next_length
+        next_length += length_count
+        if not is_good:
+            continue
+        stats['revs'] = page_revs
+        revlens = lengths[first_length:next_length]
+        if revlens:
+            stats['bytes'] = sum(revlens)
+            stats['maxrevlen'] = max(revlens)
+        if want_revlens:
+            stats['revlens'] = revlens
+    return results
+
+
+def get_page_stats(page, all_namespaces=False, want_title=False, want_revlens=False):
+    '''
+    given the contents of a page element from a stub file, return
+    its page id, namespace, number of revisions, sum of revision
+    lengths, largest revision length, and title and the list of
+    revision lengths if requested, as get_block_stats does
+    '''
+    results = get_block_stats(page, all_namespaces, want_title, True, want_revlens)
+    if results:
+        return results[0]
+    stats = {'id': 0, 'ns': None, 'revs': 0, 'bytes': 0, 'maxrevlen': 0, 'title': None}
+    if want_revlens:
+        stats['revlens'] = []
+    return stats
+
+
+def get_revids(page):
+    '''
+    given the contents of a page element from a stub file,
+    return the list of its revision ids in the order they appear
+    '''
+    return list(map(int, REVID_RE.findall(page)))
+
+
+def get_revisions(page):
+    '''
+    given the contents of a page element from a stub file, return
+    the contents of each of its revision elements, without the
+    opening tag
+    '''
+    return page.split(REVISION_START)[1:]
+
+
+def format_stats(stats, settings):
+    '''
+    return the output line for the page stats, formatted the way
+    revsperpage does it, or None if the page has too few revisions
+    to be displayed
+
+    settings is a dict with the entries 'all', 'bytes', 'maxrevlen',
+    'title', 'concise' (True or False) and 'cutoff' (a number)
+    '''
+    if not stats['revs'] or stats['revs'] <= settings['cutoff']:
+        return None
+    fields = []
+    if settings['concise']:
+        if settings['all']:
+            fields.append(b'%d:' % stats['id'])
+        if settings['bytes']:
+            fields.append(b'%d:' % stats['bytes'])
+        if settings['maxrevlen']:
+            fields.append(b'%d:' % stats['maxrevlen'])
+        fields.append(b'%d' % stats['revs'])
+        if settings['title']:
+            fields.append(b':' + (stats['title'] or b''))
+    else:
+        if settings['all']:
+            fields.append(b'page:%d ' % stats['id'])
+        if settings['bytes']:
+            fields.append(b'bytes:%d ' % stats['bytes'])
+        if settings['maxrevlen']:
+            fields.append(b'maxrevlen:%d ' % stats['maxrevlen'])
+        fields.append(b'revs:%d' % stats['revs'])
+        if settings['title']:
+            fields.append(b' title:' + (stats['title'] or b''))
+    fields.append(b'\n')
+    return b''.join(fields)
+
+
+def get_default_settings():
+    '''
+    return the default revsperpage settings: main namespace only,
+    revision counts only, no cutoff, no batching, read from
+    stdin with no extra processes, text output of all pages
+    rather than summaries
+    '''
+    return {'all': False, 'bytes': False, 'maxrevlen': False, 'title': False,
+            'concise': False, 'cutoff': 0, 'batch': 0, 'file': None, 'jobs': 1,
+            'columns': None, 'topk': 0, 'histograms': False, 'quantiles': []}
+
+
+class RevsPerPage():
+    '''
+    collect revsperpage output for pages, one at a time or merged
+    in order from other instances that each handled part of the
+    input.
+
+    if outfile is given, output is written there as it is produced,
+    batching pages if the settings say so. otherwise this is a partial
+    collector for some chunk of the input: it keeps the per-page stats
+    (when batching) or output lines (when not) to be merged later
+    '''
+    def __init__(self, settings, outfile=None):
+        self.settings = settings
+        self.outfile = outfile
+        self.lines = []
+        self.stats = []
+        self.batched = None
+        self.batch_count = 0
+
+    def add_page(self, page):
+        '''
+        count the revisions of one page element
+        '''
+        self.add_stats(get_page_stats(page, self.settings['all'], self.settings['title']))
+
+    def add_block(self, block):
+        '''
+        count the revisions of each page in a run of complete page elements
+        '''
+        for stats in get_block_stats(block, self.settings['all'], self.settings['title'],
+                                     self.settings['bytes'] or self.settings['maxrevlen']):
+            self.add_stats(stats)
+
+    def add_stats(self, stats):
+        '''
+        add one page's stats, adding them to the current batch if we are batching
+        '''
+        if not self.settings['batch']:
+            self.emit(format_stats(stats, self.settings))
+        elif self.outfile is None:
+            # batches can only be put together once we have all the pages in order
+            self.stats.append(stats)
+        else:
+            self.add_to_batch(stats)
+
+    def add_to_batch(self, stats):
+        '''
+        sum stats for every batch pages, with the page id and title of the
+        last page in each batch; a partial batch at the end is never written
+        '''
+        if self.batched is None:
+            self.batched = dict(stats)
+        else:
+            self.batched['revs'] += stats['revs']
+            self.batched['bytes'] += stats['bytes']
+            self.batched['maxrevlen'] = max(self.batched['maxrevlen'], stats['maxrevlen'])
+            self.batched['id'] = stats['id']
+            self.batched['ns'] = stats['ns']
+            self.batched['title'] = stats['title']
+        self.batch_count += 1
+        if self.batch_count == self.settings['batch']:
+            self.emit(format_stats(self.batched, self.settings))
+            self.batched = None
+            self.batch_count = 0
+
+    def emit(self, line):
+        '''
+        write or save an output line, if there is one
+        '''
+        if line is None:
+            return
+        if self.outfile is not None:
+            self.outfile.write(line)
+        else:
+            self.lines.append(line)
+
+    def merge(self, other):
+        '''
+        add the results from a collector that handled the next part of the input
+        '''
+        for stats in other.stats:
+            self.add_stats(stats)
+        for line in other.lines:
+            self.emit(line)
+
+    def finish(self):
+        '''
+        nothing to do once all pages are in; the C utility never writes
+        out a partial batch, and neither do we
+        '''
+        return
+
+
+def add_block(collector, block):
+    '''
+    hand a run of complete page elements to the collector all at once,
+    if it can take them that way, or else one page at a time
+    '''
+    if hasattr(collector, 'add_block'):
+        collector.add_block(block)
+    else:
+        for page in split_pages(block):
+            collector.add_page(page)
+
+
+def scan_pages(infile, collector, blocksize=BLOCKSIZE):
+    '''
+    read stub xml from the binary file object and hand
+    the pages to the collector
+    '''
+    for block in PageReader(infile, blocksize).blocks():
+        add_block(collector, block)
+    collector.finish()
+
+
+def write_revsperpage(infile, outfile, settings, blocksize=BLOCKSIZE):
+    '''
+    read stub xml from the binary file object infile and write
+    revsperpage output to the binary file object outfile
+    '''
+    scan_pages(infile, RevsPerPage(settings, outfile), blocksize)
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+convert MediaWiki xml stubs into compact page and revision tables,
+one .npy file per column plus a blob of page titles and a json
+schema, so that questions about revisions can be answered by
+memory-mapping the columns instead of rescanning the xml
+
+like the per-page stats columns (see pagestats.py), the .npy files
+can be loaded with numpy.load(..., mmap_mode='r') for vectorized
+filtering, but numpy is not needed to write or read them
+"""
+
+
+import array
+import calendar
+import json
+import mmap
+import os
+import re
+import sys
+import queries.pagestats as qpagestats
+import queries.stubscan as qstubscan
+
+
+SCHEMA_FORMAT = 'stub-tables'
+SCHEMA_VERSION = 1
+# name, array typecode (or None for fixed-size byte strings), npy dtype
+TABLES = {
+    'page': [
+        ('page_id', 'q', '<i8'),
+        ('ns', 'i', '<i4'),
+        ('title_offset', 'q', '<i8'),
+        ('title_len', 'i', '<i4'),
+        ('redirect', 'B', '|u1'),
+    ],
+    'revision': [
+        ('rev_id', 'q', '<i8'),
+        ('page_id', 'q', '<i8'),
+        ('parent_id', 'q', '<i8'),
+        ('timestamp', 'q', '<i8'),
+        ('len', 'q', '<i8'),
+        ('sha1', None, '|S20'),
+        ('contributor_id', 'q', '<i8'),
+        ('minor', 'B', '|u1'),
+    ],
+}
+SHA1_SIZE = 20
+NO_SHA1 = b'\0' * SHA1_SIZE
+TITLES_SUFFIX = ".page.titles"
+
+REDIRECT_TAG = b'<redirect'
+MINOR_TAG = b'<minor'
+PARENTID_RE = re.compile(rb'<parentid>(\d+)</parentid>')
+SHA1_RE = re.compile(rb'<sha1>([0-9a-z]+)</sha1>')
+TIMESTAMP_FORMAT_RE = re.compile(rb'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)')
+
+
+def get_column_path(prefix, table, name):
+    '''
+    return the path of the npy file for the given column of the table
+    '''
+    return qpagestats.get_column_path(prefix, table + '.' + name)
+
+
+def new_table(table):
+    '''
+    return a dict of empty arrays (or bytearrays, for byte strings),
+    one per column of the table
+    '''
+    return {name: array.array(typecode) if typecode else bytearray()
+            for (name, typecode, _dtype) in TABLES[table]}
+
+
+class TimestampParser():
+    '''
+    turn stub timestamps (2019-03-12T10:00:00Z) into seconds since the
+    epoch, remembering the start of each day we have already seen
+    '''
+    def __init__(self):
+        self.days = {}
+
+    def parse(self, timestamp):
+        '''
+        return the timestamp as seconds since the epoch, or 0 if it can't be read
+        '''
+        match = TIMESTAMP_FORMAT_RE.match(timestamp)
+        if not match:
+            return 0
+        day = timestamp[:10]
+        if day not in self.days:
+            self.days[day] = calendar.timegm(
+                (int(match.group(1)), int(match.group(2)), int(match.group(3)), 0, 0, 0))
+        return (self.days[day] + int(match.group(4)) * 3600 + int(match.group(5)) * 60 +
+                int(match.group(6)))
+
+
+def get_sha1_bytes(revision):
+    '''
+    return the revision's sha1 (base 36 in the stubs) as 20 bytes,
+    or 20 zero bytes if it has none
+    '''
+    match = SHA1_RE.search(revision)
+    if not match:
+        return NO_SHA1
+    try:
+        return int(match.group(1), 36).to_bytes(SHA1_SIZE, 'big')
+    except OverflowError:
+        return NO_SHA1
+
+
+def get_contributor_id(revision):
+    '''
+    return the user id of the revision's contributor, or 0 for ip
+    edits and contributors that have been deleted
+    '''
+    match = qstubscan.CONTRIBUTOR_RE.search(revision)
+    if not match:
+        return 0
+    id_match = qstubscan.ID_RE.search(match.group(1))
+    return int(id_match.group(1)) if id_match else 0
+
+
+class StubTables():
+    '''
+    collect page and revision rows for every page in every namespace,
+    with page titles in a separate blob that the page table points into.
+    revisions with deleted text get a len of -1.
+
+    if prefix is given, the columns are written to
+    <prefix>.<table>.<column>.npy, the titles to <prefix>.page.titles
+    and the schema to <prefix>.schema.json; otherwise this is a partial
+    collector for some chunk of the input, keeping everything in memory
+    to be merged later
+    '''
+    def __init__(self, prefix=None):
+        self.prefix = prefix
+        self.tables = {table: new_table(table) for table in TABLES}
+        self.rows = {table: 0 for table in TABLES}
+        self.titles = bytearray()
+        self.titles_written = 0
+        self.timestamps = TimestampParser()
+        self.outfiles = {}
+        if prefix is not None:
+            for table in TABLES:
+                for (name, _typecode, dtype) in TABLES[table]:
+                    outfile = open(get_column_path(prefix, table, name), "wb")
+                    outfile.write(qpagestats.get_npy_header(dtype, 0))
+                    self.outfiles[(table, name)] = outfile
+            self.titles_file = open(prefix + TITLES_SUFFIX, "wb")
+
+    def __getstate__(self):
+        # partial collectors get sent back from worker processes; they
+        # have no open files, and the parser's cache isn't worth the trip
+        state = dict(self.__dict__)
+        state['timestamps'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.timestamps = TimestampParser()
+
+    def add_page(self, page):
+        '''
+        add the page row and revision rows for one page element
+        '''
+        ns_match = qstubscan.NS_RE.search(page)
+        if not ns_match:
+            return
+        id_match = qstubscan.ID_RE.search(page, ns_match.end())
+        page_id = int(id_match.group(1)) if id_match else 0
+        title_match = qstubscan.TITLE_RE.search(page)
+        title = title_match.group(1) if title_match else b''
+        revisions = qstubscan.get_revisions(page)
+        first_revision = page.find(qstubscan.REVISION_START)
+        header = page[:first_revision] if first_revision >= 0 else page
+
+        columns = self.tables['page']
+        columns['page_id'].append(page_id)
+        columns['ns'].append(int(ns_match.group(1)))
+        columns['title_offset'].append(self.titles_written + len(self.titles))
+        columns['title_len'].append(len(title))
+        columns['redirect'].append(REDIRECT_TAG in header)
+        self.titles += title
+        self.rows['page'] += 1
+
+        columns = self.tables['revision']
+        for revision in revisions:
+            rev_id_match = qstubscan.ID_RE.search(revision)
+            columns['rev_id'].append(int(rev_id_match.group(1)) if rev_id_match else 0)
+            columns['page_id'].append(page_id)
+            parent_match = PARENTID_RE.search(revision)
+            columns['parent_id'].append(int(parent_match.group(1)) if parent_match else 0)
+            timestamp_match = qstubscan.TIMESTAMP_RE.search(revision)
+            columns['timestamp'].append(
+                self.timestamps.parse(timestamp_match.group(1)) if timestamp_match else 0)
+            bytes_match = qstubscan.BYTES_RE.search(revision)
+            columns['len'].append(int(bytes_match.group(1)) if bytes_match else -1)
+            columns['sha1'] += get_sha1_bytes(revision)
+            columns['contributor_id'].append(get_contributor_id(revision))
+            columns['minor'].append(MINOR_TAG in revision)
+        self.rows['revision'] += len(revisions)
+
+        if self.prefix is not None and len(self.tables['revision']['rev_id']) >= \
+                qpagestats.FLUSH_ROWS:
+            self.flush()
+
+    def merge(self, other):
+        '''
+        add the rows from a collector that handled the next part of the input
+        '''
+        offset = self.titles_written + len(self.titles)
+        for table in TABLES:
+            for (name, _typecode, _dtype) in TABLES[table]:
+                if table == 'page' and name == 'title_offset':
+                    self.tables[table][name].extend(
+                        value + offset for value in other.tables[table][name])
+                else:
+                    self.tables[table][name].extend(other.tables[table][name])
+            self.rows[table] += other.rows[table]
+        self.titles += other.titles
+        if self.prefix is not None and len(self.tables['revision']['rev_id']) >= \
+                qpagestats.FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        '''
+        write out the rows and titles we have so far
+        '''
+        for table in TABLES:
+            for (name, typecode, _dtype) in TABLES[table]:
+                column = self.tables[table][name]
+                if typecode and sys.byteorder != 'little':
+                    column.byteswap()
+                self.outfiles[(table, name)].write(column)
+            self.tables[table] = new_table(table)
+        self.titles_file.write(self.titles)
+        self.titles_written += len(self.titles)
+        self.titles = bytearray()
+
+    def finish(self):
+        '''
+        write out the rest of the rows, fix up the npy headers
+        with the final row counts and write the schema
+        '''
+        if self.prefix is None:
+            return
+        self.flush()
+        self.titles_file.close()
+        for table in TABLES:
+            for (name, _typecode, dtype) in TABLES[table]:
+                outfile = self.outfiles[(table, name)]
+                outfile.seek(0)
+                outfile.write(qpagestats.get_npy_header(dtype, self.rows[table]))
+                outfile.close()
+        schema = {'format': SCHEMA_FORMAT, 'version': SCHEMA_VERSION,
+                  'titles': os.path.basename(self.prefix + TITLES_SUFFIX),
+                  'tables': {table: {
+                      'rows': self.rows[table],
+                      'columns': [{'name': name, 'dtype': dtype, 'file': os.path.basename(
+                          get_column_path(self.prefix, table, name))}
+                                  for (name, _typecode, dtype) in TABLES[table]]}
+                             for table in TABLES}}
+        with open(qpagestats.get_schema_path(self.prefix), "w") as outfile:
+            json.dump(schema, outfile, indent=2)
+
+
+def read_schema(prefix):
+    '''
+    read and check the schema for the tables with the given prefix
+    '''
+    with open(qpagestats.get_schema_path(prefix), "r") as infile:
+        schema = json.load(infile)
+    if schema.get('format') != SCHEMA_FORMAT or schema.get('version') != SCHEMA_VERSION:
+        raise ValueError("{path} is not a schema for stub tables".format(
+            path=qpagestats.get_schema_path(prefix)))
+    return schema
+
+
+def map_file(path):
+    '''
+    return a read-only memoryview of the file's contents, memory-mapped
+    if the file isn't empty
+    '''
+    with open(path, "rb") as infile:
+        if not os.fstat(infile.fileno()).st_size:
+            return memoryview(b'')
+        return memoryview(mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def load_tables(prefix):
+    '''
+    memory-map the tables with the given prefix, returning the schema,
+    a dict of table name and dict of column name and read-only memoryview
+    of its values, and a memoryview of the titles. byte string columns
+    are one-dimensional views of SHA1_SIZE bytes per row; numpy.asarray()
+    takes the others as is
+    '''
+    schema = read_schema(prefix)
+    directory = os.path.dirname(prefix)
+    tables = {}
+    for table, contents in schema['tables'].items():
+        typecodes = {name: typecode for (name, typecode, _dtype) in TABLES[table]}
+        tables[table] = {}
+        for column in contents['columns']:
+            path = os.path.join(directory, column['file'])
+            values = map_file(path)[qpagestats.NPY_HEADER_LEN:]
+            typecode = typecodes[column['name']]
+            if typecode:
+                values = values.cast(typecode)
+                rows = len(values)
+            else:
+                rows = len(values) // SHA1_SIZE
+            if rows != contents['rows']:
+                raise ValueError("{path} has the wrong number of rows".format(path=path))
+            tables[table][column['name']] = values
+    titles = map_file(os.path.join(directory, schema['titles']))
+    return schema, tables, titles
+
+
+def get_title(tables, titles, row):
+    '''
+    return the title of the page in the given row of the page table
+    '''
+    offset = tables['page']['title_offset'][row]
+    return bytes(titles[offset:offset + tables['page']['title_len'][row]])
+
+
+def get_sha1(tables, row):
+    '''
+    return the sha1 of the revision in the given row of the revision table, as 20 bytes
+    '''
+    return bytes(tables['revision']['sha1'][row * SHA1_SIZE:(row + 1) * SHA1_SIZE])
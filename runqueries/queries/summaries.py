@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+summarize per-page revision statistics while the stubs are
+being read, instead of writing out a line for every page:
+the top K pages by revisions, bytes or largest revision,
+optionally with the revision ids at given percentiles of
+each of their histories, and log-bucketed histograms of revisions per page and of
+revision sizes, per namespace
+"""
+
+
+import heapq
+import queries.stubscan as qstubscan
+
+
+TOPK_FIELDS = ['revs', 'bytes', 'maxrevlen']
+
+
+def get_bucket(value):
+    '''
+    return the log2 bucket for a value: 0 for 0, 1 for 1,
+    2 for 2-3, 3 for 4-7 and so on
+    '''
+    return value.bit_length()
+
+
+def get_bucket_range(bucket):
+    '''
+    return the smallest and largest values that go in the given bucket
+    '''
+    if not bucket:
+        return 0, 0
+    return 1 << (bucket - 1), (1 << bucket) - 1
+
+
+def get_quantiles(values, percents):
+    '''
+    given a sorted list of values and a list of percentages,
+    return the value at each of those percentiles (nearest
+    rank, rounding down), or 0 for each if there are no values
+    '''
+    if not values:
+        return tuple(0 for _percent in percents)
+    return tuple(values[(len(values) - 1) * percent // 100] for percent in percents)
+
+
+def add_to_histogram(histogram, namespace, bucket, count=1):
+    '''
+    add count to the bucket for the namespace in the histogram,
+    a dict of namespace and list of counts per bucket
+    '''
+    counts = histogram.setdefault(namespace, [])
+    if len(counts) <= bucket:
+        counts.extend([0] * (bucket + 1 - len(counts)))
+    counts[bucket] += count
+
+
+def merge_histograms(histogram, other):
+    '''
+    add the counts from the other histogram into this one
+    '''
+    for namespace, counts in other.items():
+        for bucket, count in enumerate(counts):
+            if count:
+                add_to_histogram(histogram, namespace, bucket, count)
+
+
+class PageSummary():
+    '''
+    keep the top K pages by revisions, bytes and max revision length
+    in bounded heaps, and histograms of revisions per page and
+    revision size per namespace, for the same pages that revsperpage
+    would display with the given settings (batching is not supported).
+
+    if outfile is given, the summaries are written there once all pages
+    are in; otherwise this is a partial collector for some chunk of
+    the input, to be merged later
+    '''
+    def __init__(self, settings, outfile=None):
+        if settings['batch']:
+            raise ValueError("batching is not supported for summaries")
+        self.settings = settings
+        self.outfile = outfile
+        # for each field, a min-heap of (value, page id, stats)
+        self.heaps = {field: [] for field in TOPK_FIELDS}
+        self.revs_histogram = {}
+        self.revlen_histogram = {}
+
+    def add_page(self, page):
+        '''
+        get the stats for one page element and add them; the revision
+        ids are only dug out for pages that make it into some top K list
+        '''
+        stats = qstubscan.get_page_stats(
+            page, self.settings['all'], self.settings['title'], self.settings['histograms'])
+        if self.settings['quantiles'] and self.is_top_page(stats):
+            stats['quantiles'] = get_quantiles(sorted(qstubscan.get_revids(page)),
+                                               self.settings['quantiles'])
+        self.add_stats(stats)
+
+    def is_top_page(self, stats):
+        '''
+        return True if the page stats would go into any top K heap as things stand
+        '''
+        if not stats['revs'] or stats['revs'] <= self.settings['cutoff']:
+            return False
+        for field in TOPK_FIELDS:
+            heap = self.heaps[field]
+            if len(heap) < self.settings['topk'] or (stats[field], stats['id']) > heap[0][:2]:
+                return True
+        return False
+
+    def add_stats(self, stats):
+        '''
+        add one page's stats to the top K heaps and histograms
+        '''
+        if not stats['revs'] or stats['revs'] <= self.settings['cutoff']:
+            return
+        if self.settings['topk']:
+            entry_stats = (stats['id'], stats['ns'], stats['revs'], stats['bytes'],
+                           stats['maxrevlen'], stats.get('quantiles', ()), stats['title'])
+            for field in TOPK_FIELDS:
+                self.add_to_heap(field, (stats[field], stats['id'], entry_stats))
+        if self.settings['histograms']:
+            add_to_histogram(self.revs_histogram, stats['ns'], get_bucket(stats['revs']))
+            for revlen in stats['revlens']:
+                add_to_histogram(self.revlen_histogram, stats['ns'], get_bucket(revlen))
+
+    def add_to_heap(self, field, entry):
+        '''
+        add an entry to the heap for the field, keeping only the K largest
+        '''
+        heap = self.heaps[field]
+        if len(heap) < self.settings['topk']:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    def merge(self, other):
+        '''
+        add the summaries from a collector that handled some other part of the input
+        '''
+        for field in TOPK_FIELDS:
+            for entry in other.heaps[field]:
+                self.add_to_heap(field, entry)
+        merge_histograms(self.revs_histogram, other.revs_histogram)
+        merge_histograms(self.revlen_histogram, other.revlen_histogram)
+
+    def get_top(self, field):
+        '''
+        return the stats tuples of the top K pages for the field, largest first
+        '''
+        return [entry[2] for entry in sorted(self.heaps[field], reverse=True)]
+
+    def format_top(self):
+        '''
+        return the lines of top K output
+        '''
+        lines = []
+        for field in TOPK_FIELDS:
+            for rank, (pageid, namespace, revs, length, maxrevlen, quantiles, title) in \
+                    enumerate(self.get_top(field)):
+                line = b'topk:%s rank:%d page:%d ns:%d revs:%d bytes:%d maxrevlen:%d' % (
+                    field.encode('utf-8'), rank + 1, pageid, namespace, revs, length, maxrevlen)
+                for percent, revid in zip(self.settings['quantiles'], quantiles):
+                    line += b' revid_q%d:%d' % (percent, revid)
+                if self.settings['title']:
+                    line += b' title:' + (title or b'')
+                lines.append(line + b'\n')
+        return lines
+
+    def format_histograms(self):
+        '''
+        return the lines of histogram output
+        '''
+        lines = []
+        for name, histogram in [(b'revs_per_page', self.revs_histogram),
+                                (b'revision_size', self.revlen_histogram)]:
+            for namespace in sorted(histogram):
+                for bucket, count in enumerate(histogram[namespace]):
+                    if not count:
+                        continue
+                    low, high = get_bucket_range(bucket)
+                    lines.append(b'histogram:%s ns:%d min:%d max:%d count:%d\n' % (
+                        name, namespace, low, high, count))
+        return lines
+
+    def finish(self):
+        '''
+        write out the summaries, if we have somewhere to write them
+        '''
+        if self.outfile is None:
+            return
+        if self.settings['topk']:
+            self.outfile.writelines(self.format_top())
+        if self.settings['histograms']:
+            self.outfile.writelines(self.format_histograms())
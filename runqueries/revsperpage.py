@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Count revisions per page in a MediaWiki xml stubs file read
+from stdin, the same way the revsperpage C utility does and
+with the same arguments and output, but without having to
+build and install a binary everywhere, and without choking
+on lines longer than some fixed buffer.
+
+Given a file and a number of jobs, the file is split into
+chunks that are counted by separate processes, and the
+results are merged so that the output is the same as
+for a serial run.
+"""
+
+
+import re
+import sys
+import queries.stubscan as qstubscan
+import queries.stubchunks as qstubchunks
+import queries.pagestats as qpagestats
+import queries.summaries as qsummaries
+
+
+def usage(message=None):
+    '''
+    display a helpful usage message with
+    an optional introductory message first
+    '''
+    if message is not None:
+        sys.stderr.write(message)
+        sys.stderr.write('\n')
+    usage_message = """Usage: revsperpage.py [all] [bytes] [maxrevlen] [title] [batch] <number>
+                      [file <path>] [jobs <number>] [columns <prefix>]
+                      [topk <number>] [quantiles <percent>[,<percent>...]]
+                      [histograms]
+counts number of revisions in each page
+with 'all', displays the page id for each revision
+for all namespaces
+with 'bytes', displays the sum of byte lengths for
+each page
+with 'maxrevlen', displays the max byte length for
+revisions of the page
+with 'title', displays the title for each page
+without 'all', displays only the revision count, and
+only for the main namespace (ns 0)
+with 'batch', sums numbers about that many pages in each output line
+with 'concise', skips printing field names and just prints values
+with cutoff number, prints only information for pages
+with more revisions than the cutoff
+with 'file', reads the specified stubs file (plain, gz or bz2) instead of stdin
+with 'jobs', splits the input into chunks and counts them with that many
+processes; gz and bz2 files are split up by gzip member or bz2 stream if
+there is a member index for them (see pzcat.py), and plain files by byte range
+with 'columns', writes page id, namespace, revision count, sum of byte lengths
+and max byte length for each page that would be displayed into the binary
+column files <prefix>.<column>.npy, with a json description of them in
+<prefix>.schema.json, instead of displaying anything; batch can't be used
+with 'topk', displays only the pages with the most revisions, the most bytes
+and the largest revisions, that many of each, instead of every page
+with 'quantiles', displays for each of those top pages the revision id at
+each given percentile of the page's revision ids (50 for the midpoint)
+with 'histograms', displays only counts of pages by number of revisions and
+of revisions by byte length, per namespace, in power-of-two buckets
+topk and histograms can be used together but not with batch or columns
+"""
+    sys.stderr.write(usage_message)
+    sys.exit(1)
+
+
+def get_percents(value):
+    '''
+    return the list of percentages in a comma-separated string
+    '''
+    percents = []
+    for percent in value.split(','):
+        if not percent.isdigit() or int(percent) > 100:
+            usage("bad percentage '{percent}' for quantiles arg".format(percent=percent))
+        percents.append(int(percent))
+    return percents
+
+
+def get_settings(argv):
+    '''
+    parse the command line args the way the C utility does,
+    and return the settings for the rev counter
+    '''
+    settings = qstubscan.get_default_settings()
+    index = 0
+    while index < len(argv):
+        arg = argv[index]
+        if arg.startswith('all'):
+            settings['all'] = True
+        elif arg.startswith('bytes'):
+            settings['bytes'] = True
+        elif arg.startswith('title'):
+            settings['title'] = True
+        elif arg.startswith('maxrevlen'):
+            settings['maxrevlen'] = True
+        elif arg.startswith('batch'):
+            if index + 1 >= len(argv):
+                usage("missing value for batch arg")
+            if argv[index + 1][:1].isdigit():
+                settings['batch'] = int(re.match(r'\d+', argv[index + 1]).group(0))
+            index += 1
+        elif arg.startswith('jobs'):
+            if index + 1 >= len(argv) or not argv[index + 1].isdigit():
+                usage("missing or bad value for jobs arg")
+            settings['jobs'] = int(argv[index + 1])
+            index += 1
+        elif arg.startswith('file'):
+            if index + 1 >= len(argv):
+                usage("missing value for file arg")
+            settings['file'] = argv[index + 1]
+            index += 1
+        elif arg.startswith('columns'):
+            if index + 1 >= len(argv):
+                usage("missing value for columns arg")
+            settings['columns'] = argv[index + 1]
+            index += 1
+        elif arg.startswith('topk'):
+            if index + 1 >= len(argv) or not argv[index + 1].isdigit():
+                usage("missing or bad value for topk arg")
+            settings['topk'] = int(argv[index + 1])
+            index += 1
+        elif arg.startswith('quantiles'):
+            if index + 1 >= len(argv):
+                usage("missing value for quantiles arg")
+            settings['quantiles'] = get_percents(argv[index + 1])
+            index += 1
+        elif arg.startswith('histograms'):
+            settings['histograms'] = True
+        elif arg.startswith('concise'):
+            settings['concise'] = True
+        elif arg[:1].isdigit():
+            settings['cutoff'] = int(re.match(r'\d+', arg).group(0))
+        else:
+            usage("unknown arg '{arg}'".format(arg=arg))
+        index += 1
+    return settings
+
+
+def do_main():
+    '''
+    entry point
+    '''
+    settings = get_settings(sys.argv[1:])
+    if settings['columns'] and settings['batch']:
+        usage("columns and batch can't be used together")
+    if settings['quantiles'] and not settings['topk']:
+        usage("quantiles can only be used with topk")
+    summarize = settings['topk'] or settings['histograms']
+    if summarize and (settings['batch'] or settings['columns']):
+        usage("topk and histograms can't be used with batch or columns")
+    if summarize:
+        collector = qsummaries.PageSummary(settings, sys.stdout.buffer)
+        collector_factory = qsummaries.PageSummary
+    elif settings['columns']:
+        collector = qpagestats.PageStatsColumns(settings, settings['columns'])
+        collector_factory = qpagestats.PageStatsColumns
+    else:
+        collector = qstubscan.RevsPerPage(settings, sys.stdout.buffer)
+        collector_factory = qstubscan.RevsPerPage
+    try:
+        if settings['jobs'] > 1:
+            qstubchunks.scan_parallel(settings['file'], settings['jobs'], collector,
+                                      collector_factory, (settings,))
+        else:
+            with qstubchunks.open_input(settings['file']) as infile:
+                qstubscan.scan_pages(infile, collector)
+        sys.stdout.buffer.flush()
+    except BrokenPipeError:
+        # head or whoever has seen enough
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    do_main()
@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Read a MediaWiki xml stubs file and write out the contributors with
+the most revisions and the number of distinct contributors in each
+namespace, using fixed-size sketches so that memory use doesn't grow
+with the number of contributors.
+"""
+
+
+import getopt
+import sys
+import queries.sketches as qsketches
+import queries.stubscan as qstubscan
+import queries.stubchunks as qstubchunks
+
+
+def usage(message=None):
+    '''
+    display a helpful usage message with
+    an optional introductory message first
+    '''
+    if message is not None:
+        sys.stderr.write(message)
+        sys.stderr.write('\n')
+    usage_message = """Usage: python3 stubcontributors.py [--topk <number>] [--counters <number>]
+                        [--precision <number>] [--jobs <number>] [--output <path>] [file]
+
+Find the contributors (user:<name> for registered users, ip:<address> for
+everyone else) with the most revisions, and estimate the number of distinct
+contributors per namespace and overall, in the given stubs file (plain, gz or
+bz2), or in stub xml read from stdin if no file is given. Revisions whose
+contributor has been deleted are skipped.
+
+Output starts with two lines beginning with '#' giving the error bounds, then:
+  topk rank:<n> revs:<count> error:<most the count can be too high> contributor:<name>
+  distinct ns:<namespace> contributors:<estimate>
+  distinct ns:all contributors:<estimate>
+
+Revision counts are never too low, and never too high by more than the number
+of revisions divided by the number of counters; every contributor with more
+revisions than that is sure to be counted. Distinct counts have a standard error
+of 1.04/sqrt(2^precision), about 0.8% with the default precision.
+
+Arguments:
+  --topk       (-k):   how many of the top contributors to display
+                       default: 1000
+  --counters   (-c):   how many contributors to keep counts for; more means
+                       smaller errors and more memory
+                       default: {counters}
+  --precision  (-p):   use 2^precision registers for each distinct count, from 4 to 18
+                       default: {precision}
+  --jobs       (-j):   split the file into chunks and read them with this
+                       many processes; see revsperpage.py for how files
+                       get split up
+                       default: 1
+  --output     (-o):   path to file to which to write output
+                       default: stdout
+  --help       (-h):   display this usage message
+""".format(counters=qsketches.DEFAULT_COUNTERS, precision=qsketches.DEFAULT_PRECISION)
+    sys.stderr.write(usage_message)
+    sys.exit(1)
+
+
+def get_number(opt, val):
+    '''
+    return the value of the option as a positive number
+    '''
+    if not val.isdigit() or not int(val):
+        usage("Arg '{opt}' must be a positive number".format(opt=opt.lstrip('-')))
+    return int(val)
+
+
+def do_main():
+    '''
+    entry point
+    '''
+    topk = 1000
+    counters = qsketches.DEFAULT_COUNTERS
+    precision = qsketches.DEFAULT_PRECISION
+    jobs = 1
+    outpath = None
+    try:
+        (options, remainder) = getopt.gnu_getopt(sys.argv[1:], "k:c:p:j:o:h", [
+            "topk=", "counters=", "precision=", "jobs=", "output=", "help"])
+    except getopt.GetoptError as err:
+        usage("Unknown option specified: " + str(err))
+    for (opt, val) in options:
+        if opt in ["-k", "--topk"]:
+            topk = get_number(opt, val)
+        elif opt in ["-c", "--counters"]:
+            counters = get_number(opt, val)
+        elif opt in ["-p", "--precision"]:
+            precision = get_number(opt, val)
+            if precision < 4 or precision > 18:
+                usage("Arg 'precision' must be between 4 and 18")
+        elif opt in ["-j", "--jobs"]:
+            jobs = get_number(opt, val)
+        elif opt in ["-o", "--output"]:
+            outpath = val
+        elif opt in ["-h", "--help"]:
+            usage()
+    if len(remainder) > 1:
+        usage("At most one file may be specified")
+    filename = remainder[0] if remainder else None
+
+    outfile = open(outpath, "w") if outpath else sys.stdout
+    collector = qsketches.ContributorSketches(topk, counters, precision, outfile)
+    try:
+        if jobs > 1:
+            qstubchunks.scan_parallel(filename, jobs, collector, qsketches.ContributorSketches,
+                                      (topk, counters, precision))
+        else:
+            with qstubchunks.open_input(filename) as infile:
+                qstubscan.scan_pages(infile, collector)
+    finally:
+        if outpath:
+            outfile.close()
+
+
+if __name__ == '__main__':
+    do_main()
@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Read a MediaWiki xml stubs file and write out the number of
+revisions and the sum of their byte lengths per namespace for
+each day, week or month, ready for plotting, so that revision
+growth can be charted from the dumps instead of by running
+COUNT(*) queries against the databases.
+"""
+
+
+import getopt
+import sys
+import queries.growth as qgrowth
+import queries.stubscan as qstubscan
+import queries.stubchunks as qstubchunks
+
+
+def usage(message=None):
+    '''
+    display a helpful usage message with
+    an optional introductory message first
+    '''
+    if message is not None:
+        sys.stderr.write(message)
+        sys.stderr.write('\n')
+    usage_message = """Usage: python3 stubgrowth.py [--interval day|week|month] [--cumulative]
+                        [--jobs <number>] [--output <path>] [file]
+
+Count revisions and sum their byte lengths per namespace and per day, week
+or month of the revision timestamps in the given stubs file (plain, gz or
+bz2), or in stub xml read from stdin if no file is given.
+
+Output is one line per interval and namespace, oldest first:
+  <interval start date> <namespace> <revisions> <bytes>
+with running totals per namespace added at the end of each line if requested;
+the first line is a header starting with '#', which gnuplot skips.
+
+Arguments:
+  --interval    (-i):   day, week (starting on Monday) or month
+                        default: month
+  --cumulative  (-c):   add the running totals of revisions and bytes
+                        for the namespace to each line
+  --jobs        (-j):   split the file into chunks and read them with this
+                        many processes; see revsperpage.py for how files
+                        get split up
+                        default: 1
+  --output      (-o):   path to file to which to write output
+                        default: stdout
+  --help        (-h):   display this usage message
+
+Example use:
+   python3 stubgrowth.py -i month -c -j 8 commonswiki-20200101-stub-meta-history.xml.gz \\
+      | awk '$2 == 6 { print $1 " " $5 }' > files-revs.txt
+   echo 'set xdata time; set timefmt "%Y-%m-%d"; set terminal png;
+      set output "files-revs.png"; plot "files-revs.txt" using 1:2 with lines' | gnuplot
+"""
+    sys.stderr.write(usage_message)
+    sys.exit(1)
+
+
+def do_main():
+    '''
+    entry point
+    '''
+    interval = 'month'
+    cumulative = False
+    jobs = 1
+    outpath = None
+    try:
+        (options, remainder) = getopt.gnu_getopt(sys.argv[1:], "i:cj:o:h", [
+            "interval=", "cumulative", "jobs=", "output=", "help"])
+    except getopt.GetoptError as err:
+        usage("Unknown option specified: " + str(err))
+    for (opt, val) in options:
+        if opt in ["-i", "--interval"]:
+            if val not in qgrowth.INTERVALS:
+                usage("Arg 'interval' must be one of " + ", ".join(qgrowth.INTERVALS))
+            interval = val
+        elif opt in ["-c", "--cumulative"]:
+            cumulative = True
+        elif opt in ["-j", "--jobs"]:
+            if not val.isdigit() or not int(val):
+                usage("Arg 'jobs' must be a positive number")
+            jobs = int(val)
+        elif opt in ["-o", "--output"]:
+            outpath = val
+        elif opt in ["-h", "--help"]:
+            usage()
+    if len(remainder) > 1:
+        usage("At most one file may be specified")
+    filename = remainder[0] if remainder else None
+
+    outfile = open(outpath, "w") if outpath else sys.stdout
+    collector = qgrowth.RevisionGrowth(interval, cumulative, outfile)
+    try:
+        if jobs > 1:
+            qstubchunks.scan_parallel(filename, jobs, collector,
+                                      qgrowth.RevisionGrowth, (interval, cumulative))
+        else:
+            with qstubchunks.open_input(filename) as infile:
+                qstubscan.scan_pages(infile, collector)
+    finally:
+        if outpath:
+            outfile.close()
+
+
+if __name__ == '__main__':
+    do_main()
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+"""
+Read a MediaWiki xml stubs file once and write its pages and
+revisions out as column files that later queries can memory-map,
+instead of writing one more parser that rescans the xml.
+"""
+
+
+import getopt
+import sys
+import queries.stubchunks as qstubchunks
+import queries.stubscan as qstubscan
+import queries.stubtables as qstubtables
+
+
+def usage(message=None):
+    '''
+    display a helpful usage message with
+    an optional introductory message first
+    '''
+    if message is not None:
+        sys.stderr.write(message)
+        sys.stderr.write('\n')
+    usage_message = """Usage: python3 stubtables.py [--jobs <number>] <stubsfile> <prefix>
+
+Convert the stubs file (plain, gz or bz2, or '-' for stub xml on stdin) into
+a page table and a revision table, one .npy file per column:
+
+  <prefix>.page.<column>.npy       page_id, ns, title_offset, title_len, redirect
+  <prefix>.revision.<column>.npy   rev_id, page_id, parent_id, timestamp (seconds
+                                   since the epoch), len (-1 if the text is deleted),
+                                   sha1 (20 bytes, all zeros if missing),
+                                   contributor_id (0 for ips or deleted users), minor
+  <prefix>.page.titles             the page titles, one after the other, which
+                                   title_offset and title_len point into
+  <prefix>.schema.json             a description of all of the above
+
+All namespaces are included. The .npy files can be loaded with
+numpy.load(path, mmap_mode='r'); see queries/stubtables.py for reading them
+without numpy.
+
+Arguments:
+  --jobs    (-j):   split the stubs file into chunks and read them with this
+                    many processes; see revsperpage.py for how files get split up
+                    default: 1
+  --help    (-h):   display this usage message
+
+Example use:
+   python3 stubtables.py -j 8 elwikt-20200101-stub-meta-history.xml.gz elwikt-20200101
+   python3 -c "import numpy; lens = numpy.load('elwikt-20200101.revision.len.npy',
+       mmap_mode='r'); print(numpy.percentile(lens[lens >= 0], [50, 90, 99]))"
+"""
+    sys.stderr.write(usage_message)
+    sys.exit(1)
+
+
+def do_main():
+    '''
+    entry point
+    '''
+    jobs = 1
+    try:
+        (options, remainder) = getopt.gnu_getopt(sys.argv[1:], "j:h", ["jobs=", "help"])
+    except getopt.GetoptError as err:
+        usage("Unknown option specified: " + str(err))
+    for (opt, val) in options:
+        if opt in ["-j", "--jobs"]:
+            if not val.isdigit() or not int(val):
+                usage("Arg 'jobs' must be a positive number")
+            jobs = int(val)
+        elif opt in ["-h", "--help"]:
+            usage()
+    if len(remainder) != 2:
+        usage("A stubs file and an output prefix must be specified")
+    filename, prefix = remainder
+
+    collector = qstubtables.StubTables(prefix)
+    if jobs > 1:
+        qstubchunks.scan_parallel(filename, jobs, collector, qstubtables.StubTables, ())
+    else:
+        with qstubchunks.open_input(filename) as infile:
+            qstubscan.scan_pages(infile, collector)
+
+
+if __name__ == '__main__':
+    do_main()
@@ -0,0 +1,64 @@
+#!/bin/bash
+
+# Check that revsperpage.py gives the same output as the revsperpage C utility
+# (the one in the top level directory of this repo, which has all the options)
+# byte for byte, in every output mode, on a small stubs file.
+#
+# Give a larger (uncompressed) stubs file as the first argument and the two
+# will also be timed on it, serially and with revsperpage.py running 4 jobs.
+
+cd "$(dirname "$0")" || exit 1
+
+stubs="testdata/stubs-sample.xml"
+bigstubs="$1"
+
+workdir=$(mktemp -d) || exit 1
+trap 'rm -rf "$workdir"' EXIT
+
+# the C source predates -Werror, so build it without
+gcc -O2 -o "${workdir}/revsperpage" ../revsperpage.c || exit 1
+
+modes=(
+    ""
+    "all"
+    "bytes"
+    "maxrevlen"
+    "title"
+    "concise"
+    "all bytes maxrevlen title"
+    "all bytes maxrevlen title concise"
+    "all title concise 1"
+    "1"
+    "all 2"
+    "batch 2"
+    "batch 3"
+    "all bytes maxrevlen batch 2"
+    "all bytes batch 3 concise"
+)
+
+failed=0
+for mode in "${modes[@]}"; do
+    "${workdir}/revsperpage" $mode < "$stubs" > "${workdir}/expected"
+    python3 revsperpage.py $mode < "$stubs" > "${workdir}/serial"
+    python3 revsperpage.py $mode file "$stubs" jobs 2 > "${workdir}/parallel"
+    for output in serial parallel; do
+        if ! cmp -s "${workdir}/expected" "${workdir}/${output}"; then
+            echo "FAILED: mode '${mode}', ${output}:"
+            diff "${workdir}/expected" "${workdir}/${output}"
+            failed=1
+        fi
+    done
+done
+if [ "$failed" -ne 0 ]; then
+    exit 1
+fi
+echo "all ${#modes[@]} modes match"
+
+if [ -n "$bigstubs" ]; then
+    echo "C, serial:"
+    time "${workdir}/revsperpage" all bytes maxrevlen < "$bigstubs" > /dev/null
+    echo "revsperpage.py, serial:"
+    time python3 revsperpage.py all bytes maxrevlen < "$bigstubs" > /dev/null
+    echo "revsperpage.py, 4 jobs:"
+    time python3 revsperpage.py all bytes maxrevlen file "$bigstubs" jobs 4 > /dev/null
+fi
@@ -10,12 +10,26 @@ group, just in case some query is slower than you expect.
 """
 
 
+import concurrent.futures
+import os
 import sys
 import getopt
 import time
 import json
 from subprocess import Popen, PIPE, SubprocessError
 import MySQLdb
+import MySQLdb.cursors
+
+
+# how far past the end of an interval we look for a revision that exists
+MAX_REV_SKIP = 100
+# seconds to wait between queries on a host before we know how busy it is
+INITIAL_DELAY = 5
+# ways to ask a replica how far behind it is, newest first
+LAG_QUERIES = ['SHOW REPLICA STATUS;', 'SHOW SLAVE STATUS;']
+# how many chunks per host may be running or done but waiting for an earlier
+# chunk to finish, before we stop handing out more
+REORDER_WINDOW = 4
 
 
 def usage(message):
@@ -23,25 +37,72 @@ def usage(message):
     preceding message"""
     if message is not None:
         print(message)
-    usage_message = """Usage: get_slot_growth.py --wiki <wikidb> --host <hostname>
-  --interval <number> [--endrev <number>|max] [--minslots <number>] [--slotrole mediainfo|main]
- [--user <name>] [--verbose]| --help
+    usage_message = """Usage: get_slot_growth.py --wiki <wikidb>|--wikis <wikidb>,...|<dblist>
+  --host <hostname>|--hosts <hostname>,<hostname>...
+  --interval <number> [--endrev <number>|max] [--minslots <number>] [--slotrole <role>,<role>...]
+ [--grouped [--chunk <number>]] [--store <dir>] [--maxlag <secs>] [--maxlatency <secs>]
+ [--mindelay <secs>] [--maxdelay <secs>] [--user <name>] [--verbose]| --help
+
+Results are written as one line of json per interval, smallest rev first; with
+more than one wiki or slot role, each line also has the wiki and slot role.
 
 Arguments:
 
   --wiki      (-w):   wikidb name which will be queried
                       default: commonswiki
+  --wikis     (-W):   comma-separated list of wikidb names, or the path to a file with
+                      one name per line (a dblist), to be used instead of --wiki; a
+                      value with a '/' in it must be an existing dblist file; the
+                      wikis are done one after the other, all with the same db creds and
+                      the same connection to each host, so they must all be on the host(s)
+                      default: none
   --host      (-h):   hostname of dbserver
                       default: none
+  --hosts     (-H):   comma-separated list of hostnames of dbservers with the same wiki db,
+                      to be used instead of --host; intervals (or chunks of them, with
+                      --grouped) are split up among the hosts, each running one query
+                      at a time, with a connection to each host
+                      default: none
   --interval  (-i):   number of revisions per query
                       default: 1 million
   --endrev    (-e):   biggest rev id to query, we start here. either a number or 'max'
                       default: max
-  --slotrole  (-s):   name of role of slots to check
+  --slotrole  (-s):   name of role of slots to check, or a comma-separated list of them;
+                      slots of all the roles are counted in the same queries
                       default: mediainfo
   --minslots  (-m):   continue until fewer than this number of slots of the specified type
-                      are found in an interval
+                      are found in an interval; with several slot roles, each role's results
+                      stop there, but queries go on until all of them do
+                      default: 0
+  --grouped   (-g):   count slots for many intervals at once with one GROUP BY query
+                      per chunk of intervals, streaming the rows back, instead of one
+                      COUNT(*) query per interval
+                      default: false
+  --chunk     (-c):   number of intervals per query, with --grouped
+                      default: 100
+  --store     (-S):   directory in which to keep results, one file per wiki, slot role and
+                      interval; if there are results from an earlier run, only the revs
+                      above the last full interval stored are queried, and the stored
+                      results are updated. the newest interval is shorter than the rest
+                      if there aren't enough new revs to fill it, and gets redone the
+                      next run. minslots only applies to the first run
+                      default: none, nothing is stored
+  --maxlag    (-l):   after each query on a host, we check its replication lag and
+                      how long the query took; if either is too high, the wait before
+                      the next query on that host is doubled, otherwise it is halved.
+                      this is the most replication lag in seconds that is ok. if the
+                      db user can't see the replication lag, a warning is given and
+                      only the query time is checked
+                      default: 10
+  --maxlatency (-L):  the longest in seconds that counting one interval may take and be
+                      ok; with --grouped, the time a query for a chunk of intervals takes
+                      is divided by the number of intervals in it before checking
+                      default: 60
+  --mindelay  (-d):   the shortest wait between queries on a host, in seconds
                       default: 0
+  --maxdelay  (-D):   the longest wait between queries on a host, in seconds; the
+                      first wait is 5 seconds
+                      default: 300
   --user      (-u):   shell user to sudo to for running script to get db creds, ugh
                       default: www-data
   --verbose   (-v):   display messages about files as they are created
@@ -57,20 +118,30 @@ Example uses:
 
 def get_args():
     """get command-line args and fill in default values"""
-    args = {'wiki': 'commonswiki',
+    args = {'wiki': None,
+            'wikis': None,
             'host': None,
+            'hosts': None,
             'interval': '1000000',
             'slotrole': 'mediainfo',
             'endrev': 'max',
             'minslots': '0',
+            'grouped': False,
+            'chunk': '100',
+            'store': None,
+            'maxlag': '10',
+            'maxlatency': '60',
+            'mindelay': '0',
+            'maxdelay': '300',
             'user': 'www-data',
             'verbose': False}
 
     try:
         (options, remainder) = getopt.gnu_getopt(
-            sys.argv[1:], "w:h:i:s:e:m:u:vh", [
-                "wiki=", "host=", "interval=", "slotrole=", "endrev=", "minslots=",
-                "user=", "verbose", "help"])
+            sys.argv[1:], "w:W:h:H:i:s:e:m:c:gS:l:L:d:D:u:vh", [
+                "wiki=", "wikis=", "host=", "hosts=", "interval=", "slotrole=", "endrev=",
+                "minslots=", "chunk=", "grouped", "store=", "maxlag=", "maxlatency=",
+                "mindelay=", "maxdelay=", "user=", "verbose", "help"])
 
     except getopt.GetoptError as err:
         usage("Unknown option specified: " + str(err))
@@ -78,8 +149,12 @@ def get_args():
     for (opt, val) in options:
         if opt in ["-w", "--wiki"]:
             args['wiki'] = val
+        elif opt in ["-W", "--wikis"]:
+            args['wikis'] = val
         elif opt in ["-h", "--host"]:
             args['host'] = val
+        elif opt in ["-H", "--hosts"]:
+            args['hosts'] = val
         elif opt in ["-i", "--interval"]:
             args['interval'] = val
         elif opt in ["-s", "--slotrole"]:
@@ -88,6 +163,20 @@ def get_args():
             args['endrev'] = val
         elif opt in ["-m", "--minslots"]:
             args['minslots'] = val
+        elif opt in ["-c", "--chunk"]:
+            args['chunk'] = val
+        elif opt in ["-g", "--grouped"]:
+            args['grouped'] = True
+        elif opt in ["-S", "--store"]:
+            args['store'] = val
+        elif opt in ["-l", "--maxlag"]:
+            args['maxlag'] = val
+        elif opt in ["-L", "--maxlatency"]:
+            args['maxlatency'] = val
+        elif opt in ["-d", "--mindelay"]:
+            args['mindelay'] = val
+        elif opt in ["-D", "--maxdelay"]:
+            args['maxdelay'] = val
         elif opt in ["-u", "--user"]:
             args['user'] = val
         elif opt in ["-v", "--verbose"]:
@@ -101,20 +190,70 @@ def get_args():
     return args
 
 
+def get_wikis(wiki, wikis):
+    """return the list of wikis to do: the one wiki, if given, or the
+    comma-separated list of wikis, or the wikis in the dblist file of that
+    name, skipping comments and blank lines; commonswiki if nothing is given"""
+    if wiki:
+        return [wiki]
+    if not wikis:
+        return ['commonswiki']
+    if not os.path.exists(wikis):
+        return [name for name in wikis.split(',') if name]
+    names = []
+    with open(wikis, "r") as infile:
+        for line in infile:
+            line = line.split('#')[0].strip()
+            if line:
+                names.append(line)
+    return names
+
+
 def validate_args(args):
     """validate args or whine and die"""
-    if not args['host']:
-        usage('Mandatory arg "host" was not specified')
+    if not args['host'] and not args['hosts']:
+        usage('Mandatory arg "host" or "hosts" was not specified')
+    if args['host'] and args['hosts']:
+        usage('Only one of the args "host" and "hosts" may be specified')
     if not args['endrev'].isdigit() and args['endrev'] != 'max':
         usage('Arg "endrev" must be a number or the value "max"')
     if not args['interval'].isdigit():
         usage('Arg "interval" must be a number')
     if not args['minslots'].isdigit():
         usage('Arg "minslots" must be a number')
+    if not args['chunk'].isdigit() or not int(args['chunk']):
+        usage('Arg "chunk" must be a positive number')
+    for name in ['maxlag', 'maxlatency', 'mindelay', 'maxdelay']:
+        if not args[name].isdigit():
+            usage('Arg "{name}" must be a number'.format(name=name))
+        args[name] = int(args[name])
+    if args['mindelay'] > args['maxdelay']:
+        usage('Arg "mindelay" must be no bigger than "maxdelay"')
+    if args['wiki'] and args['wikis']:
+        usage('Only one of the args "wiki" and "wikis" may be specified')
+    if args['wikis'] and '/' in args['wikis'] and not os.path.exists(args['wikis']):
+        # wiki names never have a slash, so this is a dblist path with a typo
+        usage('Arg "wikis" looks like a dblist file but there is no such file')
+    if args['store'] and not os.path.isdir(args['store']):
+        usage('Arg "store" must be an existing directory')
     if args['endrev'].isdigit():
         args['endrev'] = int(args['endrev'])
     args['interval'] = int(args['interval'])
     args['minslots'] = int(args['minslots'])
+    args['chunk'] = int(args['chunk'])
+    args['wikis'] = get_wikis(args['wiki'], args['wikis'])
+    if not args['wikis']:
+        usage('No wikis found in arg "wikis"')
+    args['slotroles'] = []
+    for role in args['slotrole'].split(','):
+        if role and role not in args['slotroles']:
+            args['slotroles'].append(role)
+    if not args['slotroles']:
+        usage('Arg "slotrole" must have at least one role')
+    if args['hosts']:
+        args['hosts'] = [host for host in args['hosts'].split(',') if host]
+    else:
+        args['hosts'] = [args['host']]
 
 
 def get_creds(wiki, shelluser, verbose):
@@ -203,168 +342,504 @@ def get_starting_rev(endrev, db_cursor, verbose):
     return int(rev_ids[0])
 
 
-def get_rev_query(start_rev):
-    """return a query to get the fields we want for the slot range"""
-    return "SELECT rev_id, rev_timestamp FROM revision WHERE rev_id = {revid};".format(
-        revid=start_rev)
-
-
-def do_rev_query(query, db_cursor, revid, verbose):
-    """run a query designed to get the rev id and timestamp, return them if there,
-    or None if no entries, which is weird but can happen"""
+def get_boundary_revs_query(revs):
+    """return a query to get, for each of the given rev ids, the first revision
+    at or after it (some could be missing, example: revid 359704594), looking
+    no further than MAX_REV_SKIP revs ahead; one row per rev id that has such
+    a revision, with the rev id we asked about first"""
+    subqueries = []
+    for rev in revs:
+        subqueries.append(
+            "(SELECT {rev}, rev_id, rev_timestamp FROM revision "
+            "WHERE rev_id >= {rev} AND rev_id <= {maxrev} "
+            "ORDER BY rev_id LIMIT 1)".format(rev=rev, maxrev=rev + MAX_REV_SKIP))
+    return " UNION ALL ".join(subqueries) + ";"
+
+
+def get_rev_timestamps_for_end_intervals(revs, db_cursor, verbose):
+    """get the rev id and timestamp for the largest revision of each interval,
+    given the rev ids where the intervals end, with one query for all of them;
+    if a rev is missing, the next one that exists is used instead.
+    returns a dict of rev id passed in and rev info"""
+    if not revs:
+        return {}
+    query = get_boundary_revs_query(revs)
     try:
         if verbose:
             print(query)
         db_cursor.execute(query.encode('utf-8'))
     except MySQLdb.Error as ex:
-        raise MySQLdb.Error("failed to get rev timestamp for {{revid}} ({errno}:{message})".format(
-            errno=ex.args[0], message=ex.args[1])) from None
-    rev_rows = db_cursor.fetchall()
-    if not rev_rows:
-        return None
-    rev_info = []
-    for rev_row in rev_rows:
+        raise MySQLdb.Error(
+            "failed to get rev timestamps for {first}..{last} ({errno}:{message})".format(
+                first=revs[0], last=revs[-1], errno=ex.args[0], message=ex.args[1])) from None
+    rev_infos = {}
+    for rev_row in db_cursor.fetchall():
         if not rev_row:
             break
-        rev_info.append({'rev_id': rev_row[0], 'rev_timestamp': rev_row[1]})
-    if len(rev_info) != 1:
-        raise MySQLdb.Error("expected one rev timestamp entry, found {count} for {revid})".format(
-            count=len(rev_info), revid=revid)) from None
-    return rev_info[0]
+        rev_infos[int(rev_row[0])] = {'rev_id': rev_row[1], 'rev_timestamp': rev_row[2]}
+    for rev in revs:
+        if rev not in rev_infos:
+            raise MySQLdb.Error(
+                "can't get rev timestamp for {rev} or any of the {count} revs after it".format(
+                    rev=rev, count=MAX_REV_SKIP)) from None
+    return rev_infos
 
 
 def get_rev_timestamp_for_end_interval(rev, db_cursor, verbose):
     """get the timestamp for the largest revision, in some cases it could be missing
-    so be prepared to decrement and keep trying until we find one. example: revid 359704594"""
-    done = False
-    count = 0
-    while not done:
-        query = get_rev_query(rev)
-        rev_info = do_rev_query(query, db_cursor, rev, verbose)
-        if rev_info:
-            done = True
-        else:
-            rev += 1
-            count += 1
-            if count > 100:
-                raise MySQLdb.Error("can't get rev timestamp for {rev} after 100 tries".format(
-                    rev=rev)) from None
-    return rev_info
+    so use the next one that exists instead. example: revid 359704594"""
+    return get_rev_timestamps_for_end_intervals([rev], db_cursor, verbose)[rev]
 
 
-def get_slots_query(start_rev, interval, slot_role_id):
-    """return a query to get the fields we want for the slot range"""
-    query = "SELECT count(*) FROM slots"
+def get_slots_query(start_rev, interval, slot_role_ids):
+    """return a query to get the fields we want for the slot range,
+    one row with the role id and count for each role with slots in it"""
+    query = "SELECT slot_role_id, count(*) FROM slots"
     minrev = start_rev - interval
     if minrev < 1:
         minrev = 1
-    cond = " WHERE slot_revision_id > {minrev} AND slot_revision_id <= {maxrev} AND slot_role_id = {roleid}".format(
-        minrev=minrev, maxrev=start_rev, roleid=slot_role_id)
-    return query + cond
+    cond = " WHERE slot_revision_id > {minrev} AND slot_revision_id <= {maxrev}".format(
+        minrev=minrev, maxrev=start_rev)
+    roles = " AND slot_role_id IN ({roleids})".format(
+        roleids=",".join(str(roleid) for roleid in slot_role_ids))
+    return query + cond + roles + " GROUP BY slot_role_id"
 
 
 def do_slots_query(query, db_cursor, rev, verbose):
-    """get slot count for the query covering some revision interval"""
+    """get slot counts for the query covering some revision interval,
+    as a dict of role id and count; roles with no slots are left out"""
     try:
         if verbose:
             print(query)
         db_cursor.execute(query.encode('utf-8'))
     except MySQLdb.Error as ex:
-        raise MySQLdb.Error("failed to get rev timestamp for {{revid}} ({errno}:{message})".format(
-            errno=ex.args[0], message=ex.args[1])) from None
+        raise MySQLdb.Error("failed to get slot counts for {revid} ({errno}:{message})".format(
+            revid=rev, errno=ex.args[0], message=ex.args[1])) from None
     slot_rows = db_cursor.fetchall()
-    if not slot_rows:
-        return None
-    slot_info = []
+    counts = {}
     for slot_row in slot_rows:
         if not slot_row:
             break
-        slot_info.append({'slot_increment': slot_row[0], 'slot_rev_id': rev})
-    if len(slot_info) != 1:
-        raise MySQLdb.Error("expected one entry with slot count, found {count} for {revid})".format(
-            count=len(slot_info), revid=rev)) from None
-    return slot_info[0]
+        counts[int(slot_row[0])] = slot_row[1]
+    return counts
 
 
-def get_slot_id(db_cursor, slot_role, verbose):
-    """get and return the slot id for the given role or None if not found"""
-    query = "SELECT role_id from slot_roles where role_name = '{role}';".format(
-        role=slot_role)
+def get_grouped_slots_query(start_rev, interval, first, last, slot_role_ids):
+    """return a query to get slot counts for each of the intervals numbered first
+    through last, counting down from start_rev (interval 0 ends at start_rev),
+    as rows of interval number, role id and count; intervals with no slots for
+    a role have no row for it"""
+    maxrev = start_rev - first * interval
+    minrev = start_rev - (last + 1) * interval
+    if minrev < 1:
+        minrev = 1
+    query = ("SELECT FLOOR(({start_rev} - slot_revision_id) / {interval}) AS bucket, "
+             "slot_role_id, count(*) FROM slots".format(start_rev=start_rev, interval=interval))
+    cond = " WHERE slot_revision_id > {minrev} AND slot_revision_id <= {maxrev}".format(
+        minrev=minrev, maxrev=maxrev)
+    roles = " AND slot_role_id IN ({roleids})".format(
+        roleids=",".join(str(roleid) for roleid in slot_role_ids))
+    return query + cond + roles + " GROUP BY bucket, slot_role_id ORDER BY bucket"
+
+
+def do_grouped_slots_query(query, db_cursor, verbose):
+    """run a grouped slot count query on an unbuffered cursor, reading the
+    rows as they come in, and return a dict of interval number and a dict
+    of role id and count"""
     try:
         if verbose:
             print(query)
         db_cursor.execute(query.encode('utf-8'))
+        counts = {}
+        for row in db_cursor:
+            counts.setdefault(int(row[0]), {})[int(row[1])] = row[2]
     except MySQLdb.Error as ex:
-        raise MySQLdb.Error("exception getting slot id for role {role} ({errno}:{message})".format(
-            role=slot_role, errno=ex.args[0], message=ex.args[1])) from None
+        raise MySQLdb.Error("failed to get grouped slot counts ({errno}:{message})".format(
+            errno=ex.args[0], message=ex.args[1])) from None
+    return counts
+
+
+def get_slot_ids(db_cursor, slot_roles, verbose):
+    """get and return a dict of role name and slot id for the given roles,
+    whining if any of them is not found"""
+    query = "SELECT role_name, role_id from slot_roles where role_name IN ({roles});".format(
+        roles=",".join("'{role}'".format(role=role) for role in slot_roles))
+    try:
+        if verbose:
+            print(query)
+        db_cursor.execute(query.encode('utf-8'))
+    except MySQLdb.Error as ex:
+        raise MySQLdb.Error(
+            "exception getting slot ids for roles {roles} ({errno}:{message})".format(
+                roles=",".join(slot_roles), errno=ex.args[0], message=ex.args[1])) from None
     roleid_rows = db_cursor.fetchall()
-    role_ids = []
+    role_ids = {}
     for roleid_row in roleid_rows:
         if not roleid_row:
             break
-        role_ids.append(roleid_row[0])
-    if len(role_ids) != 1:
-        raise MySQLdb.Error("expected one entry with role id, found {count})".format(
-            count=len(role_ids))) from None
-    return int(role_ids[0])
+        role_name = roleid_row[0]
+        if isinstance(role_name, bytes):
+            role_name = role_name.decode('utf-8')
+        role_ids[role_name] = int(roleid_row[1])
+    for role in slot_roles:
+        if role not in role_ids:
+            raise MySQLdb.Error("expected one entry with role id for {role}, found none".format(
+                role=role)) from None
+    return role_ids
+
+
+def get_hosts(args):
+    """get db creds, connect to each host, returning a list of dicts, one per
+    host, with the host name, a cursor and the throttle settings for the host;
+    the same creds and connections are used for all the wikis"""
+    dbcreds = get_creds(args['wikis'][0], args['user'], args['verbose'])
+    hosts = []
+    for host in args['hosts']:
+        hosts.append({'name': host,
+                      'cursor': get_cursor(host, dbcreds['wgDBuser'], dbcreds['wgDBpassword']),
+                      'delay': min(max(INITIAL_DELAY, args['mindelay']), args['maxdelay']),
+                      'not_before': 0,
+                      'lag_query': None})
+    return hosts
+
+
+def get_replication_lag(host, verbose):
+    """return the number of seconds the host is behind its primary, or None if
+    it isn't replicating or we can't tell. newer servers want SHOW REPLICA
+    STATUS and call the column Seconds_Behind_Source, older ones only know
+    about SHOW SLAVE STATUS and Seconds_Behind_Master; the first one that works
+    is remembered for the host. if neither works, usually because the db user
+    doesn't have the REPLICATION CLIENT privilege, that is remembered too, and
+    we complain about it once"""
+    if host['lag_query'] is False:
+        return None
+    queries = [host['lag_query']] if host['lag_query'] else LAG_QUERIES
+    errors = []
+    for query in queries:
+        try:
+            if verbose:
+                print(query)
+            host['cursor'].execute(query.encode('utf-8'))
+        except MySQLdb.Error as ex:
+            errors.append(str(ex))
+            continue
+        host['lag_query'] = query
+        rows = host['cursor'].fetchall()
+        if not rows or not rows[0]:
+            return None
+        columns = [column[0] for column in host['cursor'].description]
+        for column in ['Seconds_Behind_Source', 'Seconds_Behind_Master']:
+            if column in columns and rows[0][columns.index(column)] is not None:
+                return int(rows[0][columns.index(column)])
+        return None
+    host['lag_query'] = False
+    sys.stderr.write("can't get replication lag for {host} ({errors}), throttling "
+                     "queries on it by latency only\n".format(
+                         host=host['name'], errors="; ".join(errors)))
+    return None
+
+
+def update_throttle(args, host, latency):
+    """given how long the last job on the host took per interval in it, check
+    the host's replication lag and set the delay before the next job: if the
+    lag or the latency are over their limits the delay is doubled, up to
+    maxdelay, and otherwise it is halved, down to mindelay; return the new delay"""
+    lag = get_replication_lag(host, args['verbose'])
+    if (lag is not None and lag > args['maxlag']) or latency > args['maxlatency']:
+        delay = min(max(host['delay'] * 2, 1), args['maxdelay'])
+    else:
+        delay = host['delay'] / 2
+        if delay < 1:
+            delay = 0
+        delay = max(delay, args['mindelay'])
+    if args['verbose']:
+        print("host", host['name'], "has lag", lag,
+              "and latency {latency:.2f} per interval,".format(latency=latency),
+              "delay now", delay)
+    host['delay'] = delay
+    return delay
+
+
+def get_growth_entries(args, db_cursor, slot_ids, start_rev, first, last):
+    """get information on growth of slots for the intervals numbered first
+    through last, counting down from start_rev, with one grouped query
+    for all of them if we are grouping and one query per interval if not;
+    return as a list with largest revid first, with slot counts as a dict
+    of role id and count"""
+    if args['grouped']:
+        # rows from the big grouped queries are streamed back rather than buffered
+        # on our end; all other queries go through the regular cursor
+        stream_cursor = db_cursor.connection.cursor(MySQLdb.cursors.SSCursor)
+        query = get_grouped_slots_query(start_rev, args['interval'], first, last, slot_ids)
+        counts = do_grouped_slots_query(query, stream_cursor, args['verbose'])
+        stream_cursor.close()
+    else:
+        counts = {}
+        for interval in range(first, last + 1):
+            rev = start_rev - interval * args['interval']
+            query = get_slots_query(rev, args['interval'], slot_ids)
+            counts[interval] = do_slots_query(query, db_cursor, rev, args['verbose'])
+
+    revs = [start_rev - interval * args['interval'] for interval in range(first, last + 1)]
+    rev_infos = get_rev_timestamps_for_end_intervals(revs, db_cursor, args['verbose'])
+
+    entries = []
+    for interval, rev in enumerate(revs, first):
+        rev_info = rev_infos[rev]
+        entry = {'revid': rev_info['rev_id'],
+                 'timestamp': rev_info['rev_timestamp'].decode('utf-8'),
+                 'slotcounts': {slot_id: counts.get(interval, {}).get(slot_id, 0)
+                                for slot_id in slot_ids},
+                 'boundary': rev}
+        if args['verbose']:
+            print("revinfo is", rev_info, "and slotcounts are", entry['slotcounts'])
+        entries.append(entry)
+    return entries
+
+
+def get_chunk_entries(args, host, slot_ids, start_rev, first, last):
+    """get information on growth of slots for the intervals numbered first
+    through last on the host, then update the host's throttle and note when
+    the next query may go to it; the delay is not waited out here, so that
+    the entries are handed back as soon as we have them"""
+    started = time.time()
+    entries = get_growth_entries(args, host['cursor'], slot_ids, start_rev, first, last)
+    # a job with a chunk of intervals is expected to take longer
+    # than one with a single interval
+    delay = update_throttle(args, host, (time.time() - started) / (last - first + 1))
+    host['not_before'] = time.time() + delay
+    return entries
+
+
+def get_ready_host(idle_hosts, now):
+    """remove and return the idle host with the shortest delay out of those
+    whose wait since their last query is over, or None if there is none"""
+    ready = [host for host in idle_hosts if host['not_before'] <= now]
+    if not ready:
+        return None
+    host = min(ready, key=lambda host: host['delay'])
+    idle_hosts.remove(host)
+    return host
+
+
+def get_slot_growth(args, hosts, slot_ids, start_rev, stop_rev=0):
+    """get information on growth of slots for the given role ids in the
+    current wikidb, for intervals counting down from start_rev, until we get
+    to stop_rev if it's set and otherwise until we find no more than minslots
+    slots of any of the roles in an interval; return as a list with largest
+    revid first
+
+    intervals are handed out one at a time, or one chunk at a time if we
+    are grouping, to whichever host is free, so each host runs one query
+    at a time, and put back in order as they come in; a slow chunk holds up
+    only its own host, not the handing out of later chunks to the others,
+    unless they get REORDER_WINDOW chunks per host ahead of it. after each
+    query on a host, it gets nothing more for a while that depends on how busy
+    the host is, so a busy host doesn't hold up the results it already has"""
+    interval_count = (start_rev - stop_rev - 1) // args['interval'] + 1
+    step = args['chunk'] if args['grouped'] else 1
+    chunks = [(first, min(first + step, interval_count) - 1)
+              for first in range(0, interval_count, step)]
+    if not chunks:
+        # no revs at all, or none above stop_rev
+        return []
+
+    idle_hosts = list(hosts)
+    results = []
+    window = REORDER_WINDOW * len(hosts)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+        # future and (chunk number, host) of the chunks being worked on
+        running = {}
+        # entries for chunks that are done but not yet added to the results
+        finished = {}
+        next_chunk = 0
+        next_result = 0
+        done = False
+        while not done:
+            now = time.time()
+            while next_chunk < len(chunks) and next_chunk - next_result < window:
+                host = get_ready_host(idle_hosts, now)
+                if host is None:
+                    break
+                future = executor.submit(get_chunk_entries, args, host, slot_ids, start_rev,
+                                         *chunks[next_chunk])
+                running[future] = (next_chunk, host)
+                next_chunk += 1
+            # if there's more to hand out but the idle hosts are still waiting
+            # because we are nice, wake up when the first of them is done waiting
+            timeout = None
+            if idle_hosts and next_chunk < len(chunks) and next_chunk - next_result < window:
+                timeout = max(min(host['not_before'] for host in idle_hosts) - now, 0)
+            if not running:
+                time.sleep(timeout)
+                continue
+            completed, _pending = concurrent.futures.wait(
+                list(running), timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in completed:
+                chunk, host = running.pop(future)
+                idle_hosts.append(host)
+                finished[chunk] = future.result()
+            while not done and next_result in finished:
+                for entry in finished.pop(next_result):
+                    results.append(entry)
+                    if not stop_rev and max(entry['slotcounts'].values()) <= args['minslots']:
+                        done = True
+                        break
+                next_result += 1
+                if next_result == len(chunks):
+                    done = True
 
+    return results
 
-def get_slot_growth(args):
-    """get information on growth of slots for the given
-    role and wikidb, return as a list with largest revid first"""
-    results = []
 
-    dbcreds = get_creds(args['wiki'], args['user'], args['verbose'])
-    db_cursor = get_cursor(args['host'], dbcreds['wgDBuser'], dbcreds['wgDBpassword'])
-    use_db(db_cursor, args['wiki'])
+def get_partial_interval(args, db_cursor, slot_ids, start_rev, stop_rev):
+    """get information on growth of slots for the one interval from stop_rev
+    up to start_rev, shorter than the usual interval, marked as partial"""
+    rev_info = get_rev_timestamp_for_end_interval(start_rev, db_cursor, args['verbose'])
+    query = get_slots_query(start_rev, start_rev - stop_rev, slot_ids)
+    counts = do_slots_query(query, db_cursor, start_rev, args['verbose'])
+    return {'revid': rev_info['rev_id'],
+            'timestamp': rev_info['rev_timestamp'].decode('utf-8'),
+            'slotcounts': {slot_id: counts.get(slot_id, 0) for slot_id in slot_ids},
+            'boundary': start_rev,
+            'partial': True}
+
+
+def split_by_role(entries, slot_ids, minslots):
+    """given slot growth entries with counts for several roles, return a dict
+    of role name and a list of entries for just that role, each list stopping
+    at the first interval with no more than minslots slots for the role, if
+    minslots is not None"""
+    results = {}
+    for role, slot_id in slot_ids.items():
+        results[role] = []
+        for entry in entries:
+            role_entry = {'revid': entry['revid'],
+                          'timestamp': entry['timestamp'],
+                          'slotcount': entry['slotcounts'][slot_id],
+                          'boundary': entry['boundary']}
+            if entry.get('partial'):
+                role_entry['partial'] = True
+            results[role].append(role_entry)
+            if minslots is not None and role_entry['slotcount'] <= minslots:
+                break
+    return results
 
-    slot_id = get_slot_id(db_cursor, args['slotrole'], args['verbose'])
 
-    done = False
-    start_rev = get_starting_rev(args['endrev'], db_cursor, args['verbose'])
-    while not done:
-        rev_info = get_rev_timestamp_for_end_interval(start_rev, db_cursor, args['verbose'])
+def get_store_path(args, wiki, role):
+    """return the path of the file in the results store for the wiki,
+    slot role and interval size"""
+    return os.path.join(args['store'], "{wiki}-{role}-{interval}.jsonl".format(
+        wiki=wiki, role=role, interval=args['interval']))
 
-        query = get_slots_query(start_rev, args['interval'], slot_id)
-        slot_info = do_slots_query(query, db_cursor, start_rev, args['verbose'])
 
-        if args['verbose']:
-            print("revinfo is", rev_info, "and slotinfo is", slot_info)
+def read_stored_growth(path):
+    """read and return slot growth results saved by a previous run, as a list
+    with largest revid first, or an empty list if there are none; a partial
+    interval at the top is left out so that it gets redone in full"""
+    if not os.path.exists(path):
+        return []
+    results = []
+    with open(path, "r") as infile:
+        for line in infile:
+            if line.strip():
+                results.append(json.loads(line))
+    results.reverse()
+    if results and results[0].get('partial'):
+        results.pop(0)
+    return results
 
-        entry = {'revid': rev_info['rev_id'],
-                 'timestamp': rev_info['rev_timestamp'].decode('utf-8'),
-                 'slotcount': slot_info['slot_increment']}
-
-        results.append(entry)
-        start_rev = start_rev - args['interval']
-        if start_rev < 1:
-            done = True
-        elif entry['slotcount'] <= args['minslots']:
-            done = True
-        else:
-            # sleep a lot between queries because we are nice
-            time.sleep(5)
 
+def write_stored_growth(path, results):
+    """save slot growth results, smallest revid first, replacing any
+    that are there already"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as outfile:
+        for entry in reversed(results):
+            outfile.write(json.dumps(entry) + "\n")
+    os.replace(tmp_path, path)
+
+
+def get_wiki_slot_growth(args, wiki, hosts, slot_ids, start_rev):
+    """get information on growth of slots for the given roles in the current
+    wikidb, returning a dict of role name and a list of results for the role
+    with largest revid first. all roles with the same revs still to do are
+    counted together in one scan.
+
+    if there is a results store, results in it from a previous run for the
+    wiki, slot role and interval are reused, and only revs above the last
+    full interval stored are queried, in full intervals going up from there
+    and one partial interval at the top; the store is updated with the new
+    results"""
+    stored = {}
+    for role in slot_ids:
+        if args['store']:
+            stored[role] = read_stored_growth(get_store_path(args, wiki, role))
+        else:
+            stored[role] = []
+
+    # roles to do, by the rev we can stop at (0 if nothing is stored)
+    todo = {}
+    for role in slot_ids:
+        stop_rev = stored[role][0]['boundary'] if stored[role] else 0
+        todo.setdefault(stop_rev, {})[role] = slot_ids[role]
+
+    results = {}
+    for stop_rev, todo_ids in todo.items():
+        if not stop_rev:
+            entries = get_slot_growth(args, hosts, list(todo_ids.values()), start_rev)
+            results.update(split_by_role(entries, todo_ids, args['minslots']))
+            continue
+        entries = []
+        if start_rev > stop_rev:
+            top_rev = stop_rev + (start_rev - stop_rev) // args['interval'] * args['interval']
+            if start_rev > top_rev:
+                entries.append(get_partial_interval(
+                    args, hosts[0]['cursor'], list(todo_ids.values()), start_rev, top_rev))
+            if top_rev > stop_rev:
+                entries.extend(get_slot_growth(
+                    args, hosts, list(todo_ids.values()), top_rev, stop_rev))
+        for role, role_entries in split_by_role(entries, todo_ids, None).items():
+            results[role] = role_entries + stored[role]
+
+    if args['store']:
+        for role in slot_ids:
+            write_stored_growth(get_store_path(args, wiki, role), results[role])
     return results
 
 
-def display_slot_growth(results):
+def display_slot_growth(results, wiki=None, role=None):
     """given a mess of slot growth results, display it in
-    some nice way"""
+    some nice way, labelled with the wiki and slot role if given"""
     # we eventually want two files for graphing purposes:
     # timestamp vs # revs
     # timestamp vs total number slots
     # we write json of each entry smallest to largest rev so it's easy for other scripts to parse
     for entry in reversed(results):
-        print(json.dumps(entry))
+        output = {field: entry[field] for field in ['revid', 'timestamp', 'slotcount']}
+        if wiki is not None:
+            output['wiki'] = wiki
+            output['slotrole'] = role
+        print(json.dumps(output))
 
 
 def do_main():
     """entry point"""
     args = get_args()
     validate_args(args)
-    results = get_slot_growth(args)
-    display_slot_growth(results)
+    hosts = get_hosts(args)
+    labelled = len(args['wikis']) > 1 or len(args['slotroles']) > 1
+    for wiki in args['wikis']:
+        for host in hosts:
+            use_db(host['cursor'], wiki)
+        slot_ids = get_slot_ids(hosts[0]['cursor'], args['slotroles'], args['verbose'])
+        start_rev = get_starting_rev(args['endrev'], hosts[0]['cursor'], args['verbose'])
+        results = get_wiki_slot_growth(args, wiki, hosts, slot_ids, start_rev)
+        for role in args['slotroles']:
+            if labelled:
+                display_slot_growth(results[role], wiki, role)
+            else:
+                display_slot_growth(results[role])
 
 
 if __name__ == '__main__':
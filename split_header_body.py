@@ -0,0 +1,255 @@
+#!/usr/bin/python3
+"""
+Given a compressed xml dump file, split out the header, body and
+footer into three separate files, like split-em.sh does, but
+decompressing the input only once and compressing the pieces in
+parallel while the input is being read.
+
+The output can instead be written as a single file with the header
+in one gzip member (or bz2 stream), the body in as many members as
+it takes, and the footer in one member, along with its member index,
+so that offset_test.py can recombine it without scanning it.
+"""
+import bz2
+import getopt
+import gzip
+import sys
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import offset_test
+import pzcat
+
+
+DEFAULT_JOBS = 4
+# uncompressed size in MB of each member of the body
+DEFAULT_CHUNKSIZE = 64
+COMPRESS_LEVEL = 6
+HEADER_END = b'</siteinfo>'
+# the header of a real dump is a few KB at most; if we've read this much
+# without finding the end of it, this isn't a dump
+MAX_HEADER_SIZE = 1024 * 1024
+DUMP_START = b'<mediawiki'
+FOOTER_START = b'</mediawiki>'
+
+
+def compress_member(data, file_format):
+    """compress the data as one gzip member or bz2 stream, return the compressed
+    data, along with the crc that the member index will want for it"""
+    if file_format == 'bz2':
+        compressed = bz2.compress(data, 9)
+        return compressed, offset_test.get_bz2_stream_crc(compressed)
+    return gzip.compress(data, COMPRESS_LEVEL, mtime=0), zlib.crc32(data)
+
+
+class MemberWriter():
+    '''
+    write data to a file as a series of gzip members or bz2 streams,
+    compressing them in a pool of processes and writing them in order,
+    and keep track of the members for the member index
+    '''
+    def __init__(self, filename, executor, jobs, chunksize):
+        self.filename = filename
+        self.file_format = 'bz2' if filename.endswith('.bz2') else 'gz'
+        self.outfile = open(filename, "wb")
+        self.executor = executor
+        self.jobs = jobs
+        self.chunksize = chunksize
+        self.buffer = []
+        self.buffered = 0
+        self.pending = deque()
+        self.members = []
+        self.offset = 0
+
+    def add(self, data):
+        '''
+        add data to the current member, starting a new one every chunksize bytes
+        '''
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.chunksize:
+            self.end_member()
+
+    def end_member(self):
+        '''
+        send everything buffered off to be compressed as one member
+        '''
+        if not self.buffered:
+            return
+        data = b''.join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        while len(self.pending) >= 2 * self.jobs:
+            self.write_next()
+        self.pending.append((self.executor.submit(compress_member, data, self.file_format),
+                             len(data)))
+
+    def write_next(self):
+        '''
+        wait for the oldest member to be compressed and write it out
+        '''
+        future, usize = self.pending.popleft()
+        compressed, crc = future.result()
+        self.outfile.write(compressed)
+        self.members.append({'offset': self.offset, 'csize': len(compressed),
+                             'usize': usize, 'crc': crc})
+        self.offset += len(compressed)
+
+    def close(self):
+        '''
+        write out everything that's left, close the file and write its member index
+        '''
+        self.end_member()
+        while self.pending:
+            self.write_next()
+        self.outfile.close()
+        offset_test.write_member_index(self.filename, self.members)
+
+
+class XmlSplitter():
+    '''
+    split a stream of xml into header (through the line with </siteinfo>),
+    body, and footer (from the line with </mediawiki>), sending each
+    to its writer as the data comes in
+    '''
+    def __init__(self, header_writer, body_writer, footer_writer):
+        self.writers = {'header': header_writer, 'body': body_writer, 'footer': footer_writer}
+        self.state = 'header'
+        self.carry = b''
+
+    def feed(self, data):
+        '''
+        process the next piece of the stream
+        '''
+        data = self.carry + data
+        self.carry = b''
+        if self.state == 'header':
+            index = data.find(HEADER_END)
+            newline = data.find(b'\n', index) if index >= 0 else -1
+            if newline < 0:
+                if len(data) > MAX_HEADER_SIZE:
+                    raise ValueError("no {marker} line found in the first {size} bytes of "
+                                     "input, is this really an xml dump?".format(
+                                         marker=HEADER_END.decode('utf-8'), size=MAX_HEADER_SIZE))
+                # keep it all until we have the end of the header
+                self.carry = data
+                return
+            if not data.lstrip().startswith(DUMP_START):
+                raise ValueError("input does not start with {marker}, is this really "
+                                 "an xml dump?".format(marker=DUMP_START.decode('utf-8')))
+            self.writers['header'].add(data[:newline + 1])
+            self.writers['header'].end_member()
+            self.state = 'body'
+            data = data[newline + 1:]
+        if self.state == 'body':
+            index = data.find(FOOTER_START)
+            if index < 0:
+                # hang on to the last partial line, it might be where the footer starts
+                last_newline = data.rfind(b'\n')
+                self.carry = data[last_newline + 1:]
+                if last_newline >= 0:
+                    self.writers['body'].add(data[:last_newline + 1])
+                return
+            line_start = data.rfind(b'\n', 0, index) + 1
+            if line_start:
+                self.writers['body'].add(data[:line_start])
+            self.writers['body'].end_member()
+            self.state = 'footer'
+            data = data[line_start:]
+        self.writers['footer'].add(data)
+
+    def finish(self):
+        '''
+        make sure we saw the whole thing and wrap up the footer
+        '''
+        if self.state != 'footer':
+            raise ValueError("no {marker} line found in input".format(
+                marker=(HEADER_END if self.state == 'header' else FOOTER_START).decode('utf-8')))
+        self.writers['footer'].end_member()
+
+
+def split_file(infile, outfile, jobs=DEFAULT_JOBS, chunksize=DEFAULT_CHUNKSIZE * 1024 * 1024,
+               single=False):
+    """split the header, body and footer of the input file into header-<outfile>,
+    <outfile> and footer-<outfile>, or, if single is True, into gzip members
+    (or bz2 streams) of outfile. decompressing and compressing share one pool
+    of jobs processes"""
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        if single:
+            writer = MemberWriter(outfile, executor, jobs, chunksize)
+            writers = [writer, writer, writer]
+        else:
+            writers = [MemberWriter("header-" + outfile, executor, jobs, chunksize),
+                       MemberWriter(outfile, executor, jobs, chunksize),
+                       MemberWriter("footer-" + outfile, executor, jobs, chunksize)]
+        splitter = XmlSplitter(*writers)
+        pzcat.decompress_file(infile, splitter.feed, jobs, executor=executor)
+        splitter.finish()
+        for writer in writers:
+            if not writer.outfile.closed:
+                writer.close()
+
+
+def usage(message=None):
+    """display usage message for this script with an optional
+    preceding message, and exit"""
+    if message is not None:
+        sys.stderr.write(message + "\n")
+    usage_message = """Usage: python3 split_header_body.py [--jobs <number>] [--chunksize <number>]
+                                  [--single] inputfile outputfile
+
+Split the header (everything through the line with </siteinfo>), the body, and the
+footer (everything from the line with </mediawiki>) out of a gzipped or bz2-compressed
+xml dump file, writing them to header-<outputfile>, <outputfile> and footer-<outputfile>.
+The input is decompressed once and the outputs are compressed in parallel as it is read.
+Output files ending in .bz2 are bz2-compressed; all others are gzipped.
+
+Arguments:
+  --jobs       (-j):   number of processes to use for decompressing and compressing
+                       default: {jobs}
+  --chunksize  (-c):   size in MB of uncompressed body data to put into each gzip member
+                       or bz2 stream of the body
+                       default: {chunksize}
+  --single     (-s):   write header, body and footer to outputfile as separate gzip
+                       members or bz2 streams, and write the member index that
+                       offset_test.py uses, so that it can be recombined without scanning
+                       default: false
+  --help       (-h):   display this usage message
+
+Example use:
+   python3 split_header_body.py -j 8 elwikt-20190108-stub-articles.xml.gz elwikt-body.xml.gz
+""".format(jobs=DEFAULT_JOBS, chunksize=DEFAULT_CHUNKSIZE)
+    sys.stderr.write(usage_message)
+    sys.exit(1)
+
+
+def do_main():
+    """entry point"""
+    jobs = DEFAULT_JOBS
+    chunksize = DEFAULT_CHUNKSIZE
+    single = False
+    try:
+        (options, filenames) = getopt.gnu_getopt(sys.argv[1:], "j:c:sh", [
+            "jobs=", "chunksize=", "single", "help"])
+    except getopt.GetoptError as err:
+        usage("Unknown option specified: " + str(err))
+    for (opt, val) in options:
+        if opt in ["-j", "--jobs"]:
+            if not val.isdigit() or not int(val):
+                usage("Arg 'jobs' must be a positive number")
+            jobs = int(val)
+        elif opt in ["-c", "--chunksize"]:
+            if not val.isdigit() or not int(val):
+                usage("Arg 'chunksize' must be a positive number")
+            chunksize = int(val)
+        elif opt in ["-s", "--single"]:
+            single = True
+        elif opt in ["-h", "--help"]:
+            usage()
+    if len(filenames) != 2:
+        usage()
+    split_file(filenames[0], filenames[1], jobs, chunksize * 1024 * 1024, single)
+
+
+if __name__ == '__main__':
+    do_main()
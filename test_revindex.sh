@@ -0,0 +1,58 @@
+#!/bin/bash
+
+# Check that revindex.py finds every revision in a small history file and
+# gets back exactly its xml, for the gz and bz2 versions of the file, built
+# serially and with 3 jobs. The compressed files are made of many members
+# (some only 6 bytes long) that are cut inside <revision> tags, just before
+# and inside revision ids, and elsewhere, so revisions whose start or id
+# runs into the next member, or the one after that, get looked up too.
+# testdata/history-sample.xml is the same content uncompressed.
+
+cd "$(dirname "$0")" || exit 1
+
+plain="testdata/history-sample.xml"
+
+workdir=$(mktemp -d) || exit 1
+trap 'rm -rf "$workdir"' EXIT
+
+failed=0
+for suffix in gz bz2; do
+    # member indexes get written next to the dump files, so work on copies
+    cp "${plain}.${suffix}" "${workdir}/" || exit 1
+    dumpfile="${workdir}/history-sample.xml.${suffix}"
+    for jobs in 1 3; do
+        index="${workdir}/${suffix}-${jobs}.idx"
+        python3 revindex.py --index "$index" --jobs "$jobs" "$dumpfile" 2> /dev/null || exit 1
+        if ! python3 - "$plain" "$index" <<'PYEOF'
+import re
+import sys
+import revindex
+
+with open(sys.argv[1], "rb") as infile:
+    expected = {int(match.group(1)): match.group(0).decode('utf-8') for match in
+                re.finditer(rb'<revision>\s*<id>(\d+)</id>.*?</revision>', infile.read(), re.DOTALL)}
+problems = 0
+for revid, revision_xml in expected.items():
+    try:
+        result = revindex.get_revision(sys.argv[2], revid, raw=True)
+    except ValueError as err:
+        result = str(err)
+    if result != revision_xml:
+        print("revision {revid}: got {result!r}".format(revid=revid, result=result[:200]))
+        problems += 1
+records = revindex.read_index_meta(sys.argv[2])['records']
+if records != len(expected):
+    print("indexed {records} revisions, expected {count}".format(
+        records=records, count=len(expected)))
+    problems += 1
+print("{count} revisions looked up, {problems} problems".format(
+    count=len(expected), problems=problems))
+sys.exit(1 if problems else 0)
+PYEOF
+        then
+            echo "FAILED: ${suffix}, ${jobs} jobs"
+            failed=1
+        fi
+    done
+done
+exit "$failed"